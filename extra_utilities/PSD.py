@@ -6,23 +6,24 @@ Computes the PSDs of the
 input files (either pickled or plain text) and returns
 the computed PSDs in a pickle format, with output file
 name 'input_name.psd'.
+PSDs are computed through Welch's method (see `pcat.condition.welch_psds`),
+all the input files with the same length at once.
 
 Daniele Trifiro`
 brethil@phy.olemiss.edu
 '''
 
-from matplotlib.mlab import psd
+from pcat.utils import *
 
-from data_conditioning import compute_psd
-
-from utilities_PCAT import *
+from pcat.condition import welch_psds
 
 
 def usage():
 	print "Usage:\t fft.py -s sampl_freq file1 file2 file3 ....\n"
 	print "\t Computes PSD at the desired resolution and returns pickled \".fft\" files."
 	print "\t Output is file1.fft, file2.fft, ..."
-	print "\tOutput is a properly normalized PSD, performed through matplotlib.mlab.psd."
+	print "\tOutput is a properly normalized PSD, computed through Welch's method"
+	print "\t(same normalization as matplotlib.mlab.psd)."
 	print "\t The density values are scaled by the so that the density is in units of Hz^-1"
 	print "\nOptions:"
 	print "\t-s sampl_freq, --sampling\n\t\tSampling frequency of the input files."
@@ -54,7 +55,7 @@ def check_options_and_args():
 	else:
 		try:
 			opts, args = getopt.getopt(sys.argv[1:], "s:po:", [ 'plot', 'ascii',
-			 							'out=', 'sampling=', '--overlap=' ] )
+			 							'out=', 'sampling=', 'overlap=' ] )
 		except getopt.error, msg:
 			print msg
 			sys.exit(1)
@@ -118,21 +119,24 @@ def __main__():
 	if ( n_files > 1 ):
 		bar = progressBar(minValue = 0, maxValue = n_files-1, totalWidth = 40 )
 		bar(0)
-	if PLOT:
-		import matplotlib
-		matplotlib.use('agg')
-		import matplotlib.pyplot as plt
-		 
-	for index, element in enumerate(input_data):
-		resolution = sampling_freq/(output_size)
-		freqs, PSD_estimate = compute_psd(element, resolution, sampling_freq, FOURIER_OVERLAP)
-		if ( PLOT ):
-			plot_transforms(freqs, PSD_estimate, args[index])
-		f = open( args[index]+".psd", "wb")
-		pickle.dump( PSD_estimate, f )
-		f.close()
-		if ( n_files > 1 ):
-			bar(index)
+	
+	resolution = sampling_freq/(output_size)
+	# Compute the PSDs of the files with the same length at once
+	lengths = [ len(element) for element in input_data ]
+	done = 0
+	for length in sorted(set(lengths)):
+		indexes = [ index for index in range(n_files) if ( lengths[index] == length ) ]
+		freqs, PSDs = welch_psds(np.array([ input_data[index] for index in indexes ]),
+									resolution, sampling_freq, FOURIER_OVERLAP)
+		for index, PSD_estimate in zip(indexes, PSDs):
+			if ( PLOT ):
+				plot_psd(freqs, PSD_estimate, args[index])
+			f = open( args[index]+".psd", "wb")
+			pickle.dump( PSD_estimate, f )
+			f.close()
+			if ( n_files > 1 ):
+				bar(done)
+			done += 1
 
 
 if __name__ == '__main__':
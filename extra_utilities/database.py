@@ -5,7 +5,8 @@
 
 This program is to be used to create databases to be used with GMM.py and
 PCA.py. A wide variety of inputs and outputs is supported, depending on the
-given options. For usage, run with -h.
+given options. Output databases are columnar databases (see
+`pcat.database`). For usage, run with -h.
 
 Daniele Trifiro`
 brethil@phy.olemiss.edu
@@ -13,7 +14,9 @@ brethil@phy.olemiss.edu
 ''' 
 from numpy import linalg
 
-from utilities_PCAT import *
+from pcat.utils import *
+from pcat.database import SpikeDatabase, DATABASE_EXTENSION, convert_legacy_database
+from pcat.database import load_database as load_pcat_database
 
 
 global frame_width
@@ -28,13 +31,13 @@ def usage():
 	
 	print "\tThis program is to be used to prepare data for use in GMM.py and\n\
 	PCA.py.\n\
-	Input type can be supplied through options. Output is a pickled file usable\n\
+	Input type can be supplied through options. Output is a database usable\n\
 	by GMM.py and PCA.py. Output name depends on the arguments:"
 	
-	print "\t\t\t> PCAT.py lists\t ---> \"merged_database.data\""
-	print "\t\t\t> Generic files\t\t ---> \"database.data\""
-	print "\t\t\t> Power Spectra lists\t ---> \"PSD_database.data\""
-	print "\t\t\t> Matrix file\t\t ---> \"matrix_database.data\""
+	print "\t\t\t> PCAT.py lists\t ---> \"merged_database.db\""
+	print "\t\t\t> Generic files\t\t ---> \"database.db\""
+	print "\t\t\t> Power Spectra lists\t ---> \"psd_database.db\""
+	print "\t\t\t> Matrix file\t\t ---> \"matrix_database.db\""
 	
 	print ""
 	print "#"*frame_width
@@ -44,6 +47,11 @@ def usage():
 	print "\t--merge\n\
 		Merge two or more databases into a single file.\n\
 		Databases are output from or from PCAT.py (or finder.py)."
+	
+	print "\t--convert\n\
+		Convert legacy databases ('.list' files, pickled lists of\n\
+		Spike() objects) to columnar databases. Each file is converted\n\
+		to a database with the same name and the '.db' extension."
 		
 	print "\t--psd\n\
 		Creates a database from a list of files (pickled arrays)\n\
@@ -85,7 +93,8 @@ def check_options_and_args():
 			opts, args = getopt.getopt( sys.argv[1:], "ho:s", [ 'help', 'ascii',
 			 											'output=', 'merge',
 														'psd', 'matrix',
-														'list', 'silent'] )
+														'list', 'silent',
+														'convert'] )
 		except getopt.error, msg:
 			print msg
 			sys.exit(1)
@@ -100,6 +109,8 @@ def check_options_and_args():
 				OUTPUT_NAME = a
 			elif o in ( '--merge' ):
 				INPUT = 'merge'
+			elif o in ( '--convert' ):
+				INPUT = 'convert'
 			elif o in ( '--matrix' ):
 				INPUT = 'matrix'
 			elif o in ( '--list' ):
@@ -111,7 +122,7 @@ def check_options_and_args():
 			else:
 				assert False, "Unknown option."
 	if not ( any( flag in o for flag in [ '--psd', '--matrix',
-	 									'--list', '--merge'] for o in opts) ):
+	 									'--list', '--merge', '--convert'] for o in opts) ):
 		print "Input options have to be specified.\n\tRun create_database.py with"
 		print "\tno options or \"-h\" or \"--help\" for a list of possible options." 
 		sys.exit(1)
@@ -125,9 +136,10 @@ def load_database(data):
 		Arguments: 
 			- data (list)
 				A list containing the filenames or paths of the files to be loaded.
+				Both columnar and legacy ('.list') databases can be loaded.
 		
 	'''
-	database = list()
+	databases = list()
 	n_files = len(data)
 	if not SILENT:
 		bar = progressBar(minValue = 0, maxValue = n_files-1 if n_files > 1 else 1, totalWidth = frame_width/2 )
@@ -135,12 +147,10 @@ def load_database(data):
 	for index, element in enumerate(data):
 		if not SILENT:
 			bar(index)
-		f = open(element, "rb")
-		database.extend( pickle.load(f) )
-		f.close()
+		databases.append( load_pcat_database(element) )
 	if not SILENT:
 		print ""
-	return database
+	return SpikeDatabase.concatenate(databases)
 
 
 def load_fft(data, pickled):
@@ -261,26 +271,33 @@ def __main__():
 	args = check_options_and_args()
 	if not SILENT:
 		print "Loading data and creating database..."
-	if ( INPUT == 'merge'):
+	if ( INPUT == 'convert' ):
+		for element in args:
+			output_name = convert_legacy_database(element)
+			if not SILENT:
+				print "Saved "+output_name
+		sys.exit(0)
+	elif ( INPUT == 'merge'):
 		database = load_database(args)
-		output_name = "merged_database.data"
+		output_name = "merged_database"
 	elif ( INPUT == 'matrix'):
 		database = load_matrix(args, PICKLED)
-		output_name = "matrix_database.data"
+		output_name = "matrix_database"
 	elif ( INPUT == 'fft'):
 		database = load_fft(args, PICKLED)
-		output_name = "psd_database.data"
+		output_name = "psd_database"
 	elif ( INPUT == 'list'):
 		database = load_list(args, PICKLED)
-		output_name = "database.data"
+		output_name = "database"
+	output_name += DATABASE_EXTENSION
 	print ""
 	if CUSTOM_OUTPUT:
 		output_name = OUTPUT_NAME
 	if not SILENT:
 		print "Saving "+output_name+"..."
-	output = open( output_name, "wb" )
-	pickle.dump( database, output )
-	output.close()
+	if not isinstance(database, SpikeDatabase):
+		database = SpikeDatabase.from_spikes(database)
+	database.save(output_name)
 	if not SILENT:
 		print "Done!"
 
@@ -0,0 +1,218 @@
+# encoding: utf-8
+'''
+cache.py
+
+Content-addressed cache of conditioned data.
+
+The conditioned data of each set of conditioning parameters (data source,
+channel, type of conditioning and all the options which change its output,
+see conditioning_parameters() in pcat) is stored in its own entry, a
+directory named after the hash of the parameters:
+	~/PCAT/Data/cache/
+		<key>/
+			parameters.json		->	Parameters the key was computed from
+			statistics.json		->	Hits and misses of the runs which used
+									the entry
+			last_used			->	Empty, its modification time is the
+									last time the entry was used
+			...					->	Conditioned data (e.g. a SegmentStore,
+									see `pcat.store`)
+
+Runs with different parameters never share conditioned data, runs with the
+same parameters reuse it, whatever interval they analyze (segments are
+identified by their GPS times).
+The cache has a maximum size: when it is exceeded the least recently used
+entries are removed (see ConditioningCache.evict()). Runs touch the entries
+they use while they are running, and entries used in the last
+CACHE_GRACE_SECONDS are never removed, so that concurrent runs do not remove
+each other's entries.
+
+	cache = ConditioningCache("~/PCAT/Data/cache/", max_bytes=50*1024**3)
+	key = cache.key(parameters)
+	directory = cache.entry(key, parameters)
+	...
+	cache.record_run(key, hits, misses)
+	cache.evict(keep=[key])
+
+Use pcat-cache to list the entries of a cache and to prune it.
+
+Contains:
+	- CACHE_VERSION, CACHE_MAX_BYTES, CACHE_GRACE_SECONDS
+	- ConditioningCache
+	- directory_size()
+'''
+
+import os
+import json
+import time
+import hashlib
+from shutil import rmtree
+
+# Changing the version invalidates all the entries (e.g. when the
+# conditioning changes)
+CACHE_VERSION = 1
+
+# Default maximum size of the cache
+CACHE_MAX_BYTES = 50*1024**3
+
+# Entries used more recently than this (in seconds) are never evicted
+CACHE_GRACE_SECONDS = 3600
+
+
+def directory_size(directory):
+	'''
+	Total size in bytes of the files in 'directory' (and its
+	subdirectories).
+	'''
+	size = 0
+	for path, directories, files in os.walk(directory):
+		for name in files:
+			try:
+				size += os.path.getsize(os.path.join(path, name))
+			except OSError:
+				# Removed while walking
+				pass
+	return size
+
+
+class ConditioningCache:
+	'''
+	Content-addressed cache of conditioned data, see the module docstring.
+
+	Attributes:
+		directory		->	Directory containing the entries
+		max_bytes		->	Maximum size of the cache (None for no limit)
+	'''
+
+	def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+		self.directory = os.path.join(os.path.expanduser(directory), "")
+		self.max_bytes = max_bytes
+
+	def key(self, parameters):
+		'''
+		Key of the entry for the given parameters (a dictionary of strings,
+		numbers and booleans).
+		'''
+		parameters = dict(parameters, cache_version=CACHE_VERSION)
+		return hashlib.sha1(json.dumps(parameters, sort_keys=True)).hexdigest()[:16]
+
+	def path(self, key):
+		'''
+		Directory of the entry.
+		'''
+		return os.path.join(self.directory, key, "")
+
+	def entry(self, key, parameters=None):
+		'''
+		Returns the directory of the entry, created if it does not exist,
+		and marks the entry as used.
+		'''
+		path = self.path(key)
+		if not os.path.isdir(path):
+			try:
+				os.makedirs(path)
+			except OSError:
+				# Created by another process
+				pass
+		if ( parameters is not None ) and not os.path.isfile(path + "parameters.json"):
+			self._write_json(path + "parameters.json", dict(parameters, cache_version=CACHE_VERSION))
+		self.touch(key)
+		return path
+
+	def touch(self, key):
+		'''
+		Marks the entry as used now.
+		'''
+		with open(self.path(key) + "last_used", "a"):
+			pass
+		os.utime(self.path(key) + "last_used", None)
+
+	def _write_json(self, file_name, data):
+		# Write to a temporary file and rename it, so that readers never see
+		# a partially written file
+		tmp_name = "{0}.{1}.tmp".format(file_name, os.getpid())
+		with open(tmp_name, "w") as f:
+			json.dump(data, f, sort_keys=True, indent=1)
+		os.rename(tmp_name, file_name)
+
+	def _read_json(self, file_name):
+		try:
+			with open(file_name) as f:
+				return json.load(f)
+		except (IOError, ValueError):
+			return {}
+
+	def record_run(self, key, hits, misses):
+		'''
+		Adds the hits and misses (segments which were/were not found in the
+		entry) of a run to the statistics of the entry.
+		'''
+		statistics = self._read_json(self.path(key) + "statistics.json")
+		statistics['runs'] = statistics.get('runs', 0) + 1
+		statistics['hits'] = statistics.get('hits', 0) + hits
+		statistics['misses'] = statistics.get('misses', 0) + misses
+		statistics['last_hits'], statistics['last_misses'] = hits, misses
+		self._write_json(self.path(key) + "statistics.json", statistics)
+		self.touch(key)
+
+	def entries(self):
+		'''
+		Returns a list of dictionaries describing the entries ('key',
+		'size', 'last_used', 'parameters' and 'statistics'), least recently
+		used first.
+		'''
+		entries = []
+		if not os.path.isdir(self.directory):
+			return entries
+		for key in os.listdir(self.directory):
+			path = self.path(key)
+			if not os.path.isdir(path):
+				continue
+			try:
+				last_used = os.path.getmtime(path + "last_used")
+			except OSError:
+				last_used = os.path.getmtime(path)
+			entries.append({ 'key': key, 'size': directory_size(path), 'last_used': last_used,
+							'parameters': self._read_json(path + "parameters.json"),
+							'statistics': self._read_json(path + "statistics.json") })
+		entries.sort(key=lambda entry: entry['last_used'])
+		return entries
+
+	def size(self):
+		'''
+		Total size of the cache in bytes.
+		'''
+		return directory_size(self.directory) if os.path.isdir(self.directory) else 0
+
+	def remove(self, key):
+		'''
+		Removes the entry.
+		'''
+		if os.path.isdir(self.path(key)):
+			rmtree(self.path(key), ignore_errors=True)
+
+	def evict(self, max_bytes=None, keep=(), older_than=None, grace=CACHE_GRACE_SECONDS):
+		'''
+		Removes the least recently used entries until the cache is not
+		larger than max_bytes (default is the maximum size of the cache),
+		and the entries not used in the last 'older_than' seconds (if
+		given). Entries in 'keep' and entries used in the last 'grace'
+		seconds (which may be in use by other runs) are never removed.
+		Returns the list of the removed entries (see entries()).
+		'''
+		if max_bytes is None:
+			max_bytes = self.max_bytes
+		entries = self.entries()
+		total = sum( entry['size'] for entry in entries )
+		removed = []
+		for entry in entries:
+			if ( entry['key'] in keep ) or ( entry['last_used'] >= time.time()-grace ):
+				continue
+			too_large = ( max_bytes is not None ) and ( total > max_bytes )
+			too_old = ( older_than is not None ) and ( entry['last_used'] < time.time()-older_than )
+			if not ( too_large or too_old ):
+				continue
+			self.remove(entry['key'])
+			total -= entry['size']
+			removed.append(entry)
+		return removed
@@ -26,14 +26,36 @@ Contains:
 		WHITENING_REMOVED_SECONDS_FACTOR  (float)
 			This is used to set the number of seconds replaced
 			with zeros to suppress high pass filter transients. 
+		RESAMPLE_METHOD (string)
+			Resampling method used by whiten(), 'polyphase', 'iir'
+			or 'auto'.
+	
+	Classes:
+		- ConditioningPlan
+		- PSDTracker
+		- StreamingFilter
 	
 	Functions:
+		- conditioning_plan()
+		- butter_coefficients()
+		- frequency_grid()
 		- high_pass_coefficients()
 		- high_pass_filter()
 		- low_pass_filter
 		- whiten()
+		- impulse_response_length()
 		- butterworth_band_pass()
+		- median_mean_average_segments()
+		- median_mean_average_counts()
+		- overlapping_segments()
+		- periodograms()
+		- median_mean_average()
 		- median_mean_average_psd()
+		- median_mean_average_energy()
+		- welch_windows()
+		- welch_psds()
+		- stft_psds()
+		- aggregate_psd()
 		- compute_psd()
 		- median_bias_factor()
 	
@@ -41,6 +63,7 @@ Contains:
 
 from scipy import signal, interpolate
 from pcat.utils import *
+from pcat import fft_backend
 
 
 #################### PARAMETER DEFINITIONS ####################
@@ -58,6 +81,15 @@ HIGH_PASS_ORDER = 4
 # High pass filter cutoff frequency
 HIGH_PASS_CUTOFF = 40.0
 
+# Maximum number of points transformed at once by welch_psds()
+WELCH_BATCH_POINTS = 2**18
+
+# Resampling method used by whiten(): 'polyphase' (zero-phase FIR filter,
+# any rational ratio, see `pcat.utils.polyphase_resample()`), 'iir'
+# (integer decimation, see `pcat.utils.decimate()`), or 'auto' ('iir' for
+# integer ratios, where it is faster, 'polyphase' otherwise)
+RESAMPLE_METHOD = 'auto'
+
 
 ###############################################################
 ################# END OF PARAMETER DEFINITIONS ################
@@ -75,6 +107,138 @@ HIGH_PASS_CUTOFF = 40.0
 # dt is the sampling period, df=1/(N*dt), N is the number of points
 # of s: N=len(s)
 
+# Filter coefficients, frequency grids and conditioning plans already
+# computed (see butter_coefficients(), frequency_grid() and
+# conditioning_plan())
+_butter_coefficients = {}
+_frequency_grids = {}
+_conditioning_plans = {}
+
+def butter_coefficients(order, cutoff, f_sampl, btype, output='ba'):
+	'''
+		Returns the (b, a) coefficients of a butterworth filter, see
+		scipy.signal.butter, or its second-order sections if output='sos'.
+		'cutoff' is a frequency, or a (low, high) tuple for band pass
+		filters.
+		Coefficients are designed once for each set of arguments.
+	'''
+	key = ( order, cutoff, f_sampl, btype, output )
+	if key not in _butter_coefficients:
+		nyquist_frequency = f_sampl/2.0
+		if isinstance(cutoff, tuple):
+			normalized_cutoff = [ frequency/nyquist_frequency for frequency in cutoff ]
+		else:
+			normalized_cutoff = cutoff/nyquist_frequency
+		_butter_coefficients[key] = signal.butter(order, normalized_cutoff, btype=btype, output=output)
+	return _butter_coefficients[key]
+
+
+def frequency_grid(n, f_sampl):
+	'''
+		Returns the frequencies of the rfft of a 'n' points long time
+		series sampled at 'f_sampl' (see rfftfreq()).
+		Frequency grids are computed once and shared: the returned array
+		is read-only.
+	'''
+	if ( n, f_sampl ) not in _frequency_grids:
+		frequencies = rfftfreq(n, d=1./f_sampl)
+		frequencies.flags.writeable = False
+		_frequency_grids[( n, f_sampl )] = frequencies
+	return _frequency_grids[( n, f_sampl )]
+
+
+class ConditioningPlan:
+	'''
+	Everything whiten() needs which only depends on the segment parameters
+	and not on the data, computed once and shared by all the segments with
+	the same parameters (see conditioning_plan()):
+	
+		plan = conditioning_plan(f_sampl, length, cutoff, order, resample_freq)
+		whitened = whiten(time_series, ..., plan=plan)
+	
+	Attributes:
+		f_sampl, length		->	Sampling frequency and number of points of
+								the input segments
+		resample_method		->	'polyphase' or 'iir' (see RESAMPLE_METHOD),
+								'auto' is replaced by the method used
+		resampling_factors	->	(up, down) factors of polyphase
+								resampling ((1, 1) if not resampling),
+								the FIR filter is designed once by
+								`pcat.utils.resampling_filter()`
+		downsample_factor	->	Decimation factor of 'iir' resampling (1
+								if not resampling), the decimation filter
+								is designed once by
+								`pcat.utils.decimation_filter()`
+		analysis_f_sampl	->	Sampling frequency after resampling
+		analysis_length		->	Number of points after resampling
+		fft_length			->	Number of points the resampled segment is
+								zero-padded to before whitening, the
+								first fast length not shorter than
+								analysis_length (see `pcat.fft_backend`)
+		highpass_filter		->	(b, a) butterworth coefficients
+		frequencies			->	rfft frequencies of the zero-padded segment
+		highpass_mask		->	True for the frequencies below the cutoff
+		psd_length			->	Points used for the 1 Hz resolution PSD,
+								its window and frequencies are cached by
+								median_mean_average_psd()
+	'''
+	def __init__(self, f_sampl, length, cutoff=HIGH_PASS_CUTOFF, order=HIGH_PASS_ORDER, resample_freq=None, resample_method=RESAMPLE_METHOD):
+		self.f_sampl = f_sampl
+		self.length = length
+		self.cutoff = cutoff
+		self.order = order
+		if ( resample_method == 'auto' ):
+			if ( resample_freq is not None ) and ( f_sampl % resample_freq == 0 ):
+				resample_method = 'iir'
+			else:
+				resample_method = 'polyphase'
+		self.resample_method = resample_method
+		
+		self.resampling_factors = ( 1, 1 )
+		self.downsample_factor = 1
+		self.analysis_f_sampl = f_sampl
+		self.analysis_length = length
+		if ( resample_freq is not None ) and ( f_sampl > resample_freq ):
+			self.analysis_f_sampl = resample_freq
+			if ( resample_method == 'iir' ):
+				self.downsample_factor = int(f_sampl/resample_freq)
+				decimation_filter(self.downsample_factor, 8)
+				self.analysis_length = -(-length//self.downsample_factor)
+			else:
+				up, down = resampling_factors(f_sampl, resample_freq)
+				self.resampling_factors = ( up, down )
+				resampling_filter(up, down)
+				self.analysis_length = -(-length*up//down)
+		
+		self.highpass_filter = butter_coefficients(order, cutoff, self.analysis_f_sampl, 'highpass')
+		
+		self.fft_length = fft_backend.fast_length(self.analysis_length)
+		self.frequencies = frequency_grid(self.fft_length, self.analysis_f_sampl)
+		self.highpass_mask = self.frequencies < cutoff
+		self.highpass_mask.flags.writeable = False
+		
+		self.psd_length = int(self.analysis_f_sampl + 0.5)
+		hanning_window(self.psd_length)
+		frequency_grid(self.psd_length, self.analysis_f_sampl)
+
+
+def conditioning_plan(f_sampl, length, cutoff=HIGH_PASS_CUTOFF, order=HIGH_PASS_ORDER, resample_freq=None, resample_method=RESAMPLE_METHOD):
+	'''
+		Returns the ConditioningPlan for segments 'length' points long
+		sampled at 'f_sampl', high-passed at 'cutoff' with a butterworth
+		filter of order 'order' and resampled to 'resample_freq' (None for
+		no resampling) with 'resample_method'.
+		Plans are created once for each set of parameters, each worker
+		process shares them between all of its segments.
+	'''
+	if ( resample_freq is not None ) and not ( f_sampl > resample_freq ):
+		resample_freq = None
+	key = ( f_sampl, length, cutoff, order, resample_freq, resample_method )
+	if key not in _conditioning_plans:
+		_conditioning_plans[key] = ConditioningPlan(f_sampl, length, cutoff, order, resample_freq, resample_method)
+	return _conditioning_plans[key]
+
+
 def usage():
 	'''
 		Usage
@@ -199,7 +363,7 @@ def high_pass_coefficients(frequencies, cutoff, f_sampl, order):
 	nyquist_frequency = f_sampl/2.0
 	
 	# Compute the coefficients:
-	b, a = signal.butter(order, cutoff/nyquist_frequency, btype='highpass')
+	b, a = butter_coefficients(order, cutoff, f_sampl, 'highpass')
 		
 	frequencies = (frequencies/nyquist_frequency)*np.pi
 	w, h = signal.freqz(b, a, worN=frequencies)
@@ -223,10 +387,8 @@ def high_pass_filter(time_series, cutoff, f_sampl, order):
 		Output:
 			- high_passed_time_series (array)
 	'''
-	nyquist_frequency = f_sampl/2.0
-	
 	# Compute the coefficients:
-	b,a = signal.butter(order, cutoff/nyquist_frequency, btype='highpass')
+	b, a = butter_coefficients(order, cutoff, f_sampl, 'highpass')
 	
 	# Apply zero phase filter using filtfilt (forward-backward linear phase 
 	# filter)
@@ -251,17 +413,15 @@ def low_pass_filter(time_series, cutoff, f_sampl, order):
 		Output:
 			- high_passed_time_series (array)
 	'''
-	nyquist_frequency = f_sampl/2.0
-	
 	# Compute the coefficients:
-	b,a = signal.butter(order, cutoff/nyquist_frequency, btype='low')
+	b, a = butter_coefficients(order, cutoff, f_sampl, 'low')
 	
 	filtered_time_series = signal.filtfilt(b, a, time_series)
 	
 	return filtered_time_series
 
 
-def whiten(time_series, excluded_seconds, f_sampl, resample_freq, highpass=True, highpass_cutoff=HIGH_PASS_CUTOFF, resample=True):
+def whiten(time_series, excluded_seconds, f_sampl, resample_freq, highpass=True, highpass_cutoff=HIGH_PASS_CUTOFF, resample=True, plan=None, spectra=False, psd_tracker=None, start_time=None, resample_method=RESAMPLE_METHOD, resampler=None, fused=False):
 	'''
 		Whitens the input time series.
 		
@@ -282,6 +442,26 @@ def whiten(time_series, excluded_seconds, f_sampl, resample_freq, highpass=True,
 		
 		Outputs the whitened (and high-passed, if requested) time series.
 		
+		Filter designs, windows and frequency grids are taken from the
+		ConditioningPlan for the input parameters (see conditioning_plan()),
+		so that they are only computed for the first segment.
+		
+		If fused=True, the time domain high pass filter is skipped: the
+		high pass is only applied in the frequency domain, together with
+		the whitening coefficients, so that the time series is transformed
+		once and transformed back once. The PSD is estimated on the
+		(Hann-windowed) sub-segments of the time series which is not
+		high-passed, and the excluded seconds are tapered instead of being
+		replaced with zeros. The result is equivalent to the default one
+		as long as the power below the high pass cutoff does not leak
+		into the PSD estimate above it, i.e. for data which is not
+		dominated by low frequency noise (see 'benchmark.py --whitening'
+		in extra_utilities for a comparison).
+		The fused whitening requires highpass=True (ValueError is raised
+		otherwise): without the high pass the default whitening estimates
+		the PSD of the filtered time series, restoring the power below the
+		cutoff, which the fused one cannot reproduce.
+		
 		Arguments:
 			- time_series (array)
 				Time series to be whitened
@@ -294,54 +474,106 @@ def whiten(time_series, excluded_seconds, f_sampl, resample_freq, highpass=True,
 				Sampling frequency for the input time series.
 			- highpass (boolean, optional, default=True)
 				True for high-pass filtering.
+			- highpass_cutoff (float, optional, default=HIGH_PASS_CUTOFF)
+				Cutoff frequency of the high pass filter, used both for the
+				time domain filter and for the whitening coefficients.
+				Note: the time domain filter used to ignore this argument
+				and always use HIGH_PASS_CUTOFF (40 Hz), so outputs for
+				other cutoffs differ from those of older versions.
 			- resample (boolean, optional, default=True)
 				Downsample the data to ANALYSIS_FREQUENCY if True.
+			- resample_method (string, optional, default=RESAMPLE_METHOD)
+				'polyphase', 'iir' or 'auto'.
+			- resampler (StreamingResampler, optional)
+				If given (with start_time), segments are resampled as a
+				stream, see `pcat.utils.StreamingResampler`.
+			- fused (boolean, optional, default=False)
+				Apply the high pass filter in the frequency domain only.
+			- plan (ConditioningPlan, optional)
+				Plan to be used instead of conditioning_plan()'s.
+			- spectra (boolean, optional, default=False)
+				Also return the spectral products of the whitening.
+			- psd_tracker (PSDTracker, optional)
+				If given (with start_time, the GPS start time of the time
+				series), the PSD is estimated over the tracker's look-back
+				instead of on the time series alone.
 		
 		Output: 
 			- whitened_time_series (numpy array)
 				The whitened (and high-passed, if requested) 
 				time series.
+			- spectra (dictionary, only if spectra=True)
+				Spectral products on the frequencies of the PSD estimate
+				(1 Hz resolution), so that they do not have to be estimated
+				again from the whitened time series:
+					'frequencies'	->	Frequencies
+					'psd'			->	PSD of the (high-passed) time
+										series used for whitening
 		
 	'''
 	
+	if fused and not highpass:
+		raise ValueError("The fused whitening requires highpass=True.")
+	
+	if plan is None:
+		plan = conditioning_plan(f_sampl, len(time_series), highpass_cutoff, HIGH_PASS_ORDER,
+									resample_freq if resample else None, resample_method)
+	
 	# If requested and if necessary, resample the signal to ANALYSIS_FREQUENCY
 	# (defined at the top of this document)
 	
-	if ( resample and (f_sampl > resample_freq) ):
-		downsample_factor = int(f_sampl/resample_freq)
-		time_series = decimate(time_series, downsample_factor)
-		
-		# Update sampling frequency to the new value
-		f_sampl = resample_freq
+	if ( plan.downsample_factor > 1 ):
+		time_series = decimate(time_series, plan.downsample_factor)
+	elif ( plan.resampling_factors != ( 1, 1 ) ):
+		if ( resampler is not None ) and ( start_time is not None ):
+			time_series = resampler.resample(time_series, int(round(start_time*f_sampl)))
+		else:
+			time_series = polyphase_resample(time_series, *plan.resampling_factors)
 		
+	# Update sampling frequency to the new value
+	f_sampl = plan.analysis_f_sampl
 	
 	time_series_duration = len(time_series)
-	x_axis = np.arange(time_series_duration)
-	high_passed_time_series = high_pass_filter(time_series, HIGH_PASS_CUTOFF, f_sampl, HIGH_PASS_ORDER)
-	
 	# FIXME: Having 0.05 is horrible. Try to find a decent way to do this
 	removed_points = int(0.05*excluded_seconds*f_sampl)
-	# Suppress high pass filter transients by replacing slices at the beginning 
-	# and the end of the segment with zeros
-	high_passed_time_series[0:removed_points] = 0.0
-	high_passed_time_series[-removed_points:] = 0.0
+	if fused:
+		# The high pass is applied with the whitening coefficients below,
+		# taper the edges to avoid leakage from the discontinuity at the
+		# edges of the segment
+		high_passed_time_series = np.array(time_series, dtype=np.float64)
+		taper = hanning_window(2*removed_points)[0]
+		high_passed_time_series[:removed_points] *= taper[:removed_points]
+		high_passed_time_series[-removed_points:] *= taper[removed_points:]
+	else:
+		b, a = plan.highpass_filter
+		high_passed_time_series = signal.filtfilt(b, a, time_series)
+		
+		# Suppress high pass filter transients by replacing slices at the beginning 
+		# and the end of the segment with zeros
+		high_passed_time_series[0:removed_points] = 0.0
+		high_passed_time_series[-removed_points:] = 0.0
 	
 	
 	# Take the FFT of the input time series,
 	# accounting for the correct normalization
+	# The time series is zero-padded to a fast length (see the
+	# ConditioningPlan), the normalization is the one of the original
+	# length
 	delta_t = (1./f_sampl)
-	transform = delta_t * np.fft.rfft(high_passed_time_series)
-	transform_len = len(transform)
-	delta_f = 1./(delta_t*len(transform))
-	
-	# Set the frequency resolution of the PSD (1 Hz)
-	bin_hz = 1.0
-	fft_length = int(f_sampl/bin_hz + 0.5)
-	# Compute PSD using the median mean average PSD Algorithm
+	transform = delta_t * fft_backend.rfft(high_passed_time_series, n=plan.fft_length)
+	transform_len = time_series_duration//2 + 1
+	delta_f = 1./(delta_t*transform_len)
+	
+	# Compute PSD using the median mean average PSD Algorithm, with the
+	# frequency resolution of the plan (1 Hz)
 	# Cut the first and last "excluded_seconds" to avoid ringing artifacts
-	frequencies, PSD_estimate = median_mean_average_psd( high_passed_time_series[removed_points:-removed_points], fft_length, f_sampl )
-	# Create frequency array to be used for interpolation
-	frequencies_to_interpolate = rfftfreq( time_series_duration, d=delta_t )
+	if ( psd_tracker is not None ) and ( start_time is not None ):
+		frequencies, PSD_estimate = psd_tracker.update( high_passed_time_series[removed_points:-removed_points],
+											start_time + removed_points/float(f_sampl), f_sampl, plan.psd_length )
+	else:
+		frequencies, PSD_estimate = median_mean_average_psd( high_passed_time_series[removed_points:-removed_points], plan.psd_length, f_sampl )
+	# Frequency array to be used for interpolation
+	frequencies_to_interpolate = plan.frequencies
 	
 	# Interpolate the estimated PSD to a higher resolution, in order to have a
 	# spectrum of the same resolution of the transformed time series
@@ -367,8 +599,7 @@ def whiten(time_series, excluded_seconds, f_sampl, resample_freq, highpass=True,
 	# to highpass the time series if requested.
 	if highpass:
 		# Replace all bins with frequencies less than highpass cutoff with zeros
-		x_tmp = np.arange(len(coefficients))
-		coefficients = np.where(frequencies_to_interpolate < highpass_cutoff, 0.0, coefficients)
+		coefficients = np.where(plan.highpass_mask, 0.0, coefficients)
 		
 		"""
 		# High pass filter frequency domain coefficients
@@ -381,14 +612,106 @@ def whiten(time_series, excluded_seconds, f_sampl, resample_freq, highpass=True,
 	# transformed time series spectrum where each fequency bin is
 	# weighted by the computed coefficients
 	# Multiply by delta_f to obtain the correctly normalized result. 
-	whitened_time_series = np.real( 2.0 * delta_f * np.fft.irfft(transform*coefficients) )
+	whitened_time_series = np.real( 2.0 * delta_f * fft_backend.irfft(transform*coefficients, n=plan.fft_length)[:time_series_duration] )
 	
 	# The returned whitened time series normalization and units depend on the 
 	# choice of the whitened coefficients, see the above definition for the 
 	# coefficients.
 	
 	#NORMALIZATION VERIFIED 8 Sep 2014
-	return whitened_time_series
+	if not spectra:
+		return whitened_time_series
+	
+	spectra = {
+		'frequencies' : frequencies,
+		'psd'         : PSD_estimate,
+	}
+	return whitened_time_series, spectra
+
+
+def impulse_response_length(sos, tolerance=1e-6):
+	'''
+		Number of points after which the impulse response of the filter
+		given by the second-order sections 'sos' has decayed, i.e. the
+		energy left in the rest of the response is less than 'tolerance'
+		times its total energy.
+		This is the length of the transients at the edges of a filtered
+		time series.
+	'''
+	length = 1024
+	while True:
+		impulse = np.zeros(length)
+		impulse[0] = 1.0
+		energy = np.cumsum( signal.sosfilt(sos, impulse)[::-1]**2 )[::-1]
+		# Energy left after each point, relative to the total energy
+		decayed = np.nonzero( energy <= tolerance*energy[0] )[0]
+		if ( decayed.size != 0 ) and ( energy[-1] <= tolerance*energy[0] ):
+			return int(decayed[0])
+		length *= 2
+
+
+class StreamingFilter:
+	'''
+	Zero-phase filtering (as scipy.signal.sosfiltfilt) of a stream of
+	contiguous (or overlapping) segments, in GPS order:
+	
+		streaming_filter = StreamingFilter(sos)
+		filtered = streaming_filter.filter(time_series, start_sample)
+	
+	where start_sample is the GPS start time of the segment times the
+	sampling frequency.
+	
+	The forward pass is run only once on each sample: its state is carried
+	from one segment to the next one, so that there are no transients at
+	the start of the segments (apart from the first one, or after a gap).
+	The backward pass is run on each segment, its transient only affects
+	the last 'lookahead' points of the segment (by default the length of
+	the impulse response, see impulse_response_length()). Segments thus
+	only need to be padded by 'lookahead' points, instead of by the
+	several seconds needed to discard the filtfilt transients.
+	'''
+	
+	def __init__(self, sos, lookahead=None):
+		self.sos = sos
+		if lookahead is None:
+			lookahead = impulse_response_length(sos)
+		self.lookahead = lookahead
+		# Steady-state response to a step, used to initialize the filters
+		self.initial_state = signal.sosfilt_zi(sos)
+		self.reset()
+	
+	def reset(self):
+		# Forward-filtered samples of the last segment, starting at
+		# buffer_start, and filter state at the end of the buffer
+		self.buffer = None
+		self.buffer_start = None
+		self.state = None
+	
+	def filter(self, time_series, start_sample):
+		'''
+			Returns the zero-phase filtered time series.
+		'''
+		time_series = np.asarray(time_series, dtype=np.float64)
+		start_sample = int(start_sample)
+		end_sample = start_sample + len(time_series)
+		
+		if ( self.buffer is None ) or not ( self.buffer_start <= start_sample <= self.buffer_start+len(self.buffer) ):
+			# First segment, gap in the data or segment out of order
+			self.reset()
+			forward, self.state = signal.sosfilt(self.sos, time_series, zi=self.initial_state*time_series[0])
+			self.buffer, self.buffer_start = forward, start_sample
+		else:
+			buffer_end = self.buffer_start+len(self.buffer)
+			# Samples already filtered by the forward pass
+			forward = self.buffer[start_sample-self.buffer_start:end_sample-self.buffer_start]
+			if ( end_sample > buffer_end ):
+				new, self.state = signal.sosfilt(self.sos, time_series[buffer_end-start_sample:], zi=self.state)
+				forward = np.concatenate( (forward, new) )
+				self.buffer, self.buffer_start = forward, start_sample
+		
+		# Backward pass, initialized with the steady state for the last point
+		backward = signal.sosfilt(self.sos, forward[::-1], zi=self.initial_state*forward[-1])[0]
+		return backward[::-1]
 
 
 def butterworth_band_pass(time_series, order, f_high, f_low, f_sampl):
@@ -410,12 +733,138 @@ def butterworth_band_pass(time_series, order, f_high, f_low, f_sampl):
 				The filtered time series.
 		
 	'''
-	nyquist_frequency = f_sampl/2.0
-	[b,a] = signal.butter(order, [frequency/(nyquist_frequency) for frequency in (f_high, f_low)], btype='band');
+	b, a = butter_coefficients(order, (f_high, f_low), f_sampl, 'band')
 	filtered_time_series = signal.filtfilt(b, a, time_series)
 	return filtered_time_series
 
 
+def median_mean_average_segments(time_series, step):
+	'''
+		Sub-segments used by the median-mean-average estimators.
+		
+		The i-th sub-segment starts at (i+1)*(step/2) and is 'step' points
+		long (sub-segments overlap by 50%), sub-segments shorter than 'step'
+		are excluded. Sub-segments with even i are the "odd" set, those with
+		odd i the "even" set.
+		
+		Output:
+			(segments, Ns, Ns_odd, Ns_even) (tuple)
+				- segments (array)
+					Read-only strided view of time_series with one sub-segment
+					per row (no data is copied), only the rows used by
+					median_mean_average() are included.
+				- Ns, Ns_odd, Ns_even (integers)
+					Total number of sub-segments and number of sub-segments
+					in the odd and even sets.
+	'''
+	signal_length = len(time_series)
+	
+	if ( 2*signal_length//step > 1):
+		Ns =  2*signal_length//step - 1
+	else:
+		Ns = 1
+	Ns_odd, Ns_even = median_mean_average_counts(Ns)
+	
+	# Rows needed for the odd (i = 0, 2, ...) and even (i = 1, 3, ...) sets
+	rows = max(2*Ns_odd-1, 2*Ns_even)
+	segments = overlapping_segments(time_series, step)[:rows]
+	return segments, Ns, Ns_odd, Ns_even
+
+
+def median_mean_average_counts(Ns):
+	'''
+		Number of sub-segments in the odd and even sets used by
+		median_mean_average() out of 'Ns' sub-segments: (Ns_odd, Ns_even).
+	'''
+	Ns_odd =  (Ns+1) // 2 
+	Ns_even = (Ns-1) // 2 
+	
+	if ( Ns_odd % 2 == 0 ):
+		Ns_odd -= 1
+	elif ( Ns_even > 1 ):
+		Ns_even -= 1
+	return Ns_odd, Ns_even
+
+
+def overlapping_segments(time_series, step):
+	'''
+		Read-only strided view (no data is copied) of all the 'step' points
+		long, 50% overlapping sub-segments of time_series, one per row. The
+		i-th row starts at (i+1)*(step/2).
+	'''
+	time_series = np.ascontiguousarray(time_series)
+	signal_length = len(time_series)
+	half_step = step//2
+	if ( half_step > 0 ) and ( signal_length >= half_step+step ):
+		rows = (signal_length-step)//half_step
+	else:
+		rows = 0
+	
+	item_size = time_series.itemsize
+	return np.lib.stride_tricks.as_strided(time_series[half_step:], shape=(rows, step),
+											strides=(half_step*item_size, item_size), writeable=False)
+
+
+def periodograms(segments, f_sampl):
+	'''
+		Hann-windowed periodograms (one-sided PSDs) of the rows of
+		'segments', all computed with a single (batched) FFT. The
+		normalization is the one used by median_mean_average_psd().
+	'''
+	step = np.shape(segments)[-1]
+	
+	# Window and window_normalization, which is used to correctly
+	# normalize the periodogram (both computed once for each step)
+	window, window_normalization = hanning_window(step)
+	
+	delta_t = 1./f_sampl
+	delta_f = f_sampl/float(step)
+	
+	# Compute the periodograms, |delta_t * rfft|^2, of all the sub-segments
+	# at once (squaring real and imaginary parts is faster than np.abs)
+	# (the windowed sub-segments are written to the same scratch array for
+	# all the segments with the same number of sub-segments)
+	windowed = fft_backend.scratch("periodograms", np.shape(segments))
+	np.multiply(segments, window, out=windowed)
+	transform = fft_backend.rfft(windowed, axis=-1)
+	Pxx = transform.real**2
+	Pxx += transform.imag**2
+	del transform
+	# Apply correct normalization (from FINDCHIRP paper):
+	# Since we used rfft, we have to multiply
+	# the result by 2 because rfft returns a one-sided version 
+	# (only positive frequencies) of the FFT and multiply by delta_f
+	# to obtain the correct units.
+	Pxx *= ( delta_t**2 * ( 2.0 * delta_f )/(window_normalization) ) 
+	# Fix normalization in the DC bin
+	Pxx[..., 0] /= 2.0
+	
+	# Units are now counts^2 Hz^-1
+	return Pxx
+
+
+def median_mean_average(values, Ns, Ns_odd, Ns_even):
+	'''
+		Median-mean-average of the values computed for each sub-segment
+		(rows of 'values', see median_mean_average_segments()): the median
+		of the odd and even sets are taken separately, the estimate is their
+		weighted average (corrected for the median bias factor).
+	'''
+	odd_median = np.median( values[0::2][:Ns_odd], axis=0 )
+	even_median = np.median( values[1::2][:Ns_even], axis=0 )
+	
+	# If there's only one segment (or no even segments), then the estimate
+	# is just the median of the odd segments, otherwise it is the weighted
+	# average
+	if ( Ns == 1 ) or ( Ns_even == 0 ):
+		return odd_median
+	even_weight = Ns_even/median_bias_factor(Ns_even)
+	odd_weight =  Ns_odd/median_bias_factor(Ns_odd)
+	estimate = even_median*even_weight + odd_median*odd_weight
+	estimate /= float( Ns_even + Ns_odd)
+	return estimate
+
+
 def median_mean_average_psd(time_series, segment_length, f_sampl):
 	''' 
 		PSD estimation through the median-mean-average algorithm.
@@ -435,7 +884,9 @@ def median_mean_average_psd(time_series, segment_length, f_sampl):
 		with odd segments), in the following weighted average the correlations 
 		won't matter as much. This is makes the algorithm less biased by loud glitches.
 		
-		The PSDs for each small subsegment is computed through matpotlib.mlab.psd
+		The sub-segments are taken as a strided view of the time series (see
+		median_mean_average_segments()) and all their PSDs are computed with
+		a single (batched) FFT.
 		
 		More info about the median-mean-average algorithm can be found 
  		in the FINDCHIRP Paper (qc/0509116)
@@ -461,157 +912,336 @@ def median_mean_average_psd(time_series, segment_length, f_sampl):
 		
 	'''
 	
-	signal_length = len(time_series)
-	even_psd_list = []
-	odd_psd_list = []
 	step = segment_length
+	segments, Ns, Ns_odd, Ns_even = median_mean_average_segments(time_series, step)
 	
-	if ( 2*signal_length//step > 1):
-		Ns =  2*signal_length//step - 1
-	else:
-		Ns = 1
-	Ns_odd =  (Ns+1) // 2 
-	Ns_even = (Ns-1) // 2 
-	
-	
-	
-	if ( Ns_odd % 2 == 0 ):
-		Ns_odd -= 1
-	elif ( Ns_even > 1 ):
-		Ns_even -= 1
+	# Frequencies array to return at the end
+	freqs = frequency_grid(step, f_sampl)
 	
-	current_bin = 0
+	Pxx = periodograms(segments, f_sampl)
+	PSD_estimate = median_mean_average(Pxx, Ns, Ns_odd, Ns_even)
 	
-	# Create window and compute window_normalization, which is used
-	# to correctly normalize the periodogram
-	window = np.hanning(step)
-	window_normalization = np.sum(window**2)/float(step)
+	return freqs, PSD_estimate
+
+
+class PSDTracker:
+	'''
+	Running PSD estimate over the last 'lookback' seconds of data, shared by
+	consecutive segments (in GPS order) so that the PSD used for whitening
+	is estimated on a longer baseline than a single segment.
+	
+		tracker = PSDTracker(128)
+		freqs, PSD = tracker.update(time_series, start_time, f_sampl, step)
+	
+	update() only computes the periodograms (see periodograms()) of the
+	sub-segments of the time series which have not been seen yet, e.g. the
+	padding shared with the previous segment is not transformed again.
+	Sub-segments are identified by their GPS start time, which is on the
+	same (step/2) grid for segments starting at integer GPS times.
+	
+	The median-mean-average (see median_mean_average()) of the new
+	sub-segments is computed once, the estimate is the average of these
+	(weighted by the number of sub-segments) over the look-back. Medians
+	are thus only taken over a few sub-segments at a time, while loud
+	glitches are still suppressed in each block of data.
+	'''
 	
-	# Create frequencies array to return at the end
-	delta_t = 1./f_sampl
-	delta_f = f_sampl/float(step)
-	freqs = rfftfreq(step, d=delta_t)
-	
-	for i in range(Ns):
-		ioff = i/2
-		current_bin += step/2
-		
-		to_transform = time_series[current_bin:current_bin+step]
-		
-		# Exclude the last segment if its size is less than step
-		if ( len(to_transform) < step):
-			continue
-		
-		# Compute periodogram and apply correct normalization:
-		# Since we used rfft, we have to multiply
-		# the result by 2 because rfft returns a one-sided version 
-		# (only positive frequencies) of the FFT and multiply by delta_f
-		# to obtain the correct units.
-		Pxx = np.abs( delta_t * np.fft.rfft(to_transform*window) )**2
-		# Apply correct normalization (from FINDCHIRP paper)
-		Pxx *= ( ( 2.0 * delta_f )/(window_normalization) ) 
-		# Fix normalization in the DC bin
-		Pxx[0] /= 2.0
-		
-		# Units are now counts^2 Hz^-1
-		
-		# Assign PSD to the correct bin	
-		if ( i % 2 == 0 ):
-			if ( ioff >= Ns_odd ):
-				continue
-			odd_psd_list.append( Pxx )
-			
-		else:
-			if ( ioff >= Ns_even ):
-				continue
-			even_psd_list.append( Pxx )
+	def __init__(self, lookback):
+		self.lookback = lookback
+		self.reset(None, None)
+	
+	def reset(self, f_sampl, step):
+		self.f_sampl = f_sampl
+		self.step = step
+		# Start sample (GPS time times f_sampl) of the sub-segments seen
+		self.keys = set()
+		# (last start sample, PSD, number of sub-segments) for each update
+		self.blocks = []
+	
+	def update(self, time_series, start_time, f_sampl, step):
+		'''
+			Adds the time series starting at GPS 'start_time' and returns
+			(freqs, PSD) estimated with 'step' points long sub-segments
+			(see median_mean_average_psd()).
+		'''
+		if ( f_sampl, step ) != ( self.f_sampl, self.step ):
+			self.reset(f_sampl, step)
+		
+		segments = overlapping_segments(time_series, step)
+		first_key = int(round(start_time*f_sampl)) + step//2
+		keys = first_key + (step//2)*np.arange(len(segments))
+		
+		new = [ index for index, key in enumerate(keys) if key not in self.keys ]
+		if new:
+			Ns = len(new)
+			Ns_odd, Ns_even = median_mean_average_counts(Ns)
+			PSD = median_mean_average(periodograms(segments[new], f_sampl), Ns, Ns_odd, Ns_even)
+			self.blocks.append( ( keys[new[-1]], PSD, Ns_odd+Ns_even ) )
+			self.keys.update(keys[new])
 			
-	
-	
-	even_psd_median = np.median( np.array(even_psd_list), axis=0 )
-	odd_psd_median = np.median( np.array(odd_psd_list), axis=0 )
-	
-	
-	# If there's only one segment, then the PSD estimate is just the median of
-	# that segment, otherwise it is the weighted average
-	if ( Ns == 1 ):
-		PSD_estimate = odd_psd_median
-	else:
-		even_weight = Ns_even/median_bias_factor(Ns_even)
-		odd_weight =  Ns_odd/median_bias_factor(Ns_odd)
-		PSD_estimate = even_psd_median*even_weight + odd_psd_median*odd_weight
-		PSD_estimate /= float( Ns_even + Ns_odd)
-	
-
-	return freqs, PSD_estimate
+			# Drop the data older than lookback
+			oldest = max( block[0] for block in self.blocks ) - int(self.lookback*f_sampl)
+			self.blocks = [ block for block in self.blocks if block[0] > oldest ]
+			self.keys = set( key for key in self.keys if key > oldest-step )
+		
+		if not self.blocks:
+			# Time series shorter than step, use the plain estimate
+			return median_mean_average_psd(time_series, step, f_sampl)
+		
+		PSD_estimate = np.average([ block[1] for block in self.blocks ], axis=0,
+									weights=[ block[2] for block in self.blocks ])
+		return frequency_grid(step, f_sampl), PSD_estimate
 
 def median_mean_average_energy(time_series, step):
 	"""
 		Does the same thing as the median-mean-average PSD, except this is done in the time
 		domain to estimate the average energy content of a segment 'step' points long.
 	"""
+	segments, Ns, Ns_odd, Ns_even = median_mean_average_segments(time_series, step)
+	energies = (segments**2).sum(axis=-1)
 	
-	signal_length = len(time_series)
-	if ( 2*signal_length//step > 1):
-		Ns =  2*signal_length//step - 1
-	else:
-		Ns = 1
-	
-	Ns_odd =  (Ns+1) // 2 
-	Ns_even = (Ns-1) // 2 
-	
-	if ( Ns_odd % 2 == 0 ):
-		Ns_odd -= 1
-	elif ( Ns_even > 1 ):
-		Ns_even -= 1
+	return median_mean_average(energies, Ns, Ns_odd, Ns_even)
+
+def welch_windows(lengths, NFFT, noverlap):
+	'''
+		Number of Welch windows (NFFT points long, overlapping by 'noverlap'
+		points) in segments 'lengths' points long, as in
+		matplotlib.mlab.psd: segments shorter than NFFT are zero-padded to
+		one window.
+	'''
+	lengths = np.asarray(lengths)
+	return np.maximum( 1 + (lengths-NFFT)//(NFFT-noverlap), 1 )
+
+
+def welch_psds(time_series, resolution, f_sampl, overlap, boundaries=None):
+	'''
+	Computes the PSDs of several segments at once through Welch's method,
+	with the same normalization as matplotlib.mlab.psd (Hann window, no
+	detrending, one-sided, scaled by the frequency).
+	All the windows of all the segments are transformed with a single
+	(batched) FFT.
 	
-	energies_even = []
-	energies_odd = []
+	Arguments:
+		- time_series (array)
+			Either a 2-D array with one segment per row, or a 1-D array
+			containing the segments (see 'boundaries').
+		- resolution (float)
+		 	Frequency resolution of the power spectral densities in Hz.
+		- f_sampl (float)
+			Sampling frequency for the given time series.
+	 	- overlap (float)
+			Overlap between the windows of each segment, in the interval
+			[0,1[: 0 is no overlap, 0.5 is 50% overlap (see --psd_overlap).
+		- boundaries (list, optional)
+			With a 1-D time_series, list of (start, end) indexes of the
+			segments in time_series (default is the whole time series).
 	
-	current_bin = 0
-	for i in range(Ns):
-		ioff = i/2
-		current_bin += step/2
-		
-		current_segment = np.array(time_series[current_bin:current_bin+step])
-		current_energy = (current_segment**2).sum()
-		
-		# Exclude the last segment if its size is less than step
-		if ( current_segment.size < step):
-			continue
-			
-		# Assign energy to the correct list
-		if ( i % 2 == 0 ):
-			if ( ioff >= Ns_odd ):
-				continue
-			energies_odd.append( current_energy )
-		
+	Output:
+		(freqs, PSDs) (tuple)
+			- freqs
+				Frequencies at which the PSDs were computed
+			- PSDs
+				2-D array with the PSDs of the segments (one per row)
+	'''
+	NFFT = int(f_sampl/resolution)
+	noverlap = int(NFFT*overlap)
+	if not ( 0 <= noverlap < NFFT ):
+		raise ValueError("overlap should be in the interval [0,1[ (overlap = {0})".format(overlap))
+	step = NFFT-noverlap
+	
+	time_series = np.asarray(time_series, dtype=np.float64)
+	if ( time_series.ndim == 2 ):
+		length = time_series.shape[1]
+		boundaries = [ (index*length, (index+1)*length) for index in range(time_series.shape[0]) ]
+		time_series = time_series.ravel()
+	elif boundaries is None:
+		boundaries = [ (0, len(time_series)) ]
+	starts = np.array([ start for start, end in boundaries ], dtype=np.int64)
+	lengths = np.array([ end-start for start, end in boundaries ], dtype=np.int64)
+	
+	# First point of each window, for all the segments
+	windows_number = welch_windows(lengths, NFFT, noverlap)
+	segment_index = np.repeat(np.arange(len(boundaries)), windows_number)
+	window_index = np.arange(len(segment_index)) - np.repeat(np.cumsum(windows_number)-windows_number, windows_number)
+	window_starts = starts[segment_index] + window_index*step
+	
+	# Windows are gathered from a strided view of the time series
+	# (segments shorter than NFFT are zero-padded)
+	if np.all( lengths >= NFFT ):
+		view = np.lib.stride_tricks.as_strided(time_series, shape=(len(time_series)-NFFT+1, NFFT),
+												strides=(time_series.strides[0], time_series.strides[0]))
+	else:
+		view = None
+	window, window_normalization = hanning_window(NFFT)
+	
+	# Transform the windows in batches of (at most) WELCH_BATCH_POINTS
+	# points, which are small enough to stay in the cache, and add the
+	# periodograms of each batch to the PSDs of their segments
+	PSDs = np.zeros((len(boundaries), NFFT//2+1))
+	batch = max(1, WELCH_BATCH_POINTS//NFFT)
+	for first in range(0, len(window_starts), batch):
+		rows = slice(first, first+batch)
+		if view is not None:
+			windows = view[window_starts[rows]]
 		else:
-			if ( ioff >= Ns_even ):
-				continue
-			energies_even.append( current_energy )
-			
-		
+			windows = np.zeros((len(window_starts[rows]), NFFT))
+			for row, window_start in enumerate(window_starts[rows]):
+				end = min(window_start+NFFT, boundaries[segment_index[first+row]][1])
+				windows[row, :end-window_start] = time_series[window_start:end]
+		windows *= window
+		transform = fft_backend.rfft(windows, axis=-1)
+		del windows
+		Pxx = transform.real**2
+		Pxx += transform.imag**2
+		del transform
 		
-	even_energies_median = np.median( np.array(energies_even), axis=0 )
-	odd_energies_median = np.median( np.array(energies_odd), axis=0 )
-	
-	# If there's only one segment, then the energy is just the median of
-	# that segment, otherwise it is the weighted average
-	if ( Ns == 1 ):
-		energy_estimate = odd_energies_median
-	else:
-		even_weight = Ns_even/median_bias_factor(Ns_even)
-		odd_weight =  Ns_odd/median_bias_factor(Ns_odd)
-		energy_estimate = even_energies_median*even_weight + odd_energies_median*odd_weight
-		energy_estimate /= float( Ns_even + Ns_odd)
+		# Windows are sorted by segment
+		batch_segments = segment_index[rows]
+		offsets = np.concatenate( ( [0], np.flatnonzero(np.diff(batch_segments))+1 ) )
+		PSDs[batch_segments[offsets]] += np.add.reduceat(Pxx, offsets, axis=0)
+	
+	# Average the windows of each segment
+	PSDs /= windows_number[:, np.newaxis]
+	
+	# One-sided, scaled by the frequency and by the window norm (as
+	# matplotlib.mlab.psd): DC (and Nyquist for even NFFT) are not doubled
+	PSDs *= 2.0/(f_sampl*window_normalization*NFFT)
+	PSDs[:, 0] /= 2.0
+	if ( NFFT % 2 == 0 ):
+		PSDs[:, -1] /= 2.0
+	freqs = frequency_grid(NFFT, f_sampl)
+	return freqs, PSDs
+
+
+def stft_psds(time_series, resolution, f_sampl, overlap, window_seconds, stride_seconds):
+	'''
+	Computes short-time PSDs of a long time series: one PSD (through
+	Welch's method, as welch_psds()) of each 'window_seconds' long window,
+	for windows starting every 'stride_seconds'.
+	The periodograms (short-time Fourier transform) of the whole time series
+	are computed once, with a single (batched) FFT, and shared by
+	overlapping windows.
+	The stride is rounded to a multiple of the step between the periodograms
+	(NFFT*(1-overlap) points, at least one step).
 	
-	return energy_estimate
+	Output:
+		(freqs, starts, length, PSDs) (tuple)
+			- freqs
+				Frequencies at which the PSDs were computed
+			- starts
+				First point of each window in time_series
+			- length
+				Length of the windows (points)
+			- PSDs
+				2-D array with the PSDs of the windows (one per row)
+	'''
+	NFFT = int(f_sampl/resolution)
+	noverlap = int(NFFT*overlap)
+	if not ( 0 <= noverlap < NFFT ):
+		raise ValueError("overlap should be in the interval [0,1[ (overlap = {0})".format(overlap))
+	step = NFFT-noverlap
+	
+	time_series = np.ascontiguousarray(time_series, dtype=np.float64)
+	# Periodograms of the time series, periodograms in each window and
+	# periodograms between the start of consecutive windows
+	periodograms_number = 1 + (len(time_series)-NFFT)//step if ( len(time_series) >= NFFT ) else 0
+	window_periodograms = int(welch_windows(int(window_seconds*f_sampl), NFFT, noverlap))
+	stride_periodograms = max(1, int(round(stride_seconds*f_sampl/step)))
+	windows_number = max(0, (periodograms_number-window_periodograms)//stride_periodograms + 1)
+	
+	freqs = frequency_grid(NFFT, f_sampl)
+	starts = np.arange(windows_number)*stride_periodograms*step
+	length = (window_periodograms-1)*step + NFFT
+	if ( windows_number == 0 ):
+		return freqs, starts, length, np.zeros((0, NFFT//2+1))
+	if ( stride_periodograms >= window_periodograms ):
+		# Windows do not share periodograms
+		return freqs, starts, length, welch_psds(time_series, resolution, f_sampl, overlap,
+												boundaries=[ (start, start+length) for start in starts ])[1]
+	
+	# The PSD of each window is the difference of the running sums of the
+	# periodograms at its last and first periodogram: only keep the running
+	# sums at these periodograms
+	first = np.arange(windows_number)*stride_periodograms
+	kept = np.union1d(first, first+window_periodograms)
+	running_sums = np.zeros((len(kept), NFFT//2+1))
+	
+	view = np.lib.stride_tricks.as_strided(time_series, shape=(periodograms_number, NFFT),
+											strides=(step*time_series.itemsize, time_series.itemsize))
+	window, window_normalization = hanning_window(NFFT)
+	total = np.zeros(NFFT//2+1)
+	batch = max(1, WELCH_BATCH_POINTS//NFFT)
+	# Running sum before the first periodogram
+	kept_index = int( kept[0] == 0 )
+	for batch_start in range(0, periodograms_number, batch):
+		windows = view[batch_start:batch_start+batch]*window
+		transform = fft_backend.rfft(windows, axis=-1)
+		del windows
+		Pxx = transform.real**2
+		Pxx += transform.imag**2
+		del transform
+		np.cumsum(Pxx, axis=0, out=Pxx)
+		Pxx += total
+		total = Pxx[-1].copy()
+		# Running sums after the periodograms kept[...]-1 of this batch
+		batch_end = batch_start+len(Pxx)
+		next_index = np.searchsorted(kept, batch_end, side='right')
+		running_sums[kept_index:next_index] = Pxx[kept[kept_index:next_index]-1-batch_start]
+		kept_index = next_index
+	
+	PSDs = running_sums[np.searchsorted(kept, first+window_periodograms)] - running_sums[np.searchsorted(kept, first)]
+	PSDs /= window_periodograms
+	
+	# Same normalization as welch_psds()
+	PSDs *= 2.0/(f_sampl*window_normalization*NFFT)
+	PSDs[:, 0] /= 2.0
+	if ( NFFT % 2 == 0 ):
+		PSDs[:, -1] /= 2.0
+	return freqs, starts, length, PSDs
+
+
+def aggregate_psd(PSD, f_sampl, NFFT, base_NFFT):
+	'''
+	Derives the PSD with the (coarser) resolution of a NFFT points long
+	transform from a one-sided PSD with the finer resolution of a
+	base_NFFT points long transform (e.g. computed by welch_psds()), by
+	averaging the power of the fine frequency bins falling in each coarse
+	bin. Bins which only partially overlap a coarse bin contribute their
+	overlapping fraction. PSD can be a 2-D array (one PSD per row).
+	base_NFFT is needed since PSDs of odd and even (base_NFFT-1) points
+	long transforms have the same number of bins.
+	
+	Returns (freqs, PSD), freqs being the frequencies of the coarse bins.
+	'''
+	PSD = np.asarray(PSD, dtype=np.float64)
+	assert ( np.shape(PSD)[-1] == base_NFFT//2+1 ), "PSD length does not match base_NFFT"
+	nyquist_frequency = f_sampl/2.0
+	fine_resolution = f_sampl/float(base_NFFT)
+	freqs = frequency_grid(NFFT, f_sampl)
+	coarse_resolution = f_sampl/float(NFFT)
+	
+	# Edges of the fine and coarse bins (bins are centered on their
+	# frequency, the first and last bins are cut at 0 and at the Nyquist
+	# frequency)
+	fine_edges = np.clip( (np.arange(np.shape(PSD)[-1]+1)-0.5)*fine_resolution, 0, nyquist_frequency )
+	coarse_edges = np.clip( (np.arange(len(freqs)+1)-0.5)*coarse_resolution, 0, nyquist_frequency )
+	
+	# Integrated power up to the fine edges, linearly interpolated at the
+	# coarse edges
+	power = np.zeros(np.shape(PSD)[:-1] + (len(fine_edges),))
+	np.cumsum(PSD*np.diff(fine_edges), axis=-1, out=power[..., 1:])
+	index = np.clip( np.searchsorted(fine_edges, coarse_edges, side='right')-1, 0, len(fine_edges)-2 )
+	fraction = (coarse_edges-fine_edges[index])/np.diff(fine_edges)[index]
+	integrated = power[..., index] + fraction*(power[..., index+1]-power[..., index])
+	
+	coarse_widths = np.diff(coarse_edges)
+	return freqs, np.diff(integrated, axis=-1)/np.where(coarse_widths > 0, coarse_widths, 1.0)
+
 
 def compute_psd(time_series, resolution, f_sampl, overlap):
 	'''
-	Computes the PSD of time series using matplotlib.mlab.psd
-	mlab.psd computes a PSD through Welch's method.
+	Computes the PSD of time series through Welch's method, see
+	welch_psds() (the result is the same as matplotlib.mlab.psd's).
 	
 	Arguments:
 		- time_series (array)
@@ -634,11 +1264,9 @@ def compute_psd(time_series, resolution, f_sampl, overlap):
 	
 	
 	'''
-	NFFT = int(f_sampl/resolution)
-	
-	(PSD, freqs) = matplotlib.mlab.psd( time_series, Fs=f_sampl, NFFT=NFFT, noverlap=int(NFFT*overlap), scale_by_freq=True)
+	freqs, PSDs = welch_psds(time_series, resolution, f_sampl, overlap)
 	
-	return freqs, PSD
+	return freqs, PSDs[0]
 
 
 def median_bias_factor(n):
@@ -5,26 +5,48 @@ Daniele Trifiro`
 brethil@phy.olemiss.edu
 
 `pcat.data` is used do retrieve time series from frame files (.gwf).
-pyl
 Can be used standalone. For usage: run with -h.
 
+Time series are read from a data source, selected with set_data_source()
+through an URL:
+	- "frames://" (default)
+		Frame files, found through pylal's AutoqueryingFrameCache.
+	- "file:///path/to/folder" (or simply "/path/to/folder")
+		Local numpy (.npy) files, see NumpyDataSource.
+	- "hdf5:///path/to/folder"
+		GWOSC-style HDF5 strain files, see HDF5DataSource.
+The local sources only read the requested GPS range from the files.
 
 Contains:
 	- download_interval()
 	- retrieve_timeseries()
+	- set_data_source(), data_source()
+	- FrameDataSource, NumpyDataSource, HDF5DataSource
+	- BlockReader, reads overlapping segments in large blocks
+	- PrefetchReader, reads segments in a background thread
 '''
 
 import os
 import sys
+import re
+import time
+import threading
+import Queue
 
 import getopt
 
-import numpy as np
-import pylal.frutils
 import numpy as np
 
 from pcat.utils import progressBar
 
+# Default length (in seconds) of the blocks read by BlockReader
+BLOCK_SECONDS = 256
+
+# Default number of segments and memory (in bytes) read ahead by
+# PrefetchReader
+PREFETCH_DEPTH = 2
+PREFETCH_BYTES = 512*1024**2
+
 def usage():
 	print "Usage:\n\tdownload_data.py -s start_time -e end_time -c channel -I IFO -f frame_type "
 	print "\t\t\t[--size segment_size] [--pad padding_seconds]"
@@ -191,10 +213,211 @@ def download_interval(start_time, end_time, step, overlap, channel_name, IFO, fr
 
 
 
+class DataSource:
+	'''
+	Base class for the data sources used by retrieve_timeseries().
+	Data sources implement fetch(), with the same arguments and output of
+	retrieve_timeseries().
+	'''
+	url = None
+	
+	def fetch(self, start_time, end_time, channel_name, IFO, frame_type):
+		raise NotImplementedError
+	
+	def __str__(self):
+		return self.url
+
+
+class FrameDataSource(DataSource):
+	'''
+	Reads frame files (.gwf) through pylal's AutoqueryingFrameCache.
+	'''
+	url = "frames://"
+	
+	def fetch(self, start_time, end_time, channel_name, IFO, frame_type):
+		import pylal.frutils
+		d = pylal.frutils.AutoqueryingFrameCache(frametype=frame_type, scratchdir=None)
+		data = d.fetch(channel_name, start_time, end_time)
+		
+		time_series = {
+			'waveform': data.A,
+			'dt'      : data.metadata.dt,
+			'fs'      : 1.0/data.metadata.dt,
+		}
+		return time_series
+
+
+class FileDataSource(DataSource):
+	'''
+	Base class for data sources reading local files, each file containing
+	a contiguous time series from a GPS start time to a GPS end time.
+	
+	Subclasses implement file_span() (which files can be used and which
+	interval they contain) and read() (reading part of a file).
+	Requested intervals spanning multiple contiguous files are joined,
+	an IOError is raised if part of the interval is not available.
+	'''
+	def __init__(self, folder):
+		self.folder = folder
+		self.url = folder
+		self.files = None
+	
+	def file_span(self, file_name, channel_name, IFO, frame_type):
+		'''
+		Returns (start, end) GPS times for the given file, or None if the
+		file does not contain the requested channel.
+		'''
+		raise NotImplementedError
+	
+	def read(self, path, file_start, start_time, end_time):
+		'''
+		Returns (waveform, dt) from start_time to end_time for the file in
+		'path', which starts at file_start.
+		'''
+		raise NotImplementedError
+	
+	def index(self, channel_name, IFO, frame_type):
+		key = ( channel_name, IFO, frame_type )
+		if ( self.files is None ) or ( self.files[0] != key ):
+			files = []
+			for file_name in sorted(os.listdir(self.folder)):
+				span = self.file_span(file_name, channel_name, IFO, frame_type)
+				if span is not None:
+					files.append( ( span[0], span[1], os.path.join(self.folder, file_name) ) )
+			self.files = ( key, sorted(files) )
+		return self.files[1]
+	
+	def fetch(self, start_time, end_time, channel_name, IFO, frame_type):
+		pieces = []
+		dt = None
+		current = start_time
+		for file_start, file_end, path in self.index(channel_name, IFO, frame_type):
+			if ( file_end <= current ) or ( file_start > current ):
+				continue
+			last = min(end_time, file_end)
+			waveform, dt = self.read(path, file_start, current, last)
+			pieces.append(waveform)
+			current = last
+			if ( current >= end_time ):
+				break
+		if ( current < end_time ):
+			raise IOError("No data for {0} from {1} to {2} in '{3}'".format(channel_name, current, end_time, self.folder))
+		
+		time_series = {
+			'waveform': pieces[0] if len(pieces) == 1 else np.concatenate(pieces),
+			'dt'      : dt,
+			'fs'      : 1.0/dt,
+		}
+		return time_series
+
+
+class NumpyDataSource(FileDataSource):
+	'''
+	Reads numpy (.npy) files from a folder. File names follow the same
+	convention as the files saved by PCAT (--save_timeseries):
+		IFO-frame_type-channel_GPSSTART-GPSEND.npy (or .data)
+	The sampling frequency is given by the number of points in the file
+	divided by its duration. Files are memory-mapped so that only the
+	requested samples are read.
+	'''
+	name_format = re.compile(r"^(.*)_(\d+)-(\d+)\.(npy|data)$")
+	
+	def __init__(self, folder):
+		FileDataSource.__init__(self, folder)
+		self.url = "file://" + folder
+	
+	def file_span(self, file_name, channel_name, IFO, frame_type):
+		match = self.name_format.match(file_name)
+		if not match:
+			return None
+		if ( match.group(1) != "{0}-{1}-{2}".format(IFO, frame_type, channel_name) ):
+			return None
+		return int(match.group(2)), int(match.group(3))
+	
+	def read(self, path, file_start, start_time, end_time):
+		data = np.load(path, mmap_mode='r')
+		file_end = int(self.name_format.match(os.path.basename(path)).group(3))
+		fs = data.size/float(file_end-file_start)
+		first = int(round( (start_time-file_start)*fs ))
+		last = int(round( (end_time-file_start)*fs ))
+		return np.array(data[first:last]), 1.0/fs
+
+
+class HDF5DataSource(FileDataSource):
+	'''
+	Reads GWOSC-style HDF5 strain files from a folder:
+		IFO-DESCRIPTION-GPSSTART-DURATION.hdf5 (or .h5)
+	e.g. 'H-H1_LOSC_4_V1-1126256640-4096.hdf5', with the time series in the
+	'strain/Strain' dataset and the sampling period in its 'Xspacing'
+	attribute. Only the requested samples are read from the dataset.
+	The channel name and the frame type are not used, files are selected
+	by IFO.
+	'''
+	name_format = re.compile(r"^([A-Z])-.*-(\d+)-(\d+)\.(hdf5|h5)$")
+	dataset = "strain/Strain"
+	
+	def __init__(self, folder):
+		FileDataSource.__init__(self, folder)
+		self.url = "hdf5://" + folder
+	
+	def file_span(self, file_name, channel_name, IFO, frame_type):
+		match = self.name_format.match(file_name)
+		if not match:
+			return None
+		if ( match.group(1) != IFO[0] ):
+			return None
+		return int(match.group(2)), int(match.group(2))+int(match.group(3))
+	
+	def read(self, path, file_start, start_time, end_time):
+		import h5py
+		with h5py.File(path, "r") as f:
+			strain = f[self.dataset]
+			dt = float(strain.attrs['Xspacing'])
+			first = int(round( (start_time-file_start)/dt ))
+			last = int(round( (end_time-file_start)/dt ))
+			waveform = strain[first:last]
+		return waveform, dt
+
+
+def data_source(url):
+	'''
+	Returns the DataSource for the given URL (see the module docstring).
+	'''
+	if ( url is None ) or ( url in ( "", "frames", "frames://" ) ):
+		return FrameDataSource()
+	if ( "://" in url ):
+		scheme, path = url.split("://", 1)
+	else:
+		scheme, path = "file", url
+	if ( scheme == "file" ):
+		return NumpyDataSource(path)
+	elif ( scheme in ( "hdf5", "gwosc" ) ):
+		return HDF5DataSource(path)
+	else:
+		raise ValueError("Unknown data source: '{0}'".format(url))
+
+
+# Data source used by retrieve_timeseries()
+current_data_source = FrameDataSource()
+
+def set_data_source(source):
+	'''
+	Sets the data source used by retrieve_timeseries(), either a DataSource
+	or an URL (see data_source()).
+	'''
+	global current_data_source
+	if isinstance(source, DataSource):
+		current_data_source = source
+	else:
+		current_data_source = data_source(source)
+	return current_data_source
+
+
 def retrieve_timeseries(start_time, end_time, channel_name, IFO, frame_type):
 	"""
-		Read the frame files associated to the input parameters and returns
-		a the time series for the given time interval.
+		Read the data associated to the input parameters (from the data
+		source set through set_data_source(), frame files by default) and
+		returns a the time series for the given time interval.
 		
 		Arguments:
 			- start_time (integer)
@@ -219,15 +442,224 @@ def retrieve_timeseries(start_time, end_time, channel_name, IFO, frame_type):
 				@ 'fs' sampling frequency (float)
 				@'dt' sampling period, 1/fs (float)
 	"""
-	d = pylal.frutils.AutoqueryingFrameCache(frametype=frame_type, scratchdir=None)
-	data = d.fetch(channel_name, start_time, end_time)
-	
-	time_series = {
-		'waveform': data.A,
-		'dt'      : data.metadata.dt,
-		'fs'      : 1.0/data.metadata.dt,
-	}
-	return time_series
+	return current_data_source.fetch(start_time, end_time, channel_name, IFO, frame_type)
+
+class BlockReader:
+	'''
+	Reads the time series for a list of (overlapping) segments in large
+	contiguous blocks, so that data shared by neighbouring segments is read
+	only once. Segments are returned as read-only views of the block, and
+	contain exactly the same samples as retrieve_timeseries() would return.
+	
+		reader = BlockReader(segments, channel_name, IFO, frame_type)
+		time_series = reader.retrieve(start, end)
+	
+	'segments' is a list of (start, end) tuples in GPS time, retrieve()
+	has the same output as retrieve_timeseries().
+	
+	Blocks contain whole segments: a block starts at the start of a segment
+	and ends at the end of the last of the following segments such that the
+	block is at most 'block_seconds' long (a block always contains at least
+	one segment). Only overlapping or contiguous segments are put in the
+	same block. Blocks are read when one of their segments is first
+	requested, only the last read block is kept in memory.
+	
+	If a block cannot be read its segments are read one at a time, so that
+	errors are raised for the single segments. If block_seconds is 0 all
+	segments are read one at a time.
+	'''
+	
+	def __init__(self, segments, channel_name, IFO, frame_type, block_seconds=BLOCK_SECONDS):
+		self.channel_name = channel_name
+		self.IFO = IFO
+		self.frame_type = frame_type
+		
+		# Seconds of data read and requested, to check the I/O saved
+		self.seconds_read = 0
+		self.seconds_requested = 0
+		
+		# Map each segment to its block
+		self.blocks = {}
+		block = []
+		for segment in sorted(set( (int(start), int(end)) for start, end in segments )):
+			if block and ( ( segment[0] > block[-1][1] ) or ( segment[1]-block[0][0] > block_seconds ) ):
+				self.add_block(block)
+				block = []
+			block.append(segment)
+		if block:
+			self.add_block(block)
+		
+		self.block = None
+		self.block_time_series = None
+		self.failed_blocks = set()
+	
+	def add_block(self, segments):
+		block = ( segments[0][0], max( end for start, end in segments ) )
+		for segment in segments:
+			self.blocks[segment] = block
+	
+	def read(self, start, end):
+		self.seconds_read += end-start
+		return retrieve_timeseries(start, end, self.channel_name, self.IFO, self.frame_type)
+	
+	def retrieve(self, start, end):
+		"""
+			Returns the time series for the segment from start to end
+			(see retrieve_timeseries()).
+		"""
+		self.seconds_requested += end-start
+		block = self.blocks.get( (int(start), int(end)) )
+		if ( block is None ) or ( block in self.failed_blocks ):
+			return self.read(start, end)
+		
+		if ( block != self.block ):
+			self.block, self.block_time_series = None, None
+			try:
+				self.block_time_series = self.read(block[0], block[1])
+				self.block = block
+			except Exception:
+				self.failed_blocks.add(block)
+				return self.read(start, end)
+		
+		fs = self.block_time_series['fs']
+		first = int(round( (start-self.block[0])*fs ))
+		length = int(round( (end-start)*fs ))
+		waveform = self.block_time_series['waveform'][first:first+length]
+		if ( waveform.size != length ):
+			# Block is shorter than expected, fall back to reading the segment
+			return self.read(start, end)
+		
+		# Neighbouring segments share their samples: make sure they cannot
+		# be modified by the conditioning functions
+		waveform = waveform.view()
+		waveform.flags.writeable = False
+		
+		time_series = {
+			'waveform': waveform,
+			'dt'      : self.block_time_series['dt'],
+			'fs'      : fs,
+		}
+		return time_series
+
+
+class PrefetchReader:
+	'''
+	Reads the time series for a list of segments in a background thread,
+	so that reading the next segments overlaps with the processing of the
+	current one.
+	
+		reader = PrefetchReader(BlockReader(segments, ...), segments)
+		time_series = reader.retrieve(start, end)
+		...
+		reader.close()
+	
+	'reader' is any object with a retrieve(start, end) method (e.g. a
+	BlockReader), 'segments' the (start, end) tuples in the order they will
+	be requested. At most 'depth' segments, and at most 'max_bytes' bytes
+	(at least one segment), are kept in memory ahead of the segment being
+	processed.
+	
+	Segments which are not requested are dropped when a later segment is
+	requested, segments which have not been prefetched are read directly.
+	Errors reading a segment are raised by retrieve() for that segment.
+	
+	stall_time is the total time (in seconds) retrieve() waited for data.
+	'''
+	
+	def __init__(self, reader, segments, depth=PREFETCH_DEPTH, max_bytes=PREFETCH_BYTES):
+		self.reader = reader
+		self.segments = [ (int(start), int(end)) for start, end in segments ]
+		self.pending = set(self.segments)
+		self.max_bytes = max_bytes
+		
+		self.stall_time = 0.0
+		self.prefetched = 0
+		
+		self.queue = Queue.Queue(maxsize=max(depth, 1))
+		self.bytes = 0
+		self.condition = threading.Condition()
+		# Readers are not thread-safe, only one thread reads at a time
+		self.lock = threading.Lock()
+		self.stopped = False
+		
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+	
+	def run(self):
+		for segment in self.segments:
+			if self.stopped:
+				break
+			try:
+				with self.lock:
+					time_series = self.reader.retrieve(segment[0], segment[1])
+				size = time_series['waveform'].nbytes
+			except Exception, error:
+				time_series, size = error, 0
+			# Wait for memory to be released
+			with self.condition:
+				while ( self.bytes > 0 ) and ( self.bytes+size > self.max_bytes ) and not self.stopped:
+					self.condition.wait(0.1)
+				self.bytes += size
+			while not self.stopped:
+				try:
+					self.queue.put( (segment, time_series, size), timeout=0.1 )
+					break
+				except Queue.Full:
+					pass
+		# Signal the end of the segments
+		while not self.stopped:
+			try:
+				self.queue.put(None, timeout=0.1)
+				break
+			except Queue.Full:
+				pass
+	
+	def release(self, size):
+		with self.condition:
+			self.bytes -= size
+			self.condition.notify()
+	
+	def retrieve(self, start, end):
+		"""
+			Returns the time series for the segment from start to end
+			(see retrieve_timeseries()).
+		"""
+		segment = ( int(start), int(end) )
+		if segment not in self.pending:
+			with self.lock:
+				return self.reader.retrieve(start, end)
+		
+		while True:
+			wait_start = time.time()
+			item = self.queue.get()
+			self.stall_time += time.time()-wait_start
+			if item is None:
+				# Reader thread stopped
+				self.pending.clear()
+				with self.lock:
+					return self.reader.retrieve(start, end)
+			queued_segment, time_series, size = item
+			self.pending.discard(queued_segment)
+			self.release(size)
+			if ( queued_segment == segment ):
+				break
+		
+		if isinstance(time_series, Exception):
+			raise time_series
+		self.prefetched += 1
+		return time_series
+	
+	def close(self):
+		'''
+		Stops the reader thread.
+		'''
+		self.stopped = True
+		with self.condition:
+			self.condition.notify()
+		self.thread.join()
+		self.pending.clear()
+
 
 def main():
 	# Check arguments:
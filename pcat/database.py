@@ -0,0 +1,432 @@
+# encoding: utf-8
+'''
+database.py
+
+Columnar database for the transients found by PCAT.
+
+A database is a directory (by convention named 'name.db') containing:
+	metadata.npy		->	Structured array, one row per transient, with
+							the fields in METADATA_DTYPE.
+	waveforms.npy		->	2-D array, one row per transient, with the
+							waveforms normalized by the 'norm' column.
+							This is the data matrix used for time-domain PCA.
+	psds.npy			->	2-D array with the PSDs of the transients
+							(only if the transients have a PSD).
+	segments.pickle		->	Pickled SegmentTable (only if the transients
+							refer to one through spike.segment_index).
+	attributes.json		->	Attributes of the database (only if they are
+							not the defaults): 'log_waveforms' is true if
+							the waveforms are already base-10 logarithms
+							(PSDs saved by frequency-domain analyses).
+
+All the arrays are saved with np.save, so that they can be loaded with
+np.load(..., mmap_mode='r') without reading the whole database in memory:
+	database = SpikeDatabase.load("t-5.5_w-1500.db")
+	data_matrix = database.data_matrix("time")		# zero-copy view
+
+SpikeDatabase can be used as a list of Spike() instances (len(),
+indexing and iteration), Spike() instances are created only when
+accessed.
+
+Databases saved by older versions of PCAT (pickled lists of Spike()
+instances, '.list' files) are loaded through load_database() and can be
+converted with convert_legacy_database().
+
+Databases saved by different processes (e.g. one per batch of segments) are
+merged with merge_databases(), which copies their memory-mapped arrays to
+the arrays of the new database without loading them in memory.
+
+'''
+
+import os
+import json
+import cPickle as pickle
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from pcat.spike import Spike, SegmentTable
+
+
+# Start and end times are floats: they are sample indices and GPS seconds
+# for time-domain transients, but fractional GPS times for the observations
+# of frequency-domain analyses (e.g. the windows of --stft in pcat)
+METADATA_DTYPE = np.dtype([	('start', np.float64), ('end', np.float64),
+							('peak', np.int64), ('norm', np.float64),
+							('peak_GPS', np.float64),
+							('segment_start', np.float64), ('segment_end', np.float64),
+							('sampling', np.float64), ('SNR', np.float64),
+							('polarity', np.int8), ('type', np.int32),
+							('segment_index', np.int32) ])
+
+# Values for missing metadata (e.g. transients which have not been
+# classified yet have type = -1)
+METADATA_DEFAULTS = { 'norm': 1.0, 'SNR': np.nan, 'polarity': 1, 'type': -1, 'segment_index': -1 }
+
+DATABASE_EXTENSION = ".db"
+
+
+def _time(value):
+	# Start and end times are integers unless they are fractional
+	value = float(value)
+	return int(value) if value.is_integer() else value
+
+
+class SpikeDatabase:
+	'''
+	Columnar spike database, see the module docstring.
+
+		database = SpikeDatabase.from_spikes(spike_list, segment_table)
+		database.save("name.db")
+
+		database = SpikeDatabase.load("name.db", mmap_mode='r')
+
+	Attributes:
+		metadata		->	structured array (METADATA_DTYPE)
+		waveforms		->	2-D array with the normalized waveforms
+		psds			->	2-D array with the PSDs (or None)
+		segment_table	->	SegmentTable (or None)
+		path			->	Path the database was loaded from/saved to
+		log_waveforms	->	True if the waveforms are base-10 logarithms
+							(see data_matrix())
+	'''
+
+	def __init__(self, metadata, waveforms, psds=None, segment_table=None, path=None, log_waveforms=False):
+		self.metadata = metadata
+		self.waveforms = waveforms
+		self.psds = psds
+		self.segment_table = segment_table
+		self.path = path
+		self.log_waveforms = log_waveforms
+		# Spike() instances which have already been created, so that
+		# attributes added to them are kept
+		self._spikes = {}
+
+	@classmethod
+	def from_spikes(cls, spikes, segment_table=None, log_waveforms=False):
+		'''
+		Creates a database from a list of Spike() instances, log_waveforms
+		is True if their waveforms are base-10 logarithms (e.g. the PSDs
+		given by create_data_matrix_from_psds() in `pcat.utils`).
+		'''
+		metadata = np.zeros(len(spikes), dtype=METADATA_DTYPE)
+		for name in METADATA_DTYPE.names:
+			default = METADATA_DEFAULTS.get(name, 0)
+			metadata[name] = [ getattr(spike, name, default) for spike in spikes ]
+
+		waveforms = np.array([ spike.waveform for spike in spikes ], dtype=np.float64)
+		if ( len(spikes) != 0 ):
+			waveforms /= metadata['norm'][:, np.newaxis]
+
+		psds = None
+		# Only save PSDs which have been computed (see Spike.psd)
+		if ( len(spikes) != 0 ) and all( spike.has_psd() for spike in spikes ):
+			if ( len(set( len(spike.psd) for spike in spikes )) == 1 ):
+				psds = np.array([ spike.psd for spike in spikes ], dtype=np.float64)
+
+		if not np.any(metadata['segment_index'] >= 0):
+			segment_table = None
+		return cls(metadata, waveforms, psds, segment_table, log_waveforms=log_waveforms)
+
+	@classmethod
+	def load(cls, path, mmap_mode='r'):
+		'''
+		Loads the database saved in the 'path' directory.
+		Arrays are memory-mapped using 'mmap_mode' (see np.load), use None
+		to load them in memory and 'c' (copy-on-write) if arrays have to be
+		modified without changing the saved database.
+		'''
+		metadata = np.load(os.path.join(path, "metadata.npy"), mmap_mode=mmap_mode)
+		if ( metadata.dtype != METADATA_DTYPE ):
+			# Saved by an older version (integer start and end times)
+			metadata = metadata.astype(METADATA_DTYPE)
+		waveforms = np.load(os.path.join(path, "waveforms.npy"), mmap_mode=mmap_mode)
+		psds = None
+		if os.path.isfile(os.path.join(path, "psds.npy")):
+			psds = np.load(os.path.join(path, "psds.npy"), mmap_mode=mmap_mode)
+		segment_table = None
+		if os.path.isfile(os.path.join(path, "segments.pickle")):
+			with open(os.path.join(path, "segments.pickle"), "rb") as f:
+				segment_table = pickle.load(f)
+		attributes = {}
+		if os.path.isfile(os.path.join(path, "attributes.json")):
+			with open(os.path.join(path, "attributes.json")) as f:
+				attributes = json.load(f)
+		return cls(metadata, waveforms, psds, segment_table, path,
+					log_waveforms=attributes.get('log_waveforms', False))
+
+	def save(self, path):
+		'''
+		Saves the database to the 'path' directory (created if it does not
+		exist).
+		'''
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		np.save(os.path.join(path, "waveforms.npy"), self.waveforms)
+		if self.psds is not None:
+			np.save(os.path.join(path, "psds.npy"), self.psds)
+		if self.segment_table is not None:
+			with open(os.path.join(path, "segments.pickle"), "wb") as f:
+				pickle.dump(self.segment_table, f, pickle.HIGHEST_PROTOCOL)
+		if self.log_waveforms:
+			with open(os.path.join(path, "attributes.json"), "w") as f:
+				json.dump({ 'log_waveforms': True }, f)
+		elif os.path.isfile(os.path.join(path, "attributes.json")):
+			os.remove(os.path.join(path, "attributes.json"))
+		self.path = path
+		self.save_metadata()
+
+	def save_metadata(self):
+		'''
+		Saves only the metadata (e.g. after changing the types), to the
+		path the database was loaded from or saved to.
+		'''
+		# Write to a temporary file and rename it, as the metadata could be
+		# memory-mapped from the file being replaced
+		file_name = os.path.join(self.path, "metadata.npy")
+		with open(file_name + ".tmp", "wb") as f:
+			np.save(f, np.asarray(self.metadata))
+		os.rename(file_name + ".tmp", file_name)
+
+	def __len__(self):
+		return len(self.metadata)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [ self[i] for i in range(*index.indices(len(self))) ]
+		if ( index < 0 ):
+			index += len(self)
+		if not ( 0 <= index < len(self) ):
+			raise IndexError("database index out of range")
+		if index not in self._spikes:
+			self._spikes[index] = self.spike(index)
+		return self._spikes[index]
+
+	def __iter__(self):
+		for index in range(len(self)):
+			yield self[index]
+
+	def spike(self, index):
+		'''
+		Returns a new Spike() instance for the index-th transient.
+		'''
+		row = self.metadata[index]
+		spike = Spike(_time(row['start']), _time(row['end']), int(row['peak']),
+						float(row['norm']), float(row['peak_GPS']),
+						_time(row['segment_start']), _time(row['segment_end']),
+						self.waveforms[index]*row['norm'], float(row['sampling']))
+		spike.SNR = float(row['SNR'])
+		spike.polarity = int(row['polarity'])
+		if ( row['type'] >= 0 ):
+			spike.type = int(row['type'])
+		if ( row['segment_index'] >= 0 ):
+			spike.segment_index = int(row['segment_index'])
+		if self.psds is not None:
+			spike.psd = self.psds[index]
+		return spike
+
+	def to_spikes(self):
+		'''
+		Returns a list of Spike() instances.
+		'''
+		return [ self[index] for index in range(len(self)) ]
+
+	def data_matrix(self, ANALYSIS="time", model_waveform=None):
+		'''
+		Returns the data matrix used for PCA (observations in the rows).
+		For ANALYSIS = "time" this is a view of the waveforms (no data is
+		copied), for the other types of analysis see create_data_matrix()
+		in `pcat.utils`. The logarithm is not taken again for databases of
+		logarithmic waveforms (log_waveforms).
+		'''
+		if ( ANALYSIS == "time" ):
+			return self.waveforms
+		elif ( ANALYSIS == "time_diff" ):
+			return np.abs( model_waveform-self.waveforms )
+		elif ( ANALYSIS == "frequency" ):
+			if self.log_waveforms:
+				return self.waveforms
+			return np.log10(self.waveforms)
+		elif ( ANALYSIS == "frequency_diff" ):
+			if self.log_waveforms:
+				return np.log10(model_waveform)-self.waveforms
+			return np.log10(model_waveform)-np.log10(self.waveforms)
+		elif ( ANALYSIS == "generic_log" ):
+			return np.log10(self.waveforms*self.metadata['norm'][:, np.newaxis])
+		elif ( ANALYSIS == "generic" ):
+			return self.waveforms*self.metadata['norm'][:, np.newaxis]
+		else:
+			assert False, "Unknown analysis type: {0}".format(ANALYSIS)
+
+	def set_types(self, labels):
+		'''
+		Saves the labels given by the clustering in the 'type' column (and
+		in the spike.type attribute of the Spike() instances already
+		created).
+		'''
+		self.metadata['type'] = labels
+		for index, spike in self._spikes.iteritems():
+			spike.type = labels[index]
+
+	def subset(self, indexes):
+		'''
+		Returns a new database (in memory) with the transients in 'indexes'.
+		The segment table is shared.
+		'''
+		indexes = np.asarray(indexes, dtype=int)
+		psds = self.psds[indexes] if self.psds is not None else None
+		return SpikeDatabase(np.array(self.metadata[indexes]), np.array(self.waveforms[indexes]),
+								psds, self.segment_table, log_waveforms=self.log_waveforms)
+
+	@classmethod
+	def concatenate(cls, databases):
+		'''
+		Merges a list of databases into a single database (in memory),
+		the segment tables are merged as well.
+		'''
+		assert len(set( database.log_waveforms for database in databases )) == 1,\
+				"Cannot merge databases of linear and logarithmic waveforms"
+		metadata = np.concatenate([ np.asarray(database.metadata) for database in databases ])
+		waveforms = np.concatenate([ np.asarray(database.waveforms) for database in databases ])
+		psds = None
+		if all( database.psds is not None for database in databases ):
+			psds = np.concatenate([ np.asarray(database.psds) for database in databases ])
+		segment_table = None
+		if any( database.segment_table is not None for database in databases ):
+			segment_table = SegmentTable()
+			offset = 0
+			for database in databases:
+				rows = slice(offset, offset+len(database))
+				offset += len(database)
+				if database.segment_table is None:
+					continue
+				index_offset = segment_table.merge(database.segment_table)
+				has_segment = metadata['segment_index'][rows] >= 0
+				metadata['segment_index'][rows][has_segment] += index_offset
+		return cls(metadata, waveforms, psds, segment_table, log_waveforms=databases[0].log_waveforms)
+
+
+def is_database(path):
+	'''
+	True if 'path' is a columnar database (a directory containing
+	metadata.npy), False for legacy pickled databases.
+	'''
+	return os.path.isfile(os.path.join(path, "metadata.npy"))
+
+
+def legacy_segment_table_name(file_name):
+	'''
+	Name of the SegmentTable saved next to a legacy ('.list') database.
+	'''
+	return os.path.splitext(file_name)[0] + ".segments"
+
+
+def load_legacy_database(file_name):
+	'''
+	Loads a legacy database (pickled list of Spike() instances) and its
+	segment table (if saved), returns a SpikeDatabase.
+	'''
+	with open(file_name, "rb") as f:
+		spikes = pickle.load(f)
+	segment_table = None
+	if os.path.isfile(legacy_segment_table_name(file_name)):
+		with open(legacy_segment_table_name(file_name), "rb") as f:
+			segment_table = pickle.load(f)
+	elif any( hasattr(spike, "fft_freq") for spike in spikes ):
+		# Older databases store the segment PSD and the frequencies in
+		# each spike: move them to a segment table
+		segment_table = SegmentTable()
+		segment_indexes = {}
+		for spike in spikes:
+			if not hasattr(spike, "fft_freq"):
+				continue
+			key = (spike.segment_start, spike.segment_end)
+			if key not in segment_indexes:
+				segment_indexes[key] = segment_table.add(key[0], key[1], getattr(spike, "segment_psd", None), spike.fft_freq)
+			spike.segment_index = segment_indexes[key]
+	return SpikeDatabase.from_spikes(spikes, segment_table)
+
+
+def load_database(path, mmap_mode='r'):
+	'''
+	Loads either a columnar database or a legacy ('.list') database,
+	returns a SpikeDatabase.
+	'''
+	if is_database(path):
+		return SpikeDatabase.load(path, mmap_mode=mmap_mode)
+	else:
+		return load_legacy_database(path)
+
+
+def convert_legacy_database(file_name, output_name=None):
+	'''
+	Converts a legacy ('.list') database to a columnar database.
+	Output name defaults to the input name with the DATABASE_EXTENSION.
+	Returns the output name.
+	'''
+	if output_name is None:
+		output_name = os.path.splitext(file_name)[0] + DATABASE_EXTENSION
+	database = load_legacy_database(file_name)
+	database.save(output_name)
+	return output_name
+
+
+def merge_databases(paths, output_path, mmap_mode='r'):
+	'''
+	Merges the databases saved in 'paths' (in this order) into a new
+	database saved to 'output_path', as SpikeDatabase.concatenate() but
+	without loading the databases in memory: their arrays are memory-mapped
+	and copied to the (memory-mapped) arrays of the new database.
+	Returns the new database, loaded with 'mmap_mode' (see
+	SpikeDatabase.load()).
+	'''
+	databases = [ SpikeDatabase.load(path, mmap_mode='r') for path in paths ]
+	assert databases, "No databases to merge"
+	assert len(set( database.log_waveforms for database in databases )) == 1,\
+			"Cannot merge databases of linear and logarithmic waveforms"
+	log_waveforms = databases[0].log_waveforms
+	if not os.path.isdir(output_path):
+		os.makedirs(output_path)
+	rows = sum( len(database) for database in databases )
+	metadata = np.zeros(rows, dtype=METADATA_DTYPE)
+	waveforms = open_memmap(os.path.join(output_path, "waveforms.npy"), mode='w+',
+							dtype=np.float64, shape=(rows, databases[0].waveforms.shape[1]))
+	psds = None
+	if all( database.psds is not None for database in databases ):
+		if ( len(set( database.psds.shape[1] for database in databases )) == 1 ):
+			psds = open_memmap(os.path.join(output_path, "psds.npy"), mode='w+',
+								dtype=np.float64, shape=(rows, databases[0].psds.shape[1]))
+	segment_table = None
+	if any( database.segment_table is not None for database in databases ):
+		segment_table = SegmentTable()
+	offset = 0
+	for database in databases:
+		block = slice(offset, offset+len(database))
+		offset += len(database)
+		metadata[block] = database.metadata
+		waveforms[block] = database.waveforms
+		if psds is not None:
+			psds[block] = database.psds
+		if database.segment_table is not None:
+			index_offset = segment_table.merge(database.segment_table)
+			has_segment = metadata['segment_index'][block] >= 0
+			metadata['segment_index'][block][has_segment] += index_offset
+	waveforms.flush()
+	del waveforms, databases
+	if psds is not None:
+		psds.flush()
+		del psds
+	elif os.path.isfile(os.path.join(output_path, "psds.npy")):
+		os.remove(os.path.join(output_path, "psds.npy"))
+	if segment_table is not None:
+		with open(os.path.join(output_path, "segments.pickle"), "wb") as f:
+			pickle.dump(segment_table, f, pickle.HIGHEST_PROTOCOL)
+	elif os.path.isfile(os.path.join(output_path, "segments.pickle")):
+		os.remove(os.path.join(output_path, "segments.pickle"))
+	if log_waveforms:
+		with open(os.path.join(output_path, "attributes.json"), "w") as f:
+			json.dump({ 'log_waveforms': True }, f)
+	elif os.path.isfile(os.path.join(output_path, "attributes.json")):
+		os.remove(os.path.join(output_path, "attributes.json"))
+	np.save(os.path.join(output_path, "metadata.npy"), metadata)
+	return SpikeDatabase.load(output_path, mmap_mode=mmap_mode)
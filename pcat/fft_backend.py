@@ -0,0 +1,106 @@
+# encoding: utf-8
+'''
+fft_backend.py
+
+Real Fourier transforms used by the conditioning and the trigger finder
+(see `pcat.condition.whiten`, `pcat.condition.periodograms`,
+`pcat.spike.transient_psd` and `pcat.gmm.matched_filtering_test`).
+
+Transforms are computed with scipy.fft if available (scipy >= 1.4), which
+can use several threads (see set_fft_workers()), numpy.fft otherwise.
+Both keep the plans for the lengths already transformed, so that
+transforms of the same length (all the segments of an analysis) reuse
+them.
+
+	transform = rfft(time_series, n=fast_length(len(time_series)))
+	time_series = irfft(transform, n=fast_length(len(time_series)))[:len(time_series)]
+
+Lengths with large prime factors are slow to transform: fast_length()
+returns the smallest length, not shorter than the given one, which only
+has small prime factors. Zero-padding to it is only valid where the
+frequency resolution does not matter (e.g. whitening, where the PSD is
+estimated separately), not for periodograms.
+
+Temporary arrays with the same shape and type (e.g. the windowed
+sub-segments of the PSD estimate) are allocated once, see scratch().
+
+Contains:
+	- FFT_BACKEND, FFT_WORKERS
+	- set_fft_workers()
+	- fast_length()
+	- rfft(), irfft()
+	- scratch()
+'''
+
+import numpy as np
+
+try:
+	import scipy.fft as _fft
+	FFT_BACKEND = "scipy.fft"
+except ImportError:
+	_fft = np.fft
+	FFT_BACKEND = "numpy.fft"
+
+try:
+	from scipy.fft import next_fast_len as _next_fast_len
+except ImportError:
+	from scipy.fftpack import next_fast_len as _next_fast_len
+
+# Number of threads used by each transform (scipy.fft only)
+FFT_WORKERS = 1
+
+# Fast lengths already computed, see fast_length()
+_fast_lengths = {}
+# Scratch arrays, by (name, shape, dtype), see scratch()
+_scratch = {}
+
+
+def set_fft_workers(workers):
+	'''
+	Sets the number of threads used by each transform. This is only used
+	with scipy.fft, e.g. when the pipeline runs fewer processes than
+	the available cores.
+	'''
+	global FFT_WORKERS
+	FFT_WORKERS = max(1, int(workers))
+
+
+def fast_length(n):
+	'''
+	Returns the smallest length not shorter than 'n' which can be
+	transformed efficiently (only has 2, 3 and 5 as prime factors).
+	'''
+	if n not in _fast_lengths:
+		_fast_lengths[n] = int(_next_fast_len(int(n)))
+	return _fast_lengths[n]
+
+
+def rfft(x, n=None, axis=-1):
+	'''
+	As numpy.fft.rfft(x, n, axis).
+	'''
+	if ( FFT_BACKEND == "scipy.fft" ):
+		return _fft.rfft(x, n=n, axis=axis, workers=FFT_WORKERS)
+	return _fft.rfft(x, n=n, axis=axis)
+
+
+def irfft(x, n=None, axis=-1):
+	'''
+	As numpy.fft.irfft(x, n, axis).
+	'''
+	if ( FFT_BACKEND == "scipy.fft" ):
+		return _fft.irfft(x, n=n, axis=axis, workers=FFT_WORKERS)
+	return _fft.irfft(x, n=n, axis=axis)
+
+
+def scratch(name, shape, dtype=np.float64):
+	'''
+	Returns an uninitialized array of the given shape and type, allocated
+	once for each ('name', shape, dtype). The array is overwritten by the
+	next call with the same arguments: it must only be used for
+	temporary results (e.g. the input of a transform).
+	'''
+	key = ( name, tuple(np.atleast_1d(shape)), np.dtype(dtype) )
+	if key not in _scratch:
+		_scratch[key] = np.empty(shape, dtype=dtype)
+	return _scratch[key]
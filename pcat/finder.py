@@ -269,7 +269,163 @@ def print_parameters():
 		print "\t Output is pickled.\n"
 
 
-def find_spikes_algorithm(data, removed_points, f_sampl, threshold, time_resolution, data_name, spike_width):
+def find_triggers(time_series, threshold, time_resolution):
+	'''
+		Vectorized trigger engine used by find_spikes_algorithm().
+		
+		Points above threshold are located with np.flatnonzero() and grouped
+		into events: an event is closed by the first point below threshold
+		which is more than 'time_resolution' points after the event's
+		current maximum. Peaks are picked with running maxima over the points
+		above threshold, so the Python loop runs once per event instead of
+		once per sample.
+		
+		Closed events with less than 2 points between the first and last
+		point above threshold are discarded. An event still open at the end
+		of the time series is always kept.
+		
+		Arguments:
+			- time_series (array)
+				Time series to be scanned.
+			- threshold (float)
+				Trigger threshold (absolute value).
+			- time_resolution (integer)
+				Number of points between two triggers (points above threshold)
+				to be considered separate transients.
+		
+		Output:
+			(first, last, peaks, peak_values, closed) (tuple of arrays)
+				- first, last
+					Index of the first and last point above threshold.
+				- peaks, peak_values
+					Index and absolute value of the maximum.
+				- closed
+					False only for the event still open at the end of the
+					time series.
+	'''
+	abs_series = np.abs(time_series)
+	above = np.flatnonzero(abs_series > threshold)
+	
+	first, last, peaks, peak_values, closed = [], [], [], [], []
+	
+	if ( above.size == 0 ):
+		empty = np.array([], dtype=int)
+		return empty, empty, empty, np.array([]), np.array([], dtype=bool)
+	
+	values = abs_series[above]
+	
+	# Points above threshold separated by more than time_resolution points
+	# below threshold always belong to different events, whatever the
+	# position of the maximum: use these to split 'above' into clusters,
+	# which are then split further only where the running maximum requires
+	gaps = np.diff(above)
+	cluster_ends = np.flatnonzero( (gaps > 1) & (gaps-1 > time_resolution) )
+	cluster_starts = np.concatenate(([0], cluster_ends+1))
+	cluster_ends = np.concatenate((cluster_ends, [above.size-1]))
+	
+	for cluster_start, cluster_end in zip(cluster_starts, cluster_ends):
+		position = cluster_start
+		while ( position <= cluster_end ):
+			indexes = above[position:cluster_end+1]
+			cluster_values = values[position:cluster_end+1]
+			
+			# Running maximum (first occurrence, as ties do not move
+			# the peak) for the event starting at 'position'
+			running_max = np.maximum.accumulate(cluster_values)
+			new_max = np.ones(cluster_values.size, dtype=bool)
+			new_max[1:] = cluster_values[1:] > running_max[:-1]
+			running_argmax = np.maximum.accumulate(np.where(new_max, np.arange(cluster_values.size), 0))
+			running_peak = indexes[running_argmax]
+			
+			# The event is closed between two consecutive points above
+			# threshold if there is at least a point below threshold in
+			# between that is more than time_resolution points past the
+			# running peak.
+			breaks = np.flatnonzero( (np.diff(indexes) > 1) & (indexes[1:]-1-running_peak[:-1] > time_resolution) )
+			end = breaks[0] if ( breaks.size > 0 ) else indexes.size-1
+			
+			first.append(indexes[0])
+			last.append(indexes[end])
+			peaks.append(running_peak[end])
+			peak_values.append(cluster_values[running_argmax[end]])
+			closed.append(True)
+			
+			position += end+1
+	
+	# The last event is only closed if there is a point below threshold
+	# more than time_resolution points after its peak
+	segment_end = abs_series.size-1
+	if not ( (segment_end > last[-1]) and (segment_end-peaks[-1] > time_resolution) ):
+		closed[-1] = False
+	
+	first, last = np.array(first), np.array(last)
+	peaks, peak_values = np.array(peaks), np.array(peak_values)
+	closed = np.array(closed)
+	
+	# Discard the glitch IF there's less than 2 points above threshold
+	keep = ~closed | ( (last-first) >= 2 )
+	
+	return first[keep], last[keep], peaks[keep], peak_values[keep], closed[keep]
+
+
+def spike_features(data, peaks, f_sampl, spike_width):
+	'''
+		Computes the features of all the transients found in a segment at
+		once: waveforms are gathered into a single 2-D array (one row per
+		transient) through fancy indexing and their PSDs are computed with a
+		single batched rfft (see transient_psd() in `pcat.spike`).
+		
+		Waveform samples falling outside of 'data' are set to zero.
+		
+		Arguments:
+			- data (array)
+				Time series.
+			- peaks (array)
+				Indexes (in 'data') of the transients' peaks.
+			- f_sampl (float)
+				Sampling frequency.
+			- spike_width (integer)
+				Number of points at which the transients are sampled.
+		
+		Output:
+			(waveforms, psds, energies, polarities) (tuple of arrays)
+				- waveforms
+					2-D array with the waveforms, multiplied by their
+					polarity so that the maximum is always positive.
+				- psds
+					2-D array with the (one-sided) PSDs of the waveforms.
+				- energies
+					Sum of the squared waveforms.
+				- polarities
+					Sign of the maximum of each waveform (1 or -1).
+	'''
+	offsets = np.arange(-(spike_width//2), spike_width//2)
+	indexes = np.asarray(peaks, dtype=int)[:, np.newaxis] + offsets
+	outside = (indexes < 0) | (indexes >= data.size)
+	waveforms = data[np.clip(indexes, 0, data.size-1)]
+	waveforms[outside] = 0.0
+	
+	# The squared SNR per unit frequency for a signal g(t) is defined as
+	#	SNR^2(f) = 2 * |g(f)|^2/Pxx(f)
+	# Factor of two beause the numerator should be g(f)*g_conj(f) + g_conj(f)*g(f)
+	# where g(f) is the Fourier transform of g(t) and Pxx is the 
+	# detector spectrum.
+	# Thus the total SNR:
+	#	SNR^2 = 4*\int_0^\infty |g(f)|^2/Pxx(f) df
+	# Since g(f) is symmetric around f  (time series is real)/
+	psds = transient_psd(waveforms, f_sampl)
+	
+	energies = (waveforms**2).sum(axis=1)
+	
+	# Check spike polarity
+	maxima = waveforms[np.arange(len(waveforms)), np.argmax(np.abs(waveforms), axis=1)]
+	polarities = np.where(maxima > 0, 1, -1)
+	waveforms *= polarities[:, np.newaxis]
+	
+	return waveforms, psds, energies, polarities
+
+
+def find_spikes_algorithm(data, removed_points, f_sampl, threshold, time_resolution, data_name, spike_width, normalization=None, segment_table=None, spectra=None):
 	'''
 		This function searches for the spikes in the data segments
 		and saves parameters for each found spike in the attributes of the
@@ -279,6 +435,9 @@ def find_spikes_algorithm(data, removed_points, f_sampl, threshold, time_resolut
 		they are in the form same form as
 			L-R-L1:PSL-FSS_FAST_MON_OUT_DQ_GPSSTART-GPSEND.data.something
 			IFO-FRAME_TYPE-CHANNEL_GPSSTART-GPSEND.data.something
+		Triggers are found through find_triggers(), their features are
+		computed for the whole segment at once through spike_features().
+		
 		Arguments:
 		- data (array)
 			Time series
@@ -294,162 +453,85 @@ def find_spikes_algorithm(data, removed_points, f_sampl, threshold, time_resolut
 			Name of the file containing 'data'
 		- spike_width (integer)
 			Number of points at which the found transients should be sampled.
+		- normalization (string, optional)
+			"energy" or "amplitude" (see find_spikes()). If None, spike.norm
+			is the peak absolute value of the time series.
+		- segment_table (SegmentTable, optional)
+			The segment PSD and the frequencies are added to this table,
+			spikes only store their index (spike.segment_index).
+			If None a new table is used.
+		- spectra (dictionary, optional)
+			Spectral products of the conditioning (see whiten(..., spectra=True)
+			in `pcat.condition`): the 'psd' used to condition the segment
+			and its 'frequencies' are added to segment_table. If None,
+			the PSD of the segment is estimated from 'data'.
 	Output:
 		- spikes (list)
 			A list fo Spike() class istances
 	'''
 		
 	spikes = []
-	"""
-	fig = plt.figure()
-	ax = fig.add_subplot(111)
-	( start, end ) = (data_name.split("/")[-1]).split('.')[0].split('_')[-1].split('-')
-	t = np.linspace(int(start), int(end), len(data[removed_points:-removed_points]))
-	ax.plot(t, data[removed_points:-removed_points])
-	ax.plot(t, threshold*np.ones(len(data[removed_points:-removed_points])))
-	ax.plot(t, -threshold*np.ones(len(data[removed_points:-removed_points])))
-	fig.savefig("{0}-{1}.svg".format(start, end))
-	plt.close()
-	"""
 	
 	to_analyze = data[removed_points:-removed_points]
 	
-	last_spike_index = 0		# Last spike index is the last index of the 
-								# spike above threshold
-	max_spike_index = 0
-	max_spike_value = 0
-	HAS_SPIKE = False
-	
 	( start, end ) = (data_name.split("/")[-1]).split('.')[0].split('_')[-1].split('-')
 	
-	# Choose NFFT to have a frequency resolution of 1 Hz or better
+	first_indexes, last_indexes, max_indexes, max_values, closed = find_triggers(to_analyze, threshold, time_resolution)
+	
+	if ( max_indexes.size == 0 ):
+		return spikes
 	
-	if (spike_width < f_sampl):
-		window = np.hanning(spike_width)
-		window_norm = (window**2).sum()/spike_width
+	if spectra is not None:
+		freqs, psd = spectra['frequencies'], spectra['psd']
+	# Choose NFFT to have a frequency resolution of 1 Hz or better
+	elif (spike_width < f_sampl):
 		freqs, psd = median_mean_average_psd(to_analyze, int(f_sampl), f_sampl)
 	else:
-		window = np.hanning(f_sampl)
-		window_norm = (window**2).sum()/float(f_sampl)
 		freqs, psd = median_mean_average_psd(to_analyze, spike_width, f_sampl)
 	
-	delta_t = 1.0/f_sampl
-	
-	segment_length = len(to_analyze)
-	for index, point in enumerate(to_analyze):
-		if (abs(point) > threshold):
-			if not HAS_SPIKE:
-				first_spike_index = index
-				HAS_SPIKE = True
-				max_spike_index = index
-				max_spike_value = abs(point)
-			elif (abs(point) > max_spike_value):
-				max_spike_value = abs(point)
-				max_spike_index = index
-			
-			last_spike_index = index
-		
-		elif (index-max_spike_index > time_resolution ) and HAS_SPIKE:
-			# We're now outside the search range for the spike: save the 
-			# current spike and start over.
-						
-			# Discard the glitch IF there's less than 2 points above threshold
-			if ( (last_spike_index-first_spike_index) < 2 ):
-				HAS_SPIKE = False
-				max_spike_value = 0
-				max_spike_index = 0
-				continue
-			
-			# Save waveform
-			waveform = data[max_spike_index+removed_points-spike_width/2:max_spike_index+removed_points+spike_width/2] 
-			# Instantiate Spike object
-			first_index, last_index = first_spike_index+removed_points, last_spike_index+removed_points
-			max_index = max_spike_index+removed_points
-			peak_GPS = (int(start)+ ( max_index / f_sampl ))
-			spike = Spike(first_index, last_index,
-							max_index, max_spike_value,
-							peak_GPS, int(start), int(end),
-							waveform, f_sampl)
-			
-			# The squared SNR per unit frequency for a signal g(t) is defined as
-			#	SNR^2(f) = 2 * |g(f)|^2/Pxx(f)
-			# Factor of two beause the numerator should be g(f)*g_conj(f) + g_conj(f)*g(f)
-			# where g(f) is the Fourier transform of g(t) and Pxx is the 
-			# detector spectrum.
-			# Thus the total SNR:
-			#	SNR^2 = 4*\int_0^\infty |g(f)|^2/Pxx(f) df
-			# Since g(f) is symmetric around f  (time series is real)/
-			
-			# Factor of two in psd because rfft is one sided.
-			spike.psd = 2 * 1.0/window_norm * 1.0 *  np.abs(delta_t*np.fft.rfft(spike.waveform*window, n=int(f_sampl)))**2
-			spike.psd[0] /= 2.0
-			spike.fft_freq = freqs
-			
-			spike.segment_psd = psd
-			
-			# We don't need the factor of 4 in front of the integral because both spike.psd and psd
-			# are one-sided and are correctly normalized
-			spike.SNR = np.sqrt( 4* (np.array(spike.waveform)**2).sum() * 2 * f_sampl )
-			
-			# Check spike polarity
-			if (spike.waveform[np.argmax(np.abs(spike.waveform))] > 0):
-				spike.polarity = 1
-			else:
-				spike.waveform *= -1
-				spike.polarity = -1
-			
-			# Save Spike object
-			spikes.append(spike)
-			
-			HAS_SPIKE = False
-			max_spike_value = 0
-			max_spike_index = 0
+	if segment_table is None:
+		segment_table = SegmentTable()
+	segment_index = segment_table.add(int(start), int(end), psd, freqs)
+	
+	waveforms, psds, energies, polarities = spike_features(data, max_indexes+removed_points,
+															f_sampl, spike_width)
+	
+	# We don't need the factor of 4 in front of the integral because both spike.psd and psd
+	# are one-sided and are correctly normalized
+	# (transients closed inside the segment have always carried an
+	# extra factor of 4, this is kept so that SNRs do not change)
+	SNRs = np.sqrt( np.where(closed, 4, 1) * energies * 2 * f_sampl )
+	
+	if ( normalization == "energy" ):
+		norms = np.sqrt(energies)
+	elif ( normalization == "amplitude" ):
+		norms = np.max(np.abs(waveforms), axis=1)
+	else:
+		norms = max_values
+	
+	first_indexes, last_indexes = first_indexes+removed_points, last_indexes+removed_points
+	max_indexes = max_indexes+removed_points
+	peak_GPSs = int(start) + ( max_indexes / f_sampl )
 	
-	if HAS_SPIKE:
-		# Save waveform
-		waveform = data[max_spike_index+removed_points-spike_width/2:max_spike_index+removed_points+spike_width/2] 
+	for index in range(max_indexes.size):
 		# Instantiate Spike object
-		first_index, last_index = first_spike_index+removed_points, last_spike_index+removed_points
-		max_index = max_spike_index+removed_points
-		peak_GPS = (int(start)+ ( max_index / f_sampl ))
-		spike = Spike(first_index, last_index,
-						max_index, max_spike_value,
-						peak_GPS, int(start), int(end),
-						waveform, f_sampl)
+		spike = Spike(first_indexes[index], last_indexes[index],
+						max_indexes[index], norms[index],
+						peak_GPSs[index], int(start), int(end),
+						waveforms[index], f_sampl)
 		
-		# The squared SNR per unit frequency for a signal g(t) is defined as
-		#	SNR^2(f) = 2 * |g(f)|^2/Pxx(f)
-		# Factor of two beause the numerator should be g(f)*g_conj(f) + g_conj(f)*g(f)
-		# where g(f) is the Fourier transform of g(t) and Pxx is the 
-		# detector spectrum.
-		# Thus the total SNR:
-		#	SNR^2 = 4*\int_0^\infty |g(f)|^2/Pxx(f) df
-		# Since g(f) is symmetric around f  (time series is real)/
+		spike.psd = psds[index]
+		spike.segment_index = segment_index
 		
-		# Factor of two in psd because rfft is one sided.
-		spike.psd = 2 * 1.0/window_norm * 1.0 *  np.abs(delta_t*np.fft.rfft(spike.waveform*window, n=int(f_sampl)))**2
-		spike.psd[0] /= 2.0
-		spike.fft_freq = freqs
-		
-		spike.segment_psd = psd
-		
-		# We don't need the factor of 4 in front of the integral because both spike.psd and psd
-		# are one-sided and are correctly normalized
-		spike.SNR = np.sqrt( (np.array(spike.waveform)**2).sum() * 2 * f_sampl )
-		
-		# Check spike polarity
-		if (spike.waveform[np.argmax(np.abs(spike.waveform))] > 0):
-			spike.polarity = 1
-		else:
-			spike.waveform *= -1
-			spike.polarity = -1
+		spike.SNR = SNRs[index]
+		spike.polarity = polarities[index]
 		
 		# Save Spike object
 		spikes.append(spike)
 	
 	return spikes
 
-def find_spikes(data, metadata, threshold, spike_width, time_resolution, removed_seconds, f_sampl, normalization=None):
+def find_spikes(data, metadata, threshold, spike_width, time_resolution, removed_seconds, f_sampl, normalization=None, segment_table=None, spectra=None):
 	'''
 		Load all the files in the 'file_list' list and searches for spikes, using the
 		find_spikes_algorithm.
@@ -474,6 +556,12 @@ def find_spikes(data, metadata, threshold, spike_width, time_resolution, removed
 		
 					If energy, spikes are normalized to unit energy, if amplitude, spikes are normalized to
 					unit maximum amplitude, if None, spikes are not normalized.
+			segment_table:
+					SegmentTable() to which the segment PSD is added
+					(see find_spikes_algorithm()).
+			spectra:
+					Spectral products of the conditioning, used instead of
+					estimating the segment PSD (see find_spikes_algorithm()).
 		
 	'''
 	spikes_list = []
@@ -483,25 +571,25 @@ def find_spikes(data, metadata, threshold, spike_width, time_resolution, removed
 	# due to the fourier transforms.
 	
 	removed_points = int(removed_seconds*f_sampl)
-		
+	
+	if normalization not in ( "energy", "amplitude", None ):
+		print "Other normalizations have yet to be implemented" 
+		assert False
+	
 	sigma = np.std(data[removed_points:-removed_points])
 	found_spikes = find_spikes_algorithm(data, removed_points, f_sampl, threshold*sigma,\
-	 								time_resolution, metadata, spike_width)
+	 								time_resolution, metadata, spike_width, normalization=normalization,
+									segment_table=segment_table, spectra=spectra)
 	
 	if ( len(found_spikes) != 0 ):
 		spikes_number += len(found_spikes)
 		spikes_list.extend( found_spikes )
 	
-	for spike in found_spikes:
-		if ( normalization == "energy" ):
-			spike.norm = linalg.norm(spike.waveform)
-		elif ( normalization == "amplitude" ):
-			spike.norm = np.max(np.abs(spike.waveform))
-		elif ( normalization == None ):
+	# Norms for "energy" and "amplitude" are computed for the whole segment
+	# in find_spikes_algorithm()
+	if ( normalization == None ):
+		for spike in found_spikes:
 			spike.norm = 1.0
-		else:
-			print "Other normalizations have yet to be implemented" 
-			assert False
 			
 	return spikes_list
 
@@ -41,6 +41,8 @@ import warnings
 
 from .utils import *
 from .pca import standardize, eigensystem, PCA, load_data, matrix_whiten
+from .database import SpikeDatabase, DATABASE_EXTENSION
+from . import fft_backend
 import matplotlib.mlab
 from matplotlib.image import NonUniformImage
 
@@ -162,8 +164,8 @@ def check_options_and_args():
 		print "No input files."
 		print "Use GMM.py -h for usage." 
 		print "Example of usage:"
-		print "\t GMM.py --time -s 32768 file.list"
-		print "\t GMM.py --frequency -s 32768 file.list\n"
+		print "\t GMM.py --time -s 32768 file.db"
+		print "\t GMM.py --frequency -s 32768 file.db\n"
 		print "\t GMM.py [--log] matrix_database.data\n"
 		print "\t GMM.py --freq --low --high matrix_database.data\n"
 		
@@ -729,21 +731,18 @@ def remove_clusters(database, labels):
 				break
 			else:
 				keyboard_input = raw_input( "Input has to be a number in the range 1 to "+str(cluster_number)+". Try again:\n" )
-	indexes_to_remove = list()
-	new_database = []
-	removed_transients = 0
-	for index, observation in enumerate(database):
-		if labels[index] not in clusters_to_remove:
-			new_database.append(observation)
-		else:
-			removed_transients += 1	
+	indexes_to_keep = [ index for index in range(len(database)) if labels[index] not in clusters_to_remove ]
+	removed_transients = len(database)-len(indexes_to_keep)
+	
+	if isinstance(database, SpikeDatabase):
+		new_database = database.subset(indexes_to_keep)
+	else:
+		new_database = SpikeDatabase.from_spikes([ database[index] for index in indexes_to_keep ])
 	
 	print removed_transients, "transients removed."
-	print "Saving "+OUTPUT+".list"
-	f = open( OUTPUT+".list", "wb" )
-	pickle.dump(new_database, f)
-	f.close()
-	print "You now may re-run GMM.py on "+OUTPUT+".list."
+	print "Saving "+OUTPUT+DATABASE_EXTENSION
+	new_database.save( OUTPUT+DATABASE_EXTENSION )
+	print "You now may re-run GMM.py on "+OUTPUT+DATABASE_EXTENSION+"."
 
 
 def print_lists(database, labels, cluster_number, ANALYSIS):
@@ -844,8 +843,9 @@ def spike_time_series(database, PCA_info, components_number, labels, f_sampl, RE
 		  principal components. Only using the first few principal components will reduce noise in the time series
 		  and make the "true" shape of the glitch more clear.
 		
-		The reconstructed time series are also saved in the spike.reconstructed attribute of spike, with the number
-		of components used saved in spike.PCs_used
+		The reconstructed time series are also available as the spike.reconstructed attribute of spike (a view
+		of the reconstructed data matrix, see Spike.set_reconstruction()), with the number of components used
+		saved in spike.PCs_used
 
 	'''
 	spikes_number = len(database)
@@ -854,7 +854,6 @@ def spike_time_series(database, PCA_info, components_number, labels, f_sampl, RE
 	# If RECONSTRUCT is true, generate an array of 'reconstructed' using the 
 	# first few principal components
 	if RECONSTRUCT:
-		reconstructed = []
 		# Unpack the tuple
 		score_matrix, principal_components, means, sigmas = PCA_info
 		# Replace all the coefficients for principal components with index 
@@ -867,11 +866,9 @@ def spike_time_series(database, PCA_info, components_number, labels, f_sampl, RE
 		for index, spike in enumerate(database):
 			# Before the PCA is computed, all waveforms are normalized
 			# by divind them by the norm attribute. To correctly invert
-			# the PCA, one has to multiply by norm.
-			tmp = new_data[index]*database[index].norm
-			reconstructed.append(tmp)
-			spike.reconstructed = tmp
-			spike.PCs_used = components_number
+			# the PCA, one has to multiply by norm (done by the spike when
+			# spike.reconstructed is accessed).
+			spike.set_reconstruction(new_data, index, components_number)
 	
 	
 	# Create a progress bar
@@ -914,7 +911,7 @@ def spike_time_series(database, PCA_info, components_number, labels, f_sampl, RE
 			ax.set_xlabel("Time [ms]")
 			ax.set_ylabel("Amplitude [counts] ")
 			if RECONSTRUCT:
-				ax.plot( x_axis, spike.polarity*reconstructed[index], 'r', label="Reconstructed - {0} PCs".format(components_number))
+				ax.plot( x_axis, spike.polarity*spike.reconstructed, 'r', label="Reconstructed - {0} PCs".format(components_number))
 				labels_list.append( "Reconstructed - {0} PCs".format(components_number) )
 				ax.legend(labels_list, loc = 'best', markerscale = 2, numpoints = 1)
 				ax1.plot( x_axis, spike.polarity*spike.waveform, "b", label="Raw 2")
@@ -926,7 +923,7 @@ def spike_time_series(database, PCA_info, components_number, labels, f_sampl, RE
 			plt.xlim( ( 0, waveform_length ) )
 			ax.plot(spike.waveform, label="Raw")
 			if RECONSTRUCT:
-				ax.plot( spike.polarity*reconstructed[index], "r", label="Reconstructed - {0} PCs".format(components_number) )
+				ax.plot( spike.polarity*spike.reconstructed, "r", label="Reconstructed - {0} PCs".format(components_number) )
 				labels_list.append( "Reconstructed - {0} PCs".format(components_number) )
 				ax.legend(labels_list, loc = 'best', markerscale = 2, numpoints = 1)
 				ax1.plot( x_axis, spike.waveform, "b", label="Raw" )
@@ -952,8 +949,8 @@ def plot_psds(database, PCA_info, components_number, labels, f_sampl, ANALYSIS="
 		
 		If "bands" in analysis, rescale the axis to be between 'low' and 'high' (global variables).
 		
-		The reconstructed time series are also saved in the spike.reconstructed attribute of spike, with the number
-		of components used saved in spike.PCs_used
+		The reconstructed time series are also available as the spike.reconstructed attribute of spike, with the
+		number of components used saved in spike.PCs_used
 	'''
 	psd_number = len(database)
 	waveform_length = len(database[0].waveform)
@@ -961,7 +958,6 @@ def plot_psds(database, PCA_info, components_number, labels, f_sampl, ANALYSIS="
 	# If RECONSTRUCT is true, generate an array of 'reconstructed' using the 
 	# first few principal components
 	if RECONSTRUCT:
-		reconstructed = []
 		# Unpack the tuple
 		score_matrix, principal_components, means, stds = PCA_info
 		# Replace all the coefficients for principal components with index 
@@ -974,10 +970,7 @@ def plot_psds(database, PCA_info, components_number, labels, f_sampl, ANALYSIS="
 		# Replace time series in the database with the new reconstructed
 		# time series
 		for index, spike in enumerate(database):
-			tmp = new_data[index]*database[index].norm
-			reconstructed.append(tmp)
-			spike.reconstructed = tmp
-			spike.PCs_used = components_number
+			spike.set_reconstruction(new_data, index, components_number)
 	
 	
 	# Create a progress bar
@@ -1005,9 +998,9 @@ def plot_psds(database, PCA_info, components_number, labels, f_sampl, ANALYSIS="
 		ax.set_autoscaley_on(True)
 		if RECONSTRUCT:
 			if ( "bands" in ANALYSIS):
-				ax.plot( freq_array, np.power(10, reconstructed[index]), label="Reconstructed - {0} PCs".format(components_number) )
+				ax.plot( freq_array, np.power(10, spike.reconstructed), label="Reconstructed - {0} PCs".format(components_number) )
 			else:
-				ax.plot( freq_array, np.power(10,reconstructed[index]), label="Reconstructed - {0} PCs".format(components_number) )
+				ax.plot( freq_array, np.power(10, spike.reconstructed), label="Reconstructed - {0} PCs".format(components_number) )
 			labels_list.append( "Reconstructed - {0} PCs".format(components_number) )
 			ax.legend(labels_list, loc = 'best', markerscale = 2, numpoints = 1)
 		ax.set_xscale('log')
@@ -1020,7 +1013,7 @@ def plot_psds(database, PCA_info, components_number, labels, f_sampl, ANALYSIS="
 			ax.set_xticklabels([ "%.2f" % el for el in ax.get_xticks()])
 		else:
 			ax.plot( freq_array, np.power(10, spike.waveform), 'r-', linewidth = 0.4 )
-		fig.savefig( "PSDs/Type_%i/%i-%i.png" % (labels[index]+1, spike.segment_start, spike.segment_end), bbox_inches='tight', pad_inches=0.2)
+		fig.savefig( "PSDs/Type_%i/%s-%s.png" % (labels[index]+1, spike.segment_start, spike.segment_end), bbox_inches='tight', pad_inches=0.2)
 		plt.close('all')
 		del fig
 		if not SILENT:
@@ -1352,11 +1345,13 @@ def matched_filtering_test(database, labels, ANALYSIS):
 		
 		
 	for index, cluster in enumerate(colored_database):
-		median = np.median([spike.waveform for spike in cluster], axis=0 )
+		waveforms = np.array([spike.waveform for spike in cluster])
+		median = np.median(waveforms, axis=0 )
 		representatives.append(median)
 		# np.corrcoef returns the correlation matrix, which is symmetric (2x2).
-		median_transform = np.fft.rfft(median)
-		spike_transforms = [np.fft.rfft(spike.waveform) for spike in cluster]
+		median_transform = fft_backend.rfft(median)
+		# Transform all the waveforms of the cluster at once
+		spike_transforms = fft_backend.rfft(waveforms, axis=-1)
 		
 		# Factor of two because the ffts are one-sided and we're integrating over all frequencies
 		matched_filters = [inner_product(median_transform, spike_transform) for spike_transform in spike_transforms]
@@ -1465,7 +1460,7 @@ def main():
 	
 	args = check_options_and_args()
 	
-	matrix, spike_database = load_data(args, ANALYSIS)
+	matrix, spike_database = load_data(args, True, ANALYSIS)
 	observations, samples = matrix.shape
 	print "Data matrix is %ix%i, %i observations of %i variables" % (observations, samples, observations, samples)
 	
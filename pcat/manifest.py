@@ -0,0 +1,150 @@
+# encoding: utf-8
+'''
+manifest.py
+
+Manifest of the stages of a pcat run, used to skip the stages whose inputs
+have not changed since the last run with the same output directory.
+
+A run is split in STAGES, each with a key which is the hash of its
+parameters and of the key of the previous stage (see stage_keys()), so that
+changing the parameters of a stage also invalidates the stages after it:
+	segments		->	Conditioning and trigger finding (each segment is also
+						cached, see `pcat.cache` and `pcat.triggers`)
+	data_matrix		->	Database/data matrix
+	PCA				->	Principal components and scores
+	clustering		->	Labels given by the clustering
+	plots			->	Plots and summary files
+
+When a stage is completed its key, the files (in the output directory) it
+produced and some information are recorded in 'manifest.json':
+	manifest = StageManifest(output_dir)
+	first = manifest.check(stage_keys(parameters))	# first stage to run
+	if not manifest.done("PCA"):
+		...
+		manifest.record("PCA", ["PCA.npz"])
+
+Contains:
+	- STAGES
+	- StageManifest
+	- stage_keys()
+'''
+
+import os
+import json
+import hashlib
+from shutil import rmtree
+
+
+STAGES = ( "segments", "data_matrix", "PCA", "clustering", "plots" )
+
+
+def stage_keys(parameters):
+	'''
+	Returns a dictionary with the key of each stage, given a dictionary
+	with the parameters (dictionaries of strings, numbers, booleans and
+	lists) of each stage.
+	'''
+	keys = {}
+	previous = None
+	for stage in STAGES:
+		previous = hashlib.sha1(json.dumps([ previous, parameters.get(stage, {}) ], sort_keys=True)).hexdigest()[:16]
+		keys[stage] = previous
+	return keys
+
+
+class StageManifest:
+	'''
+	Manifest of the completed stages of a run, see the module docstring.
+
+	Attributes:
+		directory		->	Output directory of the run
+		file_name		->	Manifest file
+		stages			->	{ stage: { 'key', 'files', 'info' } } for the
+							completed stages
+		keys			->	Keys of the stages for this run (see check())
+	'''
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.file_name = os.path.join(directory, "manifest.json")
+		self.keys = {}
+		try:
+			with open(self.file_name) as f:
+				self.stages = json.load(f)
+		except (IOError, ValueError):
+			self.stages = {}
+
+	def files(self):
+		'''
+		Files recorded by the completed stages (and the manifest itself),
+		relative to the output directory.
+		'''
+		names = [ os.path.basename(self.file_name) ]
+		for stage in self.stages.itervalues():
+			names.extend(stage['files'])
+		return names
+
+	def _save(self):
+		# Write to a temporary file and rename it, so that a crash never
+		# leaves a partially written manifest
+		with open(self.file_name + ".tmp", "w") as f:
+			json.dump(self.stages, f, sort_keys=True, indent=1)
+		os.rename(self.file_name + ".tmp", self.file_name)
+
+	def _complete(self, stage):
+		return all( os.path.exists(os.path.join(self.directory, name)) for name in self.stages[stage]['files'] )
+
+	def check(self, keys):
+		'''
+		Sets the keys of the stages for this run, removes the first stage
+		whose key has changed (or whose files are missing) and the stages
+		after it, together with their files.
+		Returns the first stage which has to be run, None if all the stages
+		are completed.
+		'''
+		self.keys = keys
+		first = None
+		for stage in STAGES:
+			if ( first is None ) and ( stage in self.stages ) and ( self.stages[stage]['key'] == keys[stage] )\
+			 and self._complete(stage):
+				continue
+			if first is None:
+				first = stage
+			self.clear(stage)
+		return first
+
+	def clear(self, stage=None):
+		'''
+		Removes the stage (all the stages if None) and its files.
+		'''
+		for name in ( [ stage ] if stage is not None else STAGES ):
+			if name not in self.stages:
+				continue
+			for file_name in self.stages.pop(name)['files']:
+				path = os.path.join(self.directory, file_name)
+				if os.path.isdir(path):
+					rmtree(path, ignore_errors=True)
+				elif os.path.exists(path):
+					os.remove(path)
+		self._save()
+
+	def done(self, stage):
+		'''
+		True if the stage has been completed with the key set by check().
+		'''
+		return ( stage in self.stages ) and ( self.stages[stage]['key'] == self.keys.get(stage) )
+
+	def record(self, stage, files=(), **info):
+		'''
+		Records the stage as completed, with the files (relative to the
+		output directory) it produced and any information (JSON
+		serializable) needed to skip it.
+		'''
+		self.stages[stage] = { 'key': self.keys[stage], 'files': list(files), 'info': info }
+		self._save()
+
+	def info(self, stage):
+		'''
+		Information recorded by the stage.
+		'''
+		return self.stages[stage]['info']
@@ -5,6 +5,7 @@
 #from mpl_toolkits.mplot3d import axes3d
 
 from pcat.utils import *
+from pcat.database import SpikeDatabase, load_database
 STANDARDIZE_COLUMNS = False
 
 global DPI
@@ -318,8 +319,13 @@ def histogram(data, component_N, bins):
 
 
 def load_data(file_list, pickled, ANALYSIS="time"):
-	'''Loads the database (pickled) and returns a matrix with the observations
-	in the rows and the loaded list of observations.
+	'''Loads the database and returns a matrix with the observations
+	in the rows and the loaded database.
+	
+	If 'pickled', the input files are PCAT databases, either columnar (see
+	`pcat.database`) or legacy pickled lists of Spike() objects. A
+	SpikeDatabase is returned, for a single columnar database the time-domain
+	data matrix is a (copy-on-write) memory-mapped view of its waveforms.
 	
 	ANALYSIS sets how data is loaded, depending on the input options, and
 	whether a model is given (--compare):
@@ -330,40 +336,48 @@ def load_data(file_list, pickled, ANALYSIS="time"):
 	 									the observation, normalized by the 'norm'
 										attribute.
 	- ANALYSIS = 'frequency'		---> Loads the data from a list of Spike() class objects
-	 									'waveform' attribute and takes base-10 logarithm.
+	 									'waveform' attribute and takes base-10 logarithm
+	 									(unless the database already stores it, as
+	 									the ones saved by pcat --frequency).
 	- ANALYSIS = 'time_diff'		---> Loads the difference between the model and
 										the base-10 logarithm of the observation.			
 	- ANALYSIS = 'generic_log'		---> Loads the data and takes base-10 logarithm.
 	- ANALYSIS = 'generic'		---> Loads the data and takes base-10 logarithm.
 	'''
 	
-	database = list()
+	# If called with the --frequency_compare option, PCA is performed on the 
+	# difference between the input model and the obsevations.
+	model_waveform = None
+	if ( "diff" in ANALYSIS ):
+		model_waveform = np.loadtxt(MODEL)
+	
 	if pickled:
-		for element in file_list:
-			f = open(element, "rb")
-			database.extend( pickle.load(f) )
-			f.close()
-	else:
-		for element in file_list:
-			database.extend( np.loadtxt(element) )
+		# PCA() whitens the data matrix in place: load copy-on-write so that
+		# the saved database is not modified
+		databases = [ load_database(element, mmap_mode='c') for element in file_list ]
+		if ( len(databases) == 1 ):
+			database = databases[0]
+		else:
+			database = SpikeDatabase.concatenate(databases)
+		data = database.data_matrix(ANALYSIS, model_waveform)
+		return data, database
+	
+	database = list()
+	for element in file_list:
+		database.extend( np.loadtxt(element) )
 	# Retrieve the waveforms, normalizing them by spike.norm
 	# If called with the --frequency option, logarithm is applied to
 	# the normalized waveform.
-	# If called with the --frequency_compare option, PCA is performed on the 
-	# difference
-	# between the input model and the obsevations.
 	waveforms = list()
-	if ( "diff" in ANALYSIS ):
-		model_waveform = np.loadtxt(MODEL)
 	for observation in database:
 			if ( ANALYSIS == 'time' ):
 				waveforms.append( (observation.waveform)/(observation.norm) )
 			elif ( ANALYSIS == 'time_diff' ):
-				waveforms.append( np.abs( model-( (observation.waveform)/(observation.norm) ) ) )
+				waveforms.append( np.abs( model_waveform-( (observation.waveform)/(observation.norm) ) ) )
 			elif ( ANALYSIS == 'frequency' ):
 				waveforms.append( np.log( (observation.waveform)/(observation.norm) )/np.log(10) )
 			elif ( ANALYSIS == 'frequency_diff' ):
-				waveforms.append( np.log(model)/np.log(10)-np.log( (observation.waveform)/(observation.norm) )/np.log(10) )
+				waveforms.append( np.log(model_waveform)/np.log(10)-np.log( (observation.waveform)/(observation.norm) )/np.log(10) )
 			elif ( ANALYSIS == "generic_log"):
 				waveforms.append( np.log(observation.waveform)/np.log(10) )
 			elif ( ANALYSIS == "generic"):
@@ -409,7 +423,7 @@ def main():
 		
 	# Load and analyze data
 	if not ( PICKLED_SCORES ):
-		data, observations = load_data(args, ANALYSIS)
+		data, observations = load_data(args, True, ANALYSIS)
 		rows, columns = np.shape(data)
 		print "Input is a", str(rows)+"x"+str(columns), "matrix."
 		print "Performing PCA..."
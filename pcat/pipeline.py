@@ -23,7 +23,8 @@ PCAT Pipeline:
 		Uses various functions from `pcat.condition`
 		
 		Data conditioning and retriveval is sped up by launching multiple
-		processes, defined by the PARALLEL_PROCESSES variable (see below).
+		processes, defined by the PARALLEL_PROCESSES variable (see below),
+		which take batches of segments as they become free.
 		
 	3) Create database
 		Create a database from the previously processed data.
@@ -54,9 +55,18 @@ import sys
 
 from time import asctime, localtime
 
-# Number of parallel processes to run when conditioning data
+# Number of parallel processes to run when conditioning data, 0 to choose it
+# from the available cores and memory (see --processes)
 global PARALLEL_PROCESSES
-PARALLEL_PROCESSES = 4
+PARALLEL_PROCESSES = 0
+# Segment-sized arrays held by each worker process while conditioning, used
+# to estimate the memory it needs
+WORKER_MEMORY_SEGMENTS = 8
+# Number of batches after which a worker process is replaced by a new one,
+# 0 to never replace them (see --tasks_per_worker)
+WORKER_TASKS = 50
+# Seconds between checks that the worker processes are still running
+WORKER_POLL_SECONDS = 5
 
 # Maximum number of principal components scores shown in the triangle plot
 # since the number of subplots in the triangle plot is n(n+1)/2, just having
@@ -89,6 +99,37 @@ segment_size = 8
 download_overlap_seconds = 4
 # Chunk padding in percent (1 = 100%)
 download_overlap = 0.5
+# Each worker process reads data through its own BlockReader (see
+# `pcat.data`), set in worker(), and a PrefetchReader reading the next
+# segments in the background while the current one is processed
+block_reader = None
+prefetch_reader = None
+# Time (in seconds) the worker process waited for data in read_segment()
+read_wait_time = 0.0
+# Segments the worker process found (hits) or did not find (misses) in the
+# conditioning cache (see `pcat.cache`)
+cache_hits = 0
+cache_misses = 0
+# PSDTracker used by each worker process to whiten its segments with a PSD
+# estimated over --psd_lookback seconds (see `pcat.condition`)
+psd_tracker = None
+# StreamingFilter used by each worker process with --streaming, the filter
+# state is carried from one segment to the next one (see `pcat.condition`)
+streaming_filter = None
+# StreamingResampler used by each worker process when whitening with
+# polyphase resampling (see `pcat.utils`)
+resampler = None
+# SpectralStore used by frequency-domain analyses with --spectral_store, PSDs
+# are computed once per segment and shared by all resolutions (see
+# `pcat.spectra`)
+spectral_store = None
+# SegmentStore containing the conditioned time series (and their spectral
+# products) of the interval, opened by each worker process in time-domain
+# analysis (see `pcat.store`)
+conditioned_store = None
+# TriggerCache containing the transients found in each segment, opened by
+# each worker process in time-domain analysis (see `pcat.triggers`)
+trigger_cache = None
 
 #####################
 
@@ -111,13 +152,22 @@ max_clusters = 10
 
 
 from glob import glob
+from Queue import Empty
 
 from pcat.utils import *
 
-from pcat.data import retrieve_timeseries
+from pcat.data import retrieve_timeseries, set_data_source, data_source, BlockReader, BLOCK_SECONDS
+from pcat.data import PrefetchReader, PREFETCH_DEPTH, PREFETCH_BYTES
 from pcat.condition import *
 
 from pcat.finder import find_spikes
+from pcat import fft_backend
+from pcat.spectra import SpectralStore
+from pcat.store import SegmentStore
+from pcat.cache import ConditioningCache, CACHE_MAX_BYTES
+from pcat.database import SpikeDatabase, DATABASE_EXTENSION, merge_databases, is_database
+from pcat.triggers import TriggerCache
+from pcat.manifest import StageManifest, stage_keys
 from pcat.pca import PCA, create_data_matrix, eigensystem, matrix_whiten
 from pcat.gmm import gaussian_mixture, scatterplot, color_clusters, spike_time_series, matched_filtering_test, correlation_test
 from pcat.gmm import print_cluster_info, calculate_types, plot_psds, configure_subplot_time, configure_subplot_freq
@@ -220,7 +270,8 @@ def usage():
 	print "\tDefault overlap between neighbouring segments is 50%."
 	
 	print "   --highpasscutoff cutoff_frequency"
-	print "\tCutoff frequency for the high pass filter (with --whiten)."
+	print "\tCutoff frequency for the high pass filter (with --whiten). Older versions"
+	print "\tonly used it for the whitening coefficients, always filtering at 40 Hz."
 	
 	print "   --nohighpass    (with --whiten)"
 	print "\tDo not apply high-pass filter to input data."
@@ -236,6 +287,53 @@ def usage():
 	print "\tis given by high_frequency-low_frequency, use small value"
 	print "\tfor the PCA algorithm to run faster."
 	
+	print "   --psd_overlap overlap"
+	print "\tOverlap (in percent) between the windows used to compute the PSD of"
+	print "\teach segment through Welch's method (see `pcat.condition.welch_psds`)."
+	print "\tDefault is 50."
+	
+	print "   --spectral_store base_resolution"
+	print "\tStore the PSD of each segment at base_resolution (Hz, not larger than the"
+	print "\tanalyzed resolution) in the processing directory of the interval, and"
+	print "\tderive the analyzed PSDs from it (see `pcat.spectra`). Later runs on the"
+	print "\tsame interval with any coarser resolution (-v) or band (--low, --high)"
+	print "\tdo not read data again."
+	
+	print "   --stft window_seconds"
+	print "\tShort-time observations: instead of a single PSD per segment, compute the"
+	print "\tPSD of each window_seconds long window of the segment, sliding the window"
+	print "\tby --stft_stride seconds. The periodograms of each segment are computed"
+	print "\tonce and shared by overlapping windows (see `pcat.condition.stft_psds`)."
+	print "\tUse long segments (--size), default is 600 seconds with --stft."
+	
+	print "   --processes processes"
+	print "\tNumber of worker processes used to retrieve and condition data. Default"
+	print "\tis one per core, fewer if the available memory is not enough for all."
+	
+	print "   --batch segments"
+	print "\tNumber of contiguous segments in each task given to the worker processes,"
+	print "\twhich take a new task as soon as they are done with the previous one."
+	print "\tDefault is the number of segments in a read block (see --block), fewer"
+	print "\tfor short intervals so that each process gets several tasks."
+	print "\tWhen the conditioning carries state between segments (--psd_lookback,"
+	print "\t--streaming, polyphase resampling) batches are aligned to GPS multiples"
+	print "\tof this number of segments, and the default is always a read block."
+	
+	print "   --tasks_per_worker tasks"
+	print "\tReplace each worker process with a new one after it has processed"
+	print "\t'tasks' tasks (0 to never replace them). Default is {0}.".format(WORKER_TASKS)
+	
+	print "   --cache_size size"
+	print "\tMaximum size (in GB) of the cache of conditioned data (~/PCAT/Data/cache/)."
+	print "\tConditioned data is stored under a hash of the data source and of all"
+	print "\tthe conditioning parameters, the least recently used entries are removed"
+	print "\twhen the cache is larger than size (see pcat-cache). Use 0 for no limit."
+	print "\tDefault is {0:g} GB.".format(CACHE_MAX_BYTES/1024.0**3)
+	
+	print "   --stft_stride seconds"
+	print "\tTime between the start of consecutive --stft windows, default is half"
+	print "\tof window_seconds."
+	
 	print '\033[1m' + "Optional arguments:" + '\033[0m'
 	
 	print "   --size segment_size\n\tSize in seconds of the chunks in which data is split."
@@ -250,6 +348,59 @@ def usage():
 		
 	print "   --padding_percentage padding"
 	print "\tSame as above, though expressed in percentage of segment_size"
+	
+	print "   --block block_seconds"
+	print "\tData is read in blocks of (at most) block_seconds seconds, each block"
+	print "\tcontaining several (padded) segments, so that the padding shared by"
+	print "\tneighbouring segments is only read once. Use 0 to read each segment"
+	print "\tseparately. Default is {0} seconds.".format(BLOCK_SECONDS)
+	
+	print "   --psd_lookback seconds"
+	print "\tWhen whitening, estimate the PSD over the last 'seconds' seconds of data"
+	print "\t(e.g. 64 to 256 seconds) instead of on each segment alone. Consecutive"
+	print "\tsegments share their periodograms, giving a less noisy and cheaper"
+	print "\testimate. Default is 0 (each segment is whitened with its own PSD)."
+	
+	print "   --fused"
+	print "\tWith --whiten, apply the high-pass filter in the frequency domain only,"
+	print "\ttogether with the whitening coefficients, instead of filtering the time"
+	print "\tseries first (see `pcat.condition.whiten`). Equivalent results unless"
+	print "\tlow-frequency noise leaks into the PSD estimate. Slightly faster, by 5%"
+	print "\tto 30% depending on the machine (see 'benchmark.py --whitening')."
+	print "\tCan not be used with --nohighpass."
+	
+	print "   --resample_method method"
+	print "\tMethod used to resample data to the analysis frequency when whitening:"
+	print "\t\tpolyphase\tzero-phase polyphase FIR filter, any rational ratio"
+	print "\t\t\t\tbetween the sampling and analysis frequencies"
+	print "\t\tiir\t\tChebyshev filter and decimation, integer ratios only"
+	print "\t\tauto\t\t'iir' for integer ratios, 'polyphase' otherwise"
+	print "\tDefault is '{0}'.".format(RESAMPLE_METHOD)
+	
+	print "   --streaming"
+	print "\tWith --filter and high-pass (not with --whiten), filter contiguous"
+	print "\tsegments as a stream: the filter state is carried from one segment"
+	print "\tto the next one, so that the padding only has to cover the impulse"
+	print "\tresponse of the filter (computed automatically unless --padding_seconds"
+	print "\tor --padding_percentage are given) instead of several seconds."
+	
+	print "   --prefetch depth"
+	print "\tNumber of segments read in the background (by each process) while"
+	print "\tthe current segment is being conditioned and searched for transients."
+	print "\tUse 0 to read segments only when needed. Default is {0}.".format(PREFETCH_DEPTH)
+	
+	print "   --prefetch_memory MB"
+	print "\tMaximum memory (in MB, for each process) used by the segments read in"
+	print "\tthe background. Default is {0} MB.".format(PREFETCH_BYTES//1024**2)
+	
+	print "   --source url"
+	print "\tData source the time series are read from (see `pcat.data`):"
+	print "\t\tframes://\t\tframe files (default)"
+	print "\t\tfile:///path/to/folder\tnumpy (.npy) files, named as the files"
+	print "\t\t\t\t\tsaved with --save_timeseries"
+	print "\t\thdf5:///path/to/folder\tGWOSC HDF5 strain files"
+	print "\tLocal files can be used to run the analysis (and benchmark data"
+	print "\tretrieval and conditioning) offline."
 
 	print "   --components components_number"
 	print "\tNumber of components to be used when clustering in the"
@@ -297,6 +448,13 @@ def usage():
 	print "\tThe saved files (binary) can be used with python/numpy,"
 	print "\tusing numpy's 'load()'"
 	
+	print "   --resume"
+	print "\tContinue an interrupted run: batches of segments completed by the last"
+	print "\trun are not processed again. Stages whose parameters have not changed"
+	print "\tsince the last run (e.g. conditioning and trigger finding when only the"
+	print "\tnumber of clusters changes) are always skipped, see 'manifest.json' in"
+	print "\tthe output folder."
+	
 	print "   --noplot"
 	print "\tDo not plot transients/PSDs (makes run faster)"
 	
@@ -316,7 +474,10 @@ def usage():
 ##############################
 	
 def check_options_and_args(argv):
-	global components_number, psd_overlap, max_clusters, segment_size, download_overlap
+	global components_number, psd_overlap, max_clusters, segment_size, download_overlap, block_seconds, source_url
+	global prefetch_depth, prefetch_bytes, psd_lookback, STREAMING, resample_method, FUSED
+	global spectral_store_resolution, stft_window, stft_stride, cache_max_bytes
+	global PARALLEL_PROCESSES, batch_size, batch_given, tasks_per_worker
 	global LIST, CUSTOM_OUT, FILTER , WHITEN, HIGH_PASS, HIGH_PASS_CUTOFF, SAVE_TIMESERIES, NORESAMPLE, RESAMPLE
 	global HIGH_PASS
 	
@@ -324,7 +485,7 @@ def check_options_and_args(argv):
 	global frame_type, variables, normalization
 	global low, high, output_name, threshold, time_resolution, components_number
 	
-	global ANALYSIS, ANALYSIS_FREQUENCY, CLEAN, RECONSTRUCT, NOPLOT, SILENT
+	global ANALYSIS, ANALYSIS_FREQUENCY, CLEAN, RECONSTRUCT, NOPLOT, SILENT, RESUME
 	global AUTOCHOOSE_COMPONENTS, VARIANCE_PERCENTAGE
 
 	LIST = False
@@ -335,10 +496,12 @@ def check_options_and_args(argv):
 	RECONSTRUCT = False
 	components_number = 40
 	AUTOCHOOSE_COMPONENTS = False
+	VARIANCE_PERCENTAGE = None
 	
 	SILENT = False
 	NOPLOT = False
 	CLEAN = False
+	RESUME = False
 	NORESAMPLE = False
 	# Boolean: apply High Pass filter
 
@@ -359,6 +522,31 @@ def check_options_and_args(argv):
 	
 	normalization = "amplitude"
 	
+	block_seconds = BLOCK_SECONDS
+	
+	source_url = "frames://"
+	
+	prefetch_depth = PREFETCH_DEPTH
+	prefetch_bytes = PREFETCH_BYTES
+	
+	psd_lookback = 0
+	
+	STREAMING = False
+	
+	resample_method = RESAMPLE_METHOD
+	
+	FUSED = False
+	
+	spectral_store_resolution = None
+	
+	stft_window = 0
+	stft_stride = None
+	
+	cache_max_bytes = CACHE_MAX_BYTES
+	
+	batch_size = 0
+	tasks_per_worker = WORKER_TASKS
+	
 	if len(argv[1:]) == 0:
 		print "No arguments."
 		usage()
@@ -369,9 +557,13 @@ def check_options_and_args(argv):
 		 												'end=', 'padding_seconds=', "padding_percentage=", 'psd_overlap=',\
 		 												'high=', 'low=', 'list=', 'components=', 'time', 'frequency',\
 														'filter', 'maxclusters=', 'whiten', 'size=', 'nohighpass', 'resample=',\
-														'highpasscutoff=', 'energy', "save_timeseries", "clean", "noresample",\
+														'highpasscutoff=', 'energy', "save_timeseries", "clean", "resume", "noresample",\
 														"reconstruct", 'noplot', 'silent', "glitchgram_start=", "glitchgram_end=",\
-														"variance="])
+														"variance=", "block=", "source=",\
+														"prefetch=", "prefetch_memory=", "psd_lookback=", "streaming",\
+														"resample_method=", "fused", "spectral_store=",\
+														"stft=", "stft_stride=", "cache_size=",\
+														"processes=", "batch=", "tasks_per_worker="])
 	except getopt.error, msg:
 		print msg
 		sys.exit(1)
@@ -406,7 +598,7 @@ def check_options_and_args(argv):
 		elif option in ( "--maxclusters", "-m" ):
 			max_clusters = int(value)
 		elif option in ( "--psd_overlap" ):
-			psd_overlap = float(value/100.0)
+			psd_overlap = float(value)/100.0
 		elif option in ( "--frame" ):
 			frame_type = value
 		elif option in ( "--components" ):
@@ -417,6 +609,39 @@ def check_options_and_args(argv):
 			low = int(value)
 		elif ( option == "--size" ):
 			segment_size = int(value)
+		elif ( option == "--block" ):
+			block_seconds = int(value)
+		elif ( option == "--source" ):
+			source_url = value
+		elif ( option == "--prefetch" ):
+			prefetch_depth = int(value)
+		elif ( option == "--prefetch_memory" ):
+			prefetch_bytes = int(float(value)*1024**2)
+		elif ( option == "--psd_lookback" ):
+			psd_lookback = int(value)
+		elif ( option == "--streaming" ):
+			STREAMING = True
+		elif ( option == "--fused" ):
+			FUSED = True
+		elif ( option == "--spectral_store" ):
+			spectral_store_resolution = float(value)
+		elif ( option == "--stft" ):
+			stft_window = float(value)
+		elif ( option == "--stft_stride" ):
+			stft_stride = float(value)
+		elif ( option == "--processes" ):
+			PARALLEL_PROCESSES = int(value)
+		elif ( option == "--batch" ):
+			batch_size = int(value)
+		elif ( option == "--tasks_per_worker" ):
+			tasks_per_worker = int(value)
+		elif ( option == "--cache_size" ):
+			cache_max_bytes = int(float(value)*1024**3) if ( float(value) > 0 ) else None
+		elif ( option == "--resample_method" ):
+			if value not in ( 'polyphase', 'iir', 'auto' ):
+				print "Unknown resampling method: '{0}'.".format(value)
+				sys.exit(1)
+			resample_method = value
 		elif option in ( "--list" ):
 			LIST = True
 			times_list = value
@@ -436,6 +661,8 @@ def check_options_and_args(argv):
 			SAVE_TIMESERIES = True
 		elif option == "--clean":
 			CLEAN = True
+		elif option == "--resume":
+			RESUME = True
 		elif option == "--reconstruct":
 			RECONSTRUCT = True
 		elif option == "--noplot":
@@ -552,10 +779,11 @@ def check_options_and_args(argv):
 	# portion of the data. Sampling frequency is accessed through the 'fs' key
 	# of the 'data' dictionary (see `pcat.data` for the definition
 	# of retrieve_timeseries)
+	set_data_source(source_url)
 	start = times[0][0]
 	try:
 		data = retrieve_timeseries(start, start+32, channel, IFO, frame_type)
-	except RuntimeError:
+	except ( RuntimeError, IOError ):
 		assert False, "Error retrieving data. Check channel name, frame type and IFO."
 	
 	sampling = data['fs']
@@ -585,6 +813,14 @@ def check_options_and_args(argv):
 		pass
 	elif ( "--size" in argv ):
 		download_overlap_seconds = int(segment_size*download_overlap)
+	
+	# When streaming, the padding only has to cover the transient of the
+	# backward pass of the filter, i.e. its impulse response
+	if STREAMING and ( FILTER or ( HIGH_PASS and not WHITEN ) ):
+		if not any( flag in argv for flag in [ "--padding_percentage", "--padding_seconds" ] ):
+			download_overlap_seconds = max(1, int(np.ceil(impulse_response_length(streaming_coefficients())/sampling)))
+	else:
+		STREAMING = False
 		
 	# If variable input has not been supplied, set them to default values:
 	if not ( any( flag in o for flag in [ '--variables', "-v" ] for o in opts ) ):
@@ -606,15 +842,61 @@ def check_options_and_args(argv):
 		
 	if ( "frequency" in ANALYSIS):
 		if not ( any("--size" in o for o in opts)):
-			segment_size = 60
+			segment_size = 600 if ( stft_window > 0 ) else 60
 		if ( any("--padd" not in o for o in opts) ):
 			download_overlap = 0.0
 			download_overlap_seconds = 0
+	
+	# Coarser resolutions are derived from the stored PSDs, finer ones can't
+	if ( spectral_store_resolution is not None ):
+		if not ( "frequency" in ANALYSIS ):
+			print "--spectral_store can only be used with frequency-domain analysis."
+			sys.exit(1)
+		if ( int(sampling/spectral_store_resolution) < 2*(variables-1) ):
+			print "--spectral_store resolution must not be larger than the analyzed"
+			print "resolution ({0:.2f} Hz).".format(sampling/(2*(variables-1)))
+			sys.exit(1)
+	
+	# The fused whitening always high-passes (see `pcat.condition.whiten`)
+	if FUSED and WHITEN and not HIGH_PASS:
+		print "--fused can not be used with --nohighpass."
+		sys.exit(1)
+	
+	# Short-time observations
+	if ( stft_window > 0 ):
+		if not ( "frequency" in ANALYSIS ) or ( spectral_store_resolution is not None ):
+			print "--stft can only be used with frequency-domain analysis (without --spectral_store)."
+			sys.exit(1)
+		if ( stft_window > segment_size ):
+			print "--stft window must not be longer than the segments (--size)."
+			sys.exit(1)
+		if stft_stride is None:
+			stft_stride = stft_window/2.0
 			
 	# Count the total number of analyzed seconds
 	total = 0
 	for element in times:
 		total += int(element[1])-int(element[0])
+	
+	# One worker process per core, as long as there is enough memory for the
+	# segments it conditions and for its read block and prefetched segments
+	if ( PARALLEL_PROCESSES <= 0 ):
+		segment_bytes = (segment_size+2*download_overlap_seconds)*sampling*8
+		memory_per_process = (WORKER_MEMORY_SEGMENTS+prefetch_depth)*segment_bytes + block_seconds*sampling*8
+		PARALLEL_PROCESSES = worker_processes(memory_per_process)
+	
+	# Batches span a read block, and each process should get several of them
+	# to balance the load (see also stateful_conditioning())
+	batch_given = ( batch_size > 0 )
+	if ( batch_size <= 0 ):
+		block_segments = max(1, int(block_seconds//segment_size))
+		segments_number = max(1, int(np.ceil(total/float(segment_size))))
+		batch_size = max(1, min(block_segments, segments_number//(4*PARALLEL_PROCESSES)))
+	
+	# Transforms use the cores which are not used by the worker processes
+	# (see `pcat.fft_backend`)
+	if ( PARALLEL_PROCESSES < multiprocessing.cpu_count() ):
+		fft_backend.set_fft_workers(multiprocessing.cpu_count()//PARALLEL_PROCESSES)
 		
 	# Set default value for find_spikes()'s time_resolution
 	time_resolution = int(variables/2)
@@ -622,6 +904,88 @@ def check_options_and_args(argv):
 
 
 
+def streaming_coefficients():
+	'''
+		Second-order sections of the filter used with --streaming.
+	'''
+	if FILTER:
+		return butter_coefficients(BUTTERWORTH_ORDER, (high, low), sampling, 'band', output='sos')
+	else:
+		return butter_coefficients(4, HIGH_PASS_CUTOFF, sampling, 'highpass', output='sos')
+
+
+def stateful_conditioning(conditioned_folder):
+	'''
+		True if the conditioning carries state between contiguous segments
+		(PSD look-back, streaming filter or streaming resampling): the
+		conditioned data then depends on the batches of segments (see
+		aligned_batches()).
+	'''
+	return ( "time" in ANALYSIS ) and ( ( psd_lookback > 0 ) or STREAMING or ( "-polyphase" in conditioned_folder ) )
+
+
+def aligned_batches(segments):
+	'''
+		Splits the (GPS ordered) segments in batches of contiguous segments
+		aligned to GPS multiples of batch_size segments, so that the batch
+		of a segment (and the history it is conditioned with) does not
+		depend on the analyzed interval.
+		Each batch comes with its warm-up segments, from the aligned start
+		of the batch to its first segment: they are not analyzed, but are
+		conditioned before the batch to carry the state of the
+		conditioning.
+		
+		Returns the list of the batches and the list of their warm-up
+		segments.
+	'''
+	batch_seconds = batch_size*segment_size
+	batches, warm_ups = [], []
+	previous = None
+	for segment in segments:
+		start = segment[0] + download_overlap_seconds
+		if ( previous is not None ) and ( segment[0] == previous[1]-2*download_overlap_seconds )\
+		 and ( start//batch_seconds == ( previous[0]+download_overlap_seconds )//batch_seconds ):
+			batches[-1].append(segment)
+		else:
+			warm_up = []
+			first = start - segment_size
+			while ( first >= (start//batch_seconds)*batch_seconds ):
+				warm_up.insert(0, ( first-download_overlap_seconds, first+segment_size+download_overlap_seconds ))
+				first -= segment_size
+			batches.append([ segment ])
+			warm_ups.append(warm_up)
+		previous = segment
+	return batches, warm_ups
+
+
+def conditioning_parameters(conditioned_folder):
+	'''
+		Parameters which determine the conditioned data, used as key in the
+		conditioning cache (see `pcat.cache`): the data source and channel,
+		the type of conditioning (conditioned_folder) and all the options
+		which change its output.
+	'''
+	parameters = { 'source': str(data_source(source_url)), 'channel': channel,
+					'IFO': IFO, 'frame_type': frame_type, 'sampling': sampling,
+					'padding': download_overlap_seconds, 'folder': conditioned_folder }
+	if ( "time" in ANALYSIS ):
+		parameters.update({ 'domain': "time", 'filter': FILTER, 'whiten': WHITEN,
+					'highpass': HIGH_PASS, 'highpass_cutoff': HIGH_PASS_CUTOFF,
+					'highpass_order': HIGH_PASS_ORDER, 'butterworth_order': BUTTERWORTH_ORDER,
+					'low': low, 'high': high, 'resample': RESAMPLE,
+					'analysis_frequency': ANALYSIS_FREQUENCY, 'resample_method': resample_method,
+					'psd_lookback': psd_lookback, 'fused': FUSED, 'streaming': STREAMING })
+		if stateful_conditioning(conditioned_folder):
+			# State is carried between the segments of a batch, each batch
+			# is conditioned from scratch (see aligned_batches())
+			parameters['batch'] = batch_size
+	else:
+		parameters.update({ 'domain': "frequency", 'resolution': resolution,
+					'psd_overlap': psd_overlap, 'stft_window': stft_window,
+					'stft_stride': stft_stride, 'spectral_store': spectral_store_resolution })
+	return parameters
+
+
 def get_server_url():
 	"""
 		This retrieves the hostname on the server this program is being run on
@@ -690,9 +1054,24 @@ def print_parameters():
 	print "\t\t Chunk size:\t\t\t", segment_size, "seconds"
 	print "\t\t Padding:\t\t\t", download_overlap_seconds, "seconds"
 	print "\t\t (Total size: ", segment_size+2*download_overlap_seconds, "seconds)"
+	print "\t\t Read block size:\t\t", block_seconds, "seconds"
+	print "\t\t Data source:\t\t\t", source_url
+	if ( psd_lookback > 0 ) and WHITEN:
+		print "\t\t PSD look-back:\t\t\t", psd_lookback, "seconds"
+	if FUSED and WHITEN:
+		print "\t\t Fused whitening and high-pass:\t", "yes"
+	if STREAMING:
+		print "\t\t Streaming filter:\t\t", "yes"
+	if ( prefetch_depth > 0 ):
+		print "\t\t Prefetch:\t\t\t{0} segments ({1} MB max)".format(prefetch_depth, prefetch_bytes//1024**2)
+	if ( fft_backend.FFT_BACKEND == "scipy.fft" ):
+		print "\t\t FFT:\t\t\t\t{0} ({1} threads per process)".format(fft_backend.FFT_BACKEND, fft_backend.FFT_WORKERS)
+	else:
+		print "\t\t FFT:\t\t\t\t{0}".format(fft_backend.FFT_BACKEND)
 	print "\t\t Sampling frequency:\t\t", sampling
 	if (RESAMPLE and ( "time" in ANALYSIS) and ( sampling > ANALYSIS_FREQUENCY) ):
 		print "\t\t (Downsampled to %.1f for analysis)" % ANALYSIS_FREQUENCY
+		print "\t\t Resampling method:\t\t", resample_method
 	print ""
 	if ( "time" in ANALYSIS ):
 		if FILTER:
@@ -740,6 +1119,10 @@ def print_parameters():
 			print "\t\tBand:\t\t\t\t%i to %i Hz (%i points)" % (low, high, int(high-low+1))
 		else:
 			print "\t\tPSD resolution:\t\t\t%.2f Hz (%i points)" % ( resolution, variables )
+		if ( spectral_store_resolution is not None ):
+			print "\t\tSpectral store resolution:\t%.2f Hz" % spectral_store_resolution
+		if ( stft_window > 0 ):
+			print "\t\tShort-time PSDs:\t\t%g s windows, every %g s" % ( stft_window, stft_stride )
 	print 
 	print "\t - PCA and GMM:"
 	if AUTOCHOOSE_COMPONENTS:
@@ -752,6 +1135,8 @@ def print_parameters():
 	global CLEAN
 	if CLEAN:
 		print "\tRemoving existing data folders before running pipeline."
+	if RESUME:
+		print "\tResuming the last run."
 	
 	if SILENT:
 		print "\tSILENT run (no progress bars)"
@@ -853,7 +1238,7 @@ def pipeline(args):
 		OUTPUT += channel + "/"
 		
 		# Set up database name and output path
-		database_name = "t-%.1f_w-%i.list" % ( threshold, variables) 
+		database_name = "t-%.1f_w-%i" % ( threshold, variables) + DATABASE_EXTENSION 
 		
 		if LIST:
 			if ( "/" in times_list):
@@ -884,9 +1269,9 @@ def pipeline(args):
 		OUTPUT += channel + "/"
 		
 		if ( "bands" in ANALYSIS):
-			database_name = "PSD_database-band_%i-%i-1Hz.list" % ( low, high )
+			database_name = "PSD_database-band_%i-%i-1Hz" % ( low, high ) + DATABASE_EXTENSION
 		else:
-			database_name = "PSD_database-%.1f_Hz.list" % resolution
+			database_name = "PSD_database-%.1f_Hz" % resolution + DATABASE_EXTENSION
 			
 		if LIST:
 			if ( "/" in times_list):
@@ -922,8 +1307,18 @@ def pipeline(args):
 	except:
 		pass
 	
-	# Make sure 'output_dir' is empty, if not, delete all contents
-	folder_contents = os.listdir(output_dir)
+	# Make sure 'output_dir' is empty, if not, delete all contents except
+	# the files of the stages completed by the last run (see
+	# `pcat.manifest`), which are checked once the parameters of all the
+	# stages are known
+	manifest = StageManifest(output_dir)
+	if CLEAN:
+		manifest.clear()
+	kept = manifest.files()
+	if RESUME:
+		# Transients found by the interrupted run
+		kept.append(database_name + ".batches")
+	folder_contents = [ element for element in os.listdir(output_dir) if element not in kept ]
 	if not ( folder_contents == [] ):
 		from shutil import rmtree
 		for element in folder_contents:
@@ -981,7 +1376,7 @@ def pipeline(args):
 		pass
 	
 	# Create log file	
-	log = open(log_name, "w")
+	log = open(log_name, "a" if RESUME else "w")
 	log.write("Log start:\t " + asctime(localtime()) + "\n")
 	log.write("-"*30)
 	log.write("\n")
@@ -1019,28 +1414,62 @@ def pipeline(args):
 	# containing the time series with keys 'waveform', 'dt', and 'fs'
 	# (see `pcat.data`)
 	
+	# Conditioned data is stored in the conditioning cache (see
+	# `pcat.cache`), under the hash of the conditioning parameters
+	conditioning_cache = ConditioningCache(data_directory + "cache/", cache_max_bytes)
+	
+	STREAM_RESAMPLING = False
 	if ( "time" in ANALYSIS ):
 		# Define band-pass or whitening filter)
-		if FILTER:
+		# In time domain analysis the conditioning function returns the
+		# conditioned time series and its spectral products (see
+		# whiten(..., spectra=True)), None if the PSD was not estimated.
+		if STREAMING:
+			# Filter state is carried between contiguous segments, see
+			# the --streaming option
+			if FILTER:
+				conditioned_folder = str(low) + "_" + str(high)+"-streaming/"
+			else:
+				conditioned_folder = "high_passed_%1.f-streaming/" % HIGH_PASS_CUTOFF
+			conditioning_function = lambda x: ( streaming_filter.filter(x['waveform'], int(round(x['start']*x['fs']))), None )
+		elif FILTER:
 			conditioned_folder = str(low) + "_" + str(high)+"/"
-			conditioning_function = lambda x: butterworth_band_pass(x['waveform'], order=BUTTERWORTH_ORDER,\
-			 							f_high=high, f_low=low, f_sampl=x['fs'])
+			conditioning_function = lambda x: ( butterworth_band_pass(x['waveform'], order=BUTTERWORTH_ORDER,\
+			 							f_high=high, f_low=low, f_sampl=x['fs']), None )
 		elif WHITEN:
 			if HIGH_PASS:
 				conditioned_folder = "high_passed_%1.f-whitened/" % HIGH_PASS_CUTOFF
 			else:
 				conditioned_folder = "whitened/"
+			if ( psd_lookback > 0 ):
+				conditioned_folder = conditioned_folder.rstrip("/") + "-psd_{0}s/".format(psd_lookback)
+			if FUSED:
+				conditioned_folder = conditioned_folder.rstrip("/") + "-fused/"
 			conditioning_function = lambda x: whiten(x['waveform'], download_overlap_seconds, f_sampl=x['fs'], resample_freq=ANALYSIS_FREQUENCY, \
 									highpass=HIGH_PASS, highpass_cutoff=HIGH_PASS_CUTOFF,\
-									resample=RESAMPLE)
+									resample=RESAMPLE, spectra=True,\
+									psd_tracker=psd_tracker, start_time=x['start'],\
+									resample_method=resample_method, resampler=resampler,\
+									fused=FUSED)
+			# Design the filters and compute windows and frequency grids
+			# before starting the worker processes, so that they are shared
+			# by all the segments (see `pcat.condition.ConditioningPlan`)
+			plan = conditioning_plan(sampling, int((segment_size+2*download_overlap_seconds)*sampling),
+								HIGH_PASS_CUTOFF, HIGH_PASS_ORDER, ANALYSIS_FREQUENCY if RESAMPLE else None,
+								resample_method)
+			# Contiguous segments are resampled as a stream (see
+			# `pcat.utils.StreamingResampler`)
+			STREAM_RESAMPLING = ( plan.resampling_factors != ( 1, 1 ) )
+			if STREAM_RESAMPLING:
+				conditioned_folder = conditioned_folder.rstrip("/") + "-polyphase/"
 		elif HIGH_PASS:
 			conditioned_folder = "high_passed_%1.f/" % HIGH_PASS_CUTOFF
-			conditioning_function = lambda x: high_pass_filter(x['waveform'], HIGH_PASS_CUTOFF, x['fs'], 4)
+			conditioning_function = lambda x: ( high_pass_filter(x['waveform'], HIGH_PASS_CUTOFF, x['fs'], 4), None )
 		else:
 			# If no kind of processing is required return the unprocessed time
 			# series.
 			conditioned_folder = "raw/"
-			conditioning_function = lambda x: x['waveform']
+			conditioning_function = lambda x: ( x['waveform'], None )
 	elif ( "frequency" in ANALYSIS ):
 		# The conditioning function simply has to compute the PSD of the input
 		# segment
@@ -1049,16 +1478,87 @@ def pipeline(args):
 			global resolution
 			freqs, PSD = compute_psd(x['waveform'], resolution=resolution, f_sampl=x['fs'], overlap=psd_overlap)
 			return PSD
+		if ( spectral_store_resolution is not None ):
+			# PSDs are computed at the store resolution and saved, the
+			# analyzed resolution is derived from them (see `pcat.spectra`)
+			global spectral_store
+			# The store is shared by all the analyzed resolutions
+			spectral_parameters = conditioning_parameters("spectra/")
+			del spectral_parameters['resolution']
+			spectral_key = conditioning_cache.key(spectral_parameters)
+			spectral_store = SpectralStore(conditioning_cache.entry(spectral_key, spectral_parameters),
+											spectral_store_resolution, psd_overlap)
+			conditioned_folder = conditioned_folder.rstrip("/") + "-store_{0:.2f}_Hz/".format(spectral_store_resolution)
+			def conditioning_function(x):
+				return spectral_store.aggregate(spectral_store.compute(x), x['fs'], resolution)
+		elif ( stft_window > 0 ):
+			# Several observations per segment: the PSDs of the windows of
+			# the segment and their GPS start and end times
+			conditioned_folder = "STFT-%1.f_Hz-window_%gs-stride_%gs/" % ( resolution, stft_window, stft_stride )
+			def conditioning_function(x):
+				freqs, starts, length, PSDs = stft_psds(x['waveform'], resolution, x['fs'], psd_overlap,
+														stft_window, stft_stride)
+				return { 'psds': PSDs, 'start': x['start'] + starts/x['fs'],
+						'end': x['start'] + (starts+length)/x['fs'] }
 
 #        if os.path.isdir(processing_directory + conditioned_folder):
 #            pass
 #        else:
 #            os.makedirs(processing_directory + conditioned_folder)
 
-	try:
-		os.makedirs( processing_directory + conditioned_folder )
-	except:
-		pass
+	# With stateful conditioning the conditioned data depends on the batches,
+	# so their default size must not depend on the number of worker processes
+	# (nor on the available memory)
+	global batch_size
+	STATEFUL = stateful_conditioning(conditioned_folder)
+	if STATEFUL and not batch_given:
+		batch_size = max(1, int(block_seconds//segment_size))
+	
+	cache_key = conditioning_cache.key(conditioning_parameters(conditioned_folder))
+	if CLEAN:
+		conditioning_cache.remove(cache_key)
+	conditioned_directory = conditioning_cache.entry(cache_key, conditioning_parameters(conditioned_folder))
+	
+	# Transients found in each segment are cached along with the conditioned
+	# data (see `pcat.triggers`), under a hash of the trigger finder
+	# parameters
+	trigger_parameters = {}
+	if ( "time" in ANALYSIS ):
+		if (WHITEN and RESAMPLE and (sampling > ANALYSIS_FREQUENCY)):
+			trigger_sampling = ANALYSIS_FREQUENCY
+		else:
+			trigger_sampling = sampling
+		trigger_parameters = { 'threshold': threshold, 'width': variables, 'time_resolution': time_resolution,
+								'removed_seconds': download_overlap_seconds, 'f_sampl': trigger_sampling,
+								'normalization': normalization }
+	
+	# Each stage is skipped if its parameters (and those of the stages
+	# before it) have not changed since the last run (see `pcat.manifest`)
+	global components_number, glitchgram_start, glitchgram_end
+	first_stage = manifest.check(stage_keys({
+			'segments': { 'cache': cache_key, 'triggers': trigger_parameters, 'analysis': ANALYSIS,
+						'times': [ [ int(element[0]), int(element[1]) ] for element in times ],
+						'segment_size': segment_size },
+			'data_matrix': { 'low': low, 'high': high, 'database': database_name },
+			'PCA': { 'components': components_number, 'autochoose': AUTOCHOOSE_COMPONENTS,
+						'variance': VARIANCE_PERCENTAGE },
+			'clustering': { 'max_clusters': max_clusters },
+			'plots': { 'noplot': NOPLOT, 'reconstruct': RECONSTRUCT,
+						'glitchgram': [ glitchgram_start, glitchgram_end ] } }))
+	# PSD files of frequency-domain analyses are stored in the conditioning
+	# cache, they are computed again if the entry has been pruned
+	if manifest.done("segments") and ( "frequency" in ANALYSIS ) and\
+	 not all( os.path.isfile(file_name) for file_name in manifest.info("segments")['results'] ):
+		manifest.clear("segments")
+		first_stage = "segments"
+	if first_stage is None:
+		print "\tAll the stages have been completed by the last run with the same parameters."
+		print "\n\tResults at:"
+		print "\t" + results_URL
+		os.chdir(original_wd)
+		return results_URL
+	elif ( first_stage != "segments" ):
+		print "\tStages completed by the last run are skipped, starting from: {0}.".format(first_stage)
 	
 	# Define the worker function, depending on the type of analyis
 	# which was requested.
@@ -1075,52 +1575,80 @@ def pipeline(args):
 	# Workfunction() takes in both case a tuple ('arguments') with the start
 	# and end time expressed in GPStime.
 	
+	# Time series are read through the worker process' PrefetchReader or
+	# BlockReader (see worker() below), or one segment at a time if there
+	# is none.
+	def read_segment(start, end):
+		global read_wait_time
+		wait_start = time.time()
+		try:
+			if prefetch_reader is not None:
+				time_series = prefetch_reader.retrieve(start, end)
+			elif block_reader is not None:
+				time_series = block_reader.retrieve(start, end)
+			else:
+				time_series = retrieve_timeseries(start, end, channel, IFO, frame_type)
+		finally:
+			read_wait_time += time.time()-wait_start
+		# GPS start and end times, used by the PSDTracker and the
+		# SpectralStore
+		time_series['start'] = start
+		time_series['end'] = end
+		return time_series
+	
 	if ( "time" in ANALYSIS):
 		# The workfunction finds transients in the given time series
 		# and returns a list of spike objects. These are later used
 		# for analysis
-		def workfunction(arguments):
-			""" arguments is a tuple, unpack it to use """
+		def workfunction(arguments, segment_table=None):
+			""" arguments is a tuple, unpack it to use.
+				Segment PSDs are added to segment_table (a SegmentTable) """
+			global cache_hits, cache_misses
 			conditioning_function, start, end = arguments
 			
 			out_name = "{0}-{1}-{2}_{3}-{4}.data".format(IFO, frame_type, channel,
 																	start, end)
 			
-			out_file = processing_directory + conditioned_folder + out_name + ".conditioned"
+			# Check if the segment has already been searched for transients
+			# (see `pcat.triggers`), conditioned data is not needed then
+			found_spikes = trigger_cache.get(start, end, trigger_sampling, segment_table)
+			if found_spikes is not None:
+				cache_hits += 1
+				log = open(log_name, "a")
+				log.write( "TRIGGERS LOADED FROM CACHE:\t{0}-{1}\n".format(start, end) )
+				log.close()
+				return found_spikes
 			
-			# Check if conditioned file already exists.
-			# If it exists, load it, else use conditioning_function() on 
+			# Spectral products of the conditioning, if any
+			spectra = None
+			
+			# Check if the segment has already been conditioned (see
+			# `pcat.store`).
+			# If it has, load it, else use conditioning_function() on 
 			# time_series
 			downsample_factor = int(sampling/ANALYSIS_FREQUENCY)
-			if os.path.isfile(out_file):
-				try:	# Try loading files
-					log = open(log_name, "a")
-					f = open(out_file, "rb")
-					conditioned = np.load(f)
-					# Print part of the path to the log file
-					log.write( "FILE EXISTS - LOADED:\t'./{0}'\n".format(join(out_file.split("/")[-5:], "/")))
-					f.close()
-					log.close()
-				except Exception, error: # Try retrieving the time series and
-										 # conditioning the file once again
-					# If there is an exception, try loading
-					# the time series from the frame files
-					# and conditioning it
-					try:
-						time_series = retrieve_timeseries(start, end, channel, IFO, frame_type)
-					except Exception, error:
-						log = open(log_name, "a")
-						log.write("!!! ERROR OPENING SEGMENT {0}-{1}:\t{2}\n".format(start, end, str(error)))
-						log.close()
-						return []
-					conditioned = conditioning_function(time_series)
-					
-				
-			else:	# First time processing data/conditioned file does not 
-					# exist.
-					# Retrieve the time series and condition/save it.
+			try:
+				stored = conditioned_store.get(start, end)
+			except Exception, error:
+				# Condition the segment once again
+				log = open(log_name, "a")
+				log.write("ERROR LOADING {0}-{1}:\t{2}\n".format(start, end, str(error)))
+				log.close()
+				stored = None
+			if stored is not None:
+				cache_hits += 1
+				conditioned = stored.pop('conditioned')
+				if stored:
+					spectra = stored
+				log = open(log_name, "a")
+				log.write( "LOADED FROM STORE:\t{0}-{1}\n".format(start, end) )
+				log.close()
+			else:	# First time processing data/segment has not been
+					# conditioned yet.
+					# Retrieve the time series and condition/store it.
+				cache_misses += 1
 				try:
-					time_series = retrieve_timeseries(start, end, channel, IFO, frame_type)
+					time_series = read_segment(start, end)
 				except Exception, error:
 					log = open(log_name, "a")
 					log.write("!!! ERROR OPENING SEGMENT {0}-{1}:\t{2}\n".format(start, end, str(error)))
@@ -1138,11 +1666,12 @@ def pipeline(args):
 						log.close()
 				
 				# Condition the retrieved time series
-				conditioned = conditioning_function(time_series)
+				conditioned, spectra = conditioning_function(time_series)
 				del time_series
 				
-				with open(out_file, "wb") as f:
-					np.save(f, conditioned)
+				arrays = dict(spectra) if spectra is not None else {}
+				arrays['conditioned'] = conditioned
+				conditioned_store.append(start, end, arrays)
 			
 			# Search the conditioned time series for transients
 			if (WHITEN and RESAMPLE and (sampling > ANALYSIS_FREQUENCY)):
@@ -1150,21 +1679,20 @@ def pipeline(args):
 											time_resolution=time_resolution,
 											removed_seconds=download_overlap_seconds, 
 											f_sampl=ANALYSIS_FREQUENCY,
-											normalization=normalization)
+											normalization=normalization,
+											segment_table=segment_table,
+											spectra=spectra)
 				
 			else:
 				found_spikes = find_spikes(conditioned, out_name, threshold, variables,
 											time_resolution=time_resolution,
 											removed_seconds=download_overlap_seconds, 
 											f_sampl=sampling,
-											normalization=normalization)
+											normalization=normalization,
+											segment_table=segment_table,
+											spectra=spectra)
 			del conditioned
-			# Update progress bar
-			if not SILENT:
-				global progress, progress_index
-				progress_index += 1
-				print "\r\t", sprog.next(), "\r",
-				progress(progress_index)
+			trigger_cache.put(start, end, found_spikes, segment_table)
 			return found_spikes
 	elif ( "frequency" in ANALYSIS):
 		# In this case the workfunction gets the timeseries, computes the PSD,
@@ -1175,7 +1703,8 @@ def pipeline(args):
 			conditioning_function, start, end = arguments
 			out_name = "{0}-{1}-{2}_{3}-{4}.data".format(IFO, frame_type, channel,
 																	start, end)
-			out_file = processing_directory + conditioned_folder + out_name + ".conditioned"
+			global cache_hits, cache_misses
+			out_file = conditioned_directory + out_name + ".conditioned"
 			# Check if conditioned file already exists.
 			# If it exists, load it, else condition
 			if os.path.isfile(out_file):
@@ -1186,9 +1715,11 @@ def pipeline(args):
 					log.write( "FILE EXISTS - LOADED:\t'~/{0}'\n".format(join(out_file.split("/")[-5:], "/")))
 					log.close()
 					f.close()
+					cache_hits += 1
 				except:
+					cache_misses += 1
 					try:
-						time_series = retrieve_timeseries(start, end, channel, IFO, frame_type)
+						time_series = read_segment(start, end)
 					except Exception, error:
 						log = open(log_name, "a")
 						log.write("!!! ERROR OPENING SEGMENT {0}-{1}:\t{2}\n".format(start, end, str(error)))
@@ -1196,39 +1727,45 @@ def pipeline(args):
 					PSD = conditioning_function(time_series)
 					del time_series
 			else:   
-				try:
-					time_series = retrieve_timeseries(start, end, channel, IFO, frame_type)
-				except Exception, error:
-					log = open(log_name, "a")
-					log.write("!!! ERROR OPENING SEGMENT {0}-{1}:\t{2}\n".format(start, end, str(error)))
-					log.close()
-					return []
-				if SAVE_TIMESERIES:
+				PSD = None
+				if spectral_store is not None:
+					# PSD stored by an earlier run (possibly with a
+					# different resolution)
+					PSD = spectral_store.psd(start, end, sampling, resolution)
+				if PSD is not None:
+					cache_hits += 1
+				else:
+					cache_misses += 1
 					try:
-						f = open(download_directory + out_name)
-						np.save(f, time_series['waveform'])
-						f.close()
-					except:
+						time_series = read_segment(start, end)
+					except Exception, error:
 						log = open(log_name, "a")
-						log.write("ERROR SAVING:\t'{0}'\n".format(out_name))
-						log.close() 
-				
-				PSD = conditioning_function(time_series)
-				del time_series
+						log.write("!!! ERROR OPENING SEGMENT {0}-{1}:\t{2}\n".format(start, end, str(error)))
+						log.close()
+						return []
+					if SAVE_TIMESERIES:
+						try:
+							f = open(download_directory + out_name)
+							np.save(f, time_series['waveform'])
+							f.close()
+						except:
+							log = open(log_name, "a")
+							log.write("ERROR SAVING:\t'{0}'\n".format(out_name))
+							log.close() 
+					
+					PSD = conditioning_function(time_series)
+					del time_series
 				try:	# Save the PSD, for later use in database
-					f = open(out_file, "w")
-					np.save(f, PSD)
+					f = open(out_file, "wb")
+					if isinstance(PSD, dict):
+						np.savez(f, **PSD)
+					else:
+						np.save(f, PSD)
 					f.close()
 				except:
 					log = open(log_name, "a")
 					log.write( "ERROR SAVING:\t'{0}'\n".format(out_file))
 					log.close()
-			# Update progress bar
-			if not SILENT:
-				global progress, progress_index
-				progress_index += 1
-				print "\r\t", sprog.next(), "\r",
-				progress(progress_index)
 			return out_file
 		
 	
@@ -1286,70 +1823,279 @@ def pipeline(args):
 	# file).
 	# parmap() is defined in `pcat.utils` and uses the multiprocessing
 	# module.
-	if not SILENT:
-		global progress, progress_index
-		progress_index = 0
-		bar_len = (len(segments)-1)//PARALLEL_PROCESSES
-		progress = progressBar(minValue = 0, maxValue=bar_len, totalWidth = 40 )
-	
-	print "\tDownloading and processing..."
-	if not SILENT:
-		progress(0)
-		print "\t", sprog.next(), "\r",
-		sys.stdout.flush()
-		print " "*(frame_width-3), "\r",
-	
-	
-	"""
-	# Old parallel code, better to avoid using this as it suppresses all
-	# errors when one of its workers fail
-	worker = lambda x: workfunction((conditioning_function, x[0], x[1]))
-	tmp_result = parmap(worker, segments, nprocs=PARALLEL_PROCESSES)
-	"""
-	# Worker function for parallel processing
-	def worker(in_list, out_q):
-		out_arr = []
-		for segment in in_list:
-			out_arr.append(workfunction((conditioning_function, segment[0], segment[1])))
-		out_q.put(out_arr)
-	
-	# Each process will get 'chunksize' segments and a queue to put his out
-	# dict into
-	out_q = multiprocessing.Queue()
-	chunksize = int(np.ceil(len(segments)/float(PARALLEL_PROCESSES)))
-	procs = []
-	
-	for i in range(PARALLEL_PROCESSES):
-		p = multiprocessing.Process(
-				target=worker,
-				args=(segments[chunksize * i:chunksize * (i + 1)],
-						out_q))
-		procs.append(p)
-		p.start()
-	
-	# Collect all results into a single array
-	tmp_result = []
-	for i in range(PARALLEL_PROCESSES):
-		tmp_result.extend(out_q.get())
+	# Skip conditioning and trigger finding if their parameters have not
+	# changed since the last run (see `pcat.manifest`)
+	if manifest.done("segments"):
+		print "\tSegments already processed by the last run, skipped (see 'manifest.json')."
+		results = manifest.info("segments")['results']
+	else:
+		if not SILENT:
+			global progress
+			progress = progressBar(minValue = 0, maxValue=len(segments), totalWidth = 40 )
+	
+		print "\tDownloading and processing..."
+		if not SILENT:
+			progress(0)
+			print "\t", sprog.next(), "\r",
+			sys.stdout.flush()
+			print " "*(frame_width-3), "\r",
+	
+	
+		"""
+		# Old parallel code, better to avoid using this as it suppresses all
+		# errors when one of its workers fail
+		worker = lambda x: workfunction((conditioning_function, x[0], x[1]))
+		tmp_result = parmap(worker, segments, nprocs=PARALLEL_PROCESSES)
+		"""
+		# Segments are processed in batches of (at most) batch_size contiguous
+		# segments, each batch is a task for the worker processes.
+		# When doing time-domain analysis the transients found in each batch
+		# (and the segment PSDs in their SegmentTable) are saved by the worker
+		# process to a database in batches_directory (see `pcat.database`), and
+		# only its name is sent back: the databases of all the batches are
+		# merged into the output database, transients are never pickled.
+		batches_directory = output_dir + database_name + ".batches/"
+		# With --resume, the databases of the batches completed by the
+		# interrupted run (with the same batches) are used
+		batches_key = "{0}-{1}".format(manifest.keys['segments'], batch_size)
+		if STATEFUL:
+			batches, warm_ups = aligned_batches(segments)
+		else:
+			batches = [ segments[first:first+batch_size] for first in range(0, len(segments), batch_size) ]
+			warm_ups = [ [] for batch in batches ]
+		resumed = {}
+		if ( "time" in ANALYSIS ):
+			if RESUME and os.path.isfile(batches_directory + "key") and\
+			 ( open(batches_directory + "key").read() == batches_key ):
+				for batch_index in range(len(batches)):
+					batch_database = batches_directory + "batch-{0:06d}".format(batch_index) + DATABASE_EXTENSION
+					if is_database(batch_database):
+						resumed[batch_index] = ( ( batch_database, len(SpikeDatabase.load(batch_database)) ), 0.0, 0, 0 )
+				print "\tResuming: {0} batches completed by the last run.".format(len(resumed))
+			else:
+				if os.path.isdir(batches_directory):
+					from shutil import rmtree
+					rmtree(batches_directory)
+				os.makedirs(batches_directory)
+				with open(batches_directory + "key", "w") as f:
+					f.write(batches_key)
+	
+		def carry_state(start, end):
+			# Conditions the segment only to carry the state of the
+			# conditioning to the next segments, it is stored if it has not
+			# been stored yet
+			try:
+				time_series = read_segment(start, end)
+			except Exception, error:
+				log = open(log_name, "a")
+				log.write("!!! ERROR OPENING SEGMENT {0}-{1}:\t{2}\n".format(start, end, str(error)))
+				log.close()
+				return
+			conditioned, spectra = conditioning_function(time_series)
+			if not conditioned_store.contains(start, end):
+				arrays = dict(spectra) if spectra is not None else {}
+				arrays['conditioned'] = conditioned
+				conditioned_store.append(start, end, arrays)
 		
-	# Wait for all worker processes to finish
-	for p in procs:
-		p.join()
+		def process_batch(batch_index, in_list):
+			# Segments in in_list are contiguous, read them in blocks
+			global block_reader, prefetch_reader, psd_tracker, streaming_filter, resampler
+			global read_wait_time, cache_hits, cache_misses
+			read_wait_time = 0.0
+			cache_hits, cache_misses = 0, 0
+			# With stateful conditioning, unless all the segments have already
+			# been stored the batch is conditioned from its aligned start (see
+			# aligned_batches()), stored segments included: stored data never
+			# depends on the intervals or on the order of the runs which
+			# stored it
+			replay = STATEFUL and not all( conditioned_store.contains(segment[0], segment[1]) for segment in in_list )
+			read_list = ( warm_ups[batch_index] if replay else [] ) + in_list
+			block_reader = BlockReader(read_list, channel, IFO, frame_type, block_seconds)
+			prefetch_reader = None
+			# Segments in in_list are processed in GPS order, they can share
+			# their PSD estimates (each batch starts from scratch, so that the
+			# conditioned data does not depend on the order batches are
+			# processed in)
+			if ( psd_lookback > 0 ):
+				psd_tracker = PSDTracker(psd_lookback)
+			if STREAMING:
+				streaming_filter = StreamingFilter(streaming_coefficients())
+			if STREAM_RESAMPLING:
+				resampler = StreamingResampler(sampling, ANALYSIS_FREQUENCY)
+			# Prefetch the segments which have not been conditioned yet
+			if ( prefetch_depth > 0 ):
+				if ( "time" in ANALYSIS ):
+					to_read = [ segment for segment in read_list if replay or not ( conditioned_store.contains(segment[0], segment[1]) or\
+										trigger_cache.contains(segment[0], segment[1]) ) ]
+				else:
+					to_read = [ segment for segment in in_list if not os.path.isfile(conditioned_directory +\
+									"{0}-{1}-{2}_{3}-{4}.data.conditioned".format(IFO, frame_type, channel, segment[0], segment[1])) ]
+				if spectral_store is not None:
+					to_read = [ segment for segment in to_read if not spectral_store.contains(segment[0], segment[1]) ]
+				prefetch_reader = PrefetchReader(block_reader, to_read, prefetch_depth, prefetch_bytes)
+			out_arr = []
+			batch_table = SegmentTable()
+			if replay:
+				for segment in warm_ups[batch_index]:
+					carry_state(segment[0], segment[1])
+			for segment in in_list:
+				if ( "time" in ANALYSIS ):
+					if replay and conditioned_store.contains(segment[0], segment[1]):
+						carry_state(segment[0], segment[1])
+					out_arr.extend(workfunction((conditioning_function, segment[0], segment[1]), batch_table))
+				else:
+					out_arr.append(workfunction((conditioning_function, segment[0], segment[1])))
+			if ( "time" in ANALYSIS ):
+				# Save the transients, send back the name of the database and
+				# the number of transients
+				batch_database = None
+				if out_arr:
+					batch_database = batches_directory + "batch-{0:06d}".format(batch_index) + DATABASE_EXTENSION
+					SpikeDatabase.from_spikes(out_arr, batch_table).save(batch_database)
+				out_arr = ( batch_database, len(out_arr) )
+			if ( block_reader.seconds_requested > 0 ):
+				log = open(log_name, "a")
+				log.write("BLOCK READER:\t{0} s of data read for {1} s of segments\n".format(block_reader.seconds_read, block_reader.seconds_requested))
+				log.close()
+			if prefetch_reader is not None:
+				prefetch_reader.close()
+				log = open(log_name, "a")
+				log.write("PREFETCH:\t{0} segments prefetched\n".format(prefetch_reader.prefetched))
+				log.close()
+			log = open(log_name, "a")
+			log.write("I/O WAIT:\t{0:.1f} s waiting for data\n".format(read_wait_time))
+			log.close()
+			return out_arr, read_wait_time, cache_hits, cache_misses
+	
+		# Worker processes take the next batch from task_q when they are done
+		# with the previous one (so that slow batches do not hold up the
+		# others) and send its results back right away through out_q.
+		# After tasks_per_worker batches a worker process exits and is
+		# replaced by a new one, which frees the memory it accumulated. A worker
+		# process also exits when it gets None from task_q (no batches left).
+		def worker(task_q, out_q):
+			global conditioned_store, trigger_cache
+			# Conditioned time series (and the transients found in them) are
+			# stored in a single store, its index is read once by each worker
+			# process
+			if ( "time" in ANALYSIS ):
+				conditioned_store = SegmentStore(conditioned_directory)
+				trigger_cache = TriggerCache(conditioned_directory, trigger_parameters)
+			tasks = 0
+			while True:
+				if ( tasks_per_worker > 0 ) and ( tasks >= tasks_per_worker ):
+					message = ( "recycled", None )
+					break
+				task = task_q.get()
+				if task is None:
+					message = ( "done", None )
+					break
+				batch_index, in_list = task
+				out_q.put(( "batch", ( batch_index, len(in_list), process_batch(batch_index, in_list) ) ))
+				tasks += 1
+			if conditioned_store is not None:
+				conditioned_store.close()
+				trigger_cache.close()
+			out_q.put(message)
+	
+		def start_worker():
+			p = multiprocessing.Process(target=worker, args=(task_q, out_q))
+			p.start()
+			return p
+	
+		pending = [ task for task in enumerate(batches) if task[0] not in resumed ]
+		processes_number = min(PARALLEL_PROCESSES, len(pending))
+		task_q = multiprocessing.Queue()
+		out_q = multiprocessing.Queue()
+		for task in pending:
+			task_q.put(task)
+		# One None for each chain of worker processes
+		for i in range(processes_number):
+			task_q.put(None)
+		procs = [ start_worker() for i in range(processes_number) ]
+	
+		# Collect the results of the batches as they are completed, until all
+		# the worker processes got None
+		batch_results = dict(resumed)
+		done = sum( len(batches[batch_index]) for batch_index in resumed )
+		finished = 0
+		while ( finished < processes_number ):
+			# Keep the cache entries in use from being evicted by concurrent
+			# runs (see ConditioningCache.evict())
+			conditioning_cache.touch(cache_key)
+			if spectral_store is not None:
+				conditioning_cache.touch(spectral_key)
+			try:
+				message, content = out_q.get(timeout=WORKER_POLL_SECONDS)
+			except Empty:
+				# Worker processes which died (e.g. killed for running out of
+				# memory) never send their results
+				failed = [ p for p in procs if ( p.exitcode is not None ) and ( p.exitcode != 0 ) ]
+				if failed:
+					for p in procs:
+						if p.is_alive():
+							p.terminate()
+					raise RuntimeError("Worker process {0} exited with code {1}.".format(failed[0].pid, failed[0].exitcode))
+				continue
+			if ( message == "batch" ):
+				batch_index, segments_number, result = content
+				batch_results[batch_index] = result
+				done += segments_number
+				if not SILENT:
+					print "\r\t", sprog.next(), "\r",
+					progress(done)
+			elif ( message == "recycled" ):
+				procs.append(start_worker())
+			elif ( message == "done" ):
+				finished += 1
+	
+		# Wait for all worker processes to finish
+		for p in procs:
+			p.join()
+	
+		# Collect all results (in GPS order): the names of the databases of the
+		# batches for time-domain analysis, the names of the PSD files for
+		# frequency-domain analysis
+		tmp_result = []
+		wait_time = 0.0
+		hits, misses = 0, 0
+		for batch_index in sorted(batch_results):
+			out_arr, batch_wait_time, batch_hits, batch_misses = batch_results[batch_index]
+			wait_time += batch_wait_time
+			hits += batch_hits
+			misses += batch_misses
+			if ( "time" in ANALYSIS ):
+				tmp_result.append(out_arr)
+			else:
+				tmp_result.extend(out_arr)
+		del batch_results
 		
 		
-	# Complete progress bar
-	if not SILENT:
-		progress(bar_len)
-		print "\t[ O ]"
-	
-	if ("time" in ANALYSIS):
-		results = []
-		for item in tmp_result:
-			results.extend(item)
-		print "\tFound {0} transients.".format(len(results))
-		del tmp_result
-	else:
-		results = tmp_result
+		# Complete progress bar
+		if not SILENT:
+			progress(len(segments))
+			print "\t[ O ]"
+		print "\tTime spent waiting for data: {0:.1f} s ({1} processes, {2} batches).".format(wait_time, processes_number, len(batches))
+	
+		# Report the use of the conditioning cache and remove its least recently
+		# used entries if it has grown too large
+		conditioning_cache.record_run(cache_key, hits, misses)
+		evicted = conditioning_cache.evict(keep=[cache_key, spectral_key if spectral_store is not None else None])
+		print "\tConditioning cache: {0} hits, {1} misses (entry {2}).".format(hits, misses, cache_key)
+		if evicted:
+			print "\t\tRemoved {0} least recently used entries ({1:.1f} MB).".format(len(evicted), sum( entry['size'] for entry in evicted )/1024.0**2)
+		log = open(log_name, "a")
+		log.write("CACHE:\t{0} hits, {1} misses, entry {2} ({3})\n".format(hits, misses, cache_key, conditioned_directory))
+		log.close()
+	
+		if ("time" in ANALYSIS):
+			# Databases of the batches in which transients were found
+			results = [ batch_database for batch_database, spikes_number in tmp_result if batch_database ]
+			print "\tFound {0} transients.".format(sum( spikes_number for batch_database, spikes_number in tmp_result ))
+			del tmp_result
+		else:
+			# Segments which could not be read give no PSD
+			results = [ out_file for out_file in tmp_result if out_file ]
 	
 
 	"""
@@ -1385,6 +2131,11 @@ def pipeline(args):
 	# If there are 0 transients, write a warning to the output directory and 
 	# return the URL to the warning
 	if ( len(results) == 0 ):
+		# Only the resume key is left in the batches directory (which is
+		# not defined if the segments stage was skipped)
+		if ( "time" in ANALYSIS ) and not manifest.done("segments"):
+			from shutil import rmtree
+			rmtree(batches_directory)
 		with open(output_dir + "no_transients.txt", "w") as f:
 			print>>f, "\n No transients found. Quitting."
 		return results_URL + "no_transients.txt"
@@ -1398,13 +2149,37 @@ def pipeline(args):
 	
 	# Create data_matrix. PCA will be perfomed on this matrix.
 	if ( ANALYSIS == "time" ):
-		# Create data_matrix
-		data_matrix = create_data_matrix(results, ANALYSIS)
-		data_list = results
+		# Merge the databases of the batches into the output database (see
+		# `pcat.database`), and use its waveforms as data matrix. The data
+		# matrix is memory-mapped copy-on-write as PCA() whitens it in
+		# place, and separately from the database used as list of Spike()
+		# instances, so that their waveforms are not whitened.
+		if manifest.done("segments"):
+			database = SpikeDatabase.load(output_dir + database_name, mmap_mode='c')
+		else:
+			database = merge_databases(results, output_dir + database_name, mmap_mode='c')
+			from shutil import rmtree
+			rmtree(batches_directory)
+			manifest.record("segments", [ database_name ], results=[ database_name ])
+		data_matrix = SpikeDatabase.load(output_dir + database_name, mmap_mode='c').data_matrix(ANALYSIS)
+		data_list = database
+		segment_table = database.segment_table
 	elif ( "frequency" in ANALYSIS ):
-		data_list, data_matrix = create_data_matrix_from_psds(results, ANALYSIS, sampling, low, high)
+		# PSDs are stacked in a single array in the conditioned folder, later
+		# runs (e.g. with different bands) only read the bins they need
+		if ( stft_window > 0 ):
+			stack_name = None
+		else:
+			stack_name = conditioned_directory + "stacked_PSDs"
+		if not manifest.done("segments"):
+			manifest.record("segments", results=results)
+		data_list, data_matrix = create_data_matrix_from_psds(results, ANALYSIS, sampling, low, high, stack_name=stack_name)
 	else:
 		assert False, "DIFF ANALYSIS NOT IMPLEMENTED"
+	# The data matrix is a view of the database (time domain) or of the
+	# stacked PSDs (frequency domain): it is read, not computed again
+	if not manifest.done("data_matrix"):
+		manifest.record("data_matrix")
 		
 	# Change working directory to 'output_dir'
 	os.chdir( output_dir )
@@ -1428,18 +2203,28 @@ def pipeline(args):
 	# Columns means and standard deviations are stored in means
 	# stds should be a numpy array of ones, unless matrix_whiten(..., std=True)
 	# in PCA()
-	global components_number
-
-	if AUTOCHOOSE_COMPONENTS:
-		score_matrix, principal_components, means, stds, eigenvalues = PCA(data_matrix, components_number=components_number, variance=VARIANCE_PERCENTAGE )
+	if manifest.done("PCA"):
+		PCA_results = np.load("PCA.npz")
+		score_matrix, principal_components, means, stds, eigenvalues = [ PCA_results[name] for name in\
+						( 'score_matrix', 'principal_components', 'means', 'stds', 'eigenvalues' ) ]
+		print "\tLoaded principal components computed by the last run ('PCA.npz')"
 	else:
-		score_matrix, principal_components, means, stds, eigenvalues = PCA(data_matrix, components_number=components_number)
-
-	# Save pickled Principal Components 
-	f = open("Principal_components.dat", "wb")
-	pickle.dump(principal_components, f)
-	f.close()
-	print "\tSaved 'Principal_components.dat'"
+		if AUTOCHOOSE_COMPONENTS:
+			score_matrix, principal_components, means, stds, eigenvalues = PCA(data_matrix, components_number=components_number, variance=VARIANCE_PERCENTAGE )
+		else:
+			score_matrix, principal_components, means, stds, eigenvalues = PCA(data_matrix, components_number=components_number)
+	
+		# Save pickled Principal Components 
+		f = open("Principal_components.dat", "wb")
+		pickle.dump(principal_components, f)
+		f.close()
+		print "\tSaved 'Principal_components.dat'"
+		
+		# Save the results of PCA, used by later runs with different
+		# clustering or plotting parameters
+		np.savez("PCA.npz", score_matrix=score_matrix, principal_components=principal_components,
+					means=means, stds=stds, eigenvalues=eigenvalues)
+		manifest.record("PCA", [ "PCA.npz", "Principal_components.dat" ])
 	
 	explained_variance = np.cumsum(np.abs(eigenvalues))/np.sum(np.abs(eigenvalues))
 	
@@ -1463,8 +2248,17 @@ def pipeline(args):
 	# data (set zero mean and unit variance) using matrix_whiten to improve
 	# clustering.
 
-	reduced_whitened_scores, tmp_means, tmp_stds = matrix_whiten(score_matrix[:, :components_number], std=True)
-	labels = gaussian_mixture(reduced_whitened_scores, upper_bound=max_clusters, SILENT=SILENT)
+	if manifest.done("clustering"):
+		labels = np.load("Labels.npy").tolist()
+		print "\tLoaded labels given by the last run ('Labels.npy')"
+	else:
+		reduced_whitened_scores, tmp_means, tmp_stds = matrix_whiten(score_matrix[:, :components_number], std=True)
+		labels = gaussian_mixture(reduced_whitened_scores, upper_bound=max_clusters, SILENT=SILENT)
+		np.save("Labels.npy", labels)
+		manifest.record("clustering", [ "Labels.npy" ])
+	
+	# Files created from now on are recorded as outputs of the plots stage
+	before_plots = set(os.listdir(output_dir))
 	
 	
 	# Print information about found clusters:
@@ -1472,8 +2266,11 @@ def pipeline(args):
 	colored_clusters = color_clusters( score_matrix, labels )
 	
 	# Save the type the glitch belongs to in the "type" attribute
-	for index, spike in enumerate(data_list):
-		spike.type = labels[index]
+	if ( ANALYSIS == "time" ):
+		database.set_types(labels)
+	else:
+		for index, spike in enumerate(data_list):
+			spike.type = labels[index]
 	
 	print_cluster_info(colored_clusters)	
 	
@@ -1636,13 +2433,12 @@ def pipeline(args):
 	if "time" in ANALYSIS:
 		start_time = times[0][0]
 		end_time = times[-1][1]
-		global glitchgram_start, glitchgram_end
 		if glitchgram_start and glitchgram_end:
-			plot_glitchgram(data_list, times, glitchgram_start, glitchgram_end, HIGH_PASS_CUTOFF, sampling, labels)
+			plot_glitchgram(data_list, times, glitchgram_start, glitchgram_end, HIGH_PASS_CUTOFF, sampling, labels, segment_table=segment_table)
 			for segments in times:
-				plot_glitchgram(data_list, [segments], segments[0], segments[1], HIGH_PASS_CUTOFF, sampling, labels, name="Glitchgram_{0}-{1}".format(segments[0], segments[1]))
+				plot_glitchgram(data_list, [segments], segments[0], segments[1], HIGH_PASS_CUTOFF, sampling, labels, name="Glitchgram_{0}-{1}".format(segments[0], segments[1]), segment_table=segment_table)
 		else:
-			plot_glitchgram(data_list, times, start_time, end_time, HIGH_PASS_CUTOFF, sampling, labels)
+			plot_glitchgram(data_list, times, start_time, end_time, HIGH_PASS_CUTOFF, sampling, labels, segment_table=segment_table)
 	
 	# If time-domain analysis, create a folder, with subfolders for each
 	# type, to save the transient's time series
@@ -1668,9 +2464,15 @@ def pipeline(args):
 			plot_psds(data_list, (score_matrix, principal_components, means, stds), components_number, labels, sampling, ANALYSIS, RECONSTRUCT, SILENT)
 	print ""
 	
-	# Dump the database to a pickle file
-	pickle_dump(data_list, database_name)
+	# Save the database. For time-domain analysis it has already been
+	# saved, only the types have to be updated.
+	if ( ANALYSIS == "time" ):
+		database.save_metadata()
+	else:
+		# The waveforms are the log10 of the PSDs
+		SpikeDatabase.from_spikes(data_list, log_waveforms=True).save(database_name)
 	print "\tSaved {0}".format(database_name)
+	manifest.record("plots", sorted(set(os.listdir(output_dir))-before_plots))
 	
 	# Analysis finished. Print output URL	
 	print "#"*int(0.8*frame_width)
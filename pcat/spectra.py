@@ -0,0 +1,129 @@
+# encoding: utf-8
+'''
+spectra.py
+
+Spectral store used by frequency-domain analyses.
+
+PSDs are computed once for each segment of an interval, at the finest
+resolution which is going to be analyzed (the 'base' resolution), and saved
+in the processing directory of the interval. Analyses with a coarser
+resolution (-v) are derived from the stored PSDs by averaging the power of
+the neighbouring bins (see `pcat.condition.aggregate_psd`), band analyses
+(--low/--high) select their bins from the derived PSDs: later runs on the
+same interval do not read data again.
+
+	store = SpectralStore(processing_directory, 0.5, psd_overlap)
+	PSD = store.psd(start, end, f_sampl, resolution)	# None if not stored
+	if PSD is None:
+		PSD = store.aggregate(store.compute(time_series), f_sampl, resolution)
+
+The store is a directory (named after the base resolution and the overlap
+used by Welch's method) containing one .npy file per segment:
+	spectra-0.50_Hz-overlap_50/
+		start-end.npy		->	PSD of the segment from 'start' to 'end'
+								(GPS times) at the base resolution.
+
+Contains:
+	- SpectralStore
+'''
+
+import os
+
+import numpy as np
+
+from pcat.condition import compute_psd, aggregate_psd
+
+
+class SpectralStore:
+	'''
+	Per-interval store of segment PSDs, see the module docstring.
+
+	Attributes:
+		directory		->	Directory containing the stored PSDs
+		resolution		->	Base resolution (Hz) of the stored PSDs
+		overlap			->	Overlap between the windows used to compute
+							the PSDs (fraction of the window length)
+	'''
+
+	def __init__(self, processing_directory, resolution, overlap):
+		self.resolution = float(resolution)
+		self.overlap = float(overlap)
+		self.directory = os.path.join(processing_directory,
+					"spectra-{0:.2f}_Hz-overlap_{1:g}/".format(self.resolution, 100*self.overlap))
+		if not os.path.isdir(self.directory):
+			try:
+				os.makedirs(self.directory)
+			except OSError:
+				# Created by another process
+				pass
+
+	def file_name(self, start, end):
+		'''
+		Name of the file containing the PSD of the segment from 'start' to
+		'end'.
+		'''
+		return os.path.join(self.directory, "{0}-{1}.npy".format(int(start), int(end)))
+
+	def contains(self, start, end):
+		'''
+		True if the PSD of the segment has been stored.
+		'''
+		return os.path.isfile(self.file_name(start, end))
+
+	def load(self, start, end, f_sampl):
+		'''
+		Returns the stored PSD of the segment at the base resolution, None
+		if it has not been stored (or it was computed with a different
+		sampling frequency).
+		'''
+		try:
+			PSD = np.load(self.file_name(start, end))
+		except (IOError, ValueError):
+			return None
+		if ( len(PSD) != int(f_sampl/self.resolution)//2+1 ):
+			return None
+		return PSD
+
+	def save(self, start, end, PSD):
+		'''
+		Stores the PSD (at the base resolution) of the segment.
+		'''
+		# Write to a temporary file and rename it, so that other processes
+		# never load a partially written PSD
+		file_name = self.file_name(start, end)
+		with open(file_name + ".tmp", "wb") as f:
+			np.save(f, PSD)
+		os.rename(file_name + ".tmp", file_name)
+
+	def compute(self, time_series):
+		'''
+		Computes the PSD of the time series (as returned by
+		`pcat.data.retrieve_timeseries`, with the 'start' and 'end' GPS
+		times of the segment) at the base resolution, stores and returns it.
+		'''
+		freqs, PSD = compute_psd(time_series['waveform'], resolution=self.resolution,
+								f_sampl=time_series['fs'], overlap=self.overlap)
+		self.save(time_series['start'], time_series['end'], PSD)
+		return PSD
+
+	def aggregate(self, PSD, f_sampl, resolution):
+		'''
+		Derives the PSD with the given resolution (as used by compute_psd())
+		from a PSD at the base resolution.
+		'''
+		NFFT = int(f_sampl/resolution)
+		base_NFFT = int(f_sampl/self.resolution)
+		if ( NFFT == base_NFFT ):
+			return PSD
+		assert NFFT < base_NFFT, "Resolution finer than the store resolution"
+		return aggregate_psd(PSD, f_sampl, NFFT, base_NFFT)[1]
+
+	def psd(self, start, end, f_sampl, resolution):
+		'''
+		Returns the PSD of the segment with the given resolution, derived
+		from the stored PSD, None if the segment has not been stored.
+		'''
+		PSD = self.load(start, end, f_sampl)
+		if PSD is None:
+			return None
+		return self.aggregate(PSD, f_sampl, resolution)
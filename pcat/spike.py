@@ -23,10 +23,20 @@ The Spike class is used to store the information about a spike, such as amplitud
 		spike.type				->	Type
 		spike.peak_frequency	->	Peak frequency
 		spike.central_freq		->	Central Frequency
-		spike.fft				->	Fourier Transform of the glitch (dimensional)
-		spike.psd				->	Power Spectral Density (PSD) of the glitch (np.abs(fft)**2)
-		spike.fft_freq			->	Fourier Transform frequencies
-		spike.segment_psd		->	PSD of the (whitened) segment from which the glitch was extracted.
+		spike.psd				->	Power Spectral Density (PSD) of the glitch (np.abs(fft)**2),
+									computed from the waveform when first accessed
+		spike.reconstructed		->	Waveform reconstructed from the first
+									spike.PCs_used principal components
+		spike.segment_index		->	Index of the segment from which the glitch was
+									extracted in a SegmentTable (see below)
+	
+	The PSD of the segment and the Fourier Transform frequencies are shared
+	by all the glitches found in the same segment, they are stored once per
+	segment in a SegmentTable:
+		table.segment_psd(spike)	->	PSD of the segment from which the
+										glitch was extracted (for whitened
+										data, the PSD used for whitening).
+		table.fft_freq(spike)		->	Fourier Transform frequencies
 		
 	
 	For frequency domain analysis:
@@ -45,9 +55,63 @@ The Spike class is used to store the information about a spike, such as amplitud
 import matplotlib.mlab
 import numpy as np
 
-class Spike:
+from pcat import fft_backend
+
+# Hann windows (and their normalization) already computed, by length
+_windows = {}
+
+def hanning_window(length):
+	'''
+	Returns (window, normalization) for a Hann window 'length' points long,
+	normalization being (window**2).sum()/length.
+	Windows are computed once and shared: the returned array is read-only.
+	'''
+	if length not in _windows:
+		window = np.hanning(length)
+		window.flags.writeable = False
+		_windows[length] = ( window, np.sum(window**2)/float(length) )
+	return _windows[length]
+
+
+def transient_psd(waveforms, f_sampl):
+	'''
+	One-sided PSD of a transient (or of all the rows of a 2-D array of
+	transients), with a 1 Hz resolution: waveforms are Hann-windowed and
+	zero-padded to int(f_sampl) points.
+	'''
+	delta_t = 1.0/f_sampl
+	width = np.shape(waveforms)[-1]
+	window, window_norm = hanning_window(width)
 	
-	def __init__(self, start, end, peak, norm, peak_GPS, segment_start, segment_end, waveform, sampling_frequency):
+	# Factor of two in psd because rfft is one sided.
+	psd = 2 * 1.0/window_norm * np.abs(delta_t*fft_backend.rfft(waveforms*window, n=int(f_sampl), axis=-1))**2
+	psd[..., 0] /= 2.0
+	return psd
+
+
+class Spike(object):
+	'''
+	Record for a transient, see the module docstring for the attributes.
+	
+	The attributes are fixed (__slots__), optional attributes (e.g. SNR,
+	type) are not defined until they are set.
+	Heavy attributes are materialized only when needed:
+		- spike.psd is computed from the waveform on first access (and
+		  cached) unless it has been set.
+		- spike.reconstructed can refer to a row of a shared matrix with the
+		  reconstructed (normalized) waveforms, see set_reconstruction().
+	
+	Spikes from databases saved by older versions of PCAT can still be
+	unpickled, attributes which are no longer part of the record (e.g.
+	fft_freq, segment_psd) are kept and are still readable.
+	'''
+	__slots__ = ( 'start', 'end', 'peak', 'norm', 'width', 'peak_GPS',
+					'segment_start', 'segment_end', 'waveform', 'len', 'sampling',
+					'duration', 'SNR', 'polarity', 'type', 'segment_index',
+					'peak_frequency', 'central_freq', 'PCs_used',
+					'_psd', '_reconstructed', '_reconstruction', '_extra' )
+	
+	def __init__(self, start=0, end=0, peak=0, norm=1.0, peak_GPS=0, segment_start=0, segment_end=0, waveform=(), sampling_frequency=0):
 		self.start = start
 		self.end = end
 		self.peak = peak
@@ -60,7 +124,100 @@ class Spike:
 		self.len = len(self.waveform)
 		self.sampling = sampling_frequency
 		self.duration = (end-start)*sampling_frequency
-        
+		self._init_heavy()
+	
+	def _init_heavy(self):
+		self._psd = None
+		self._reconstructed = None
+		self._reconstruction = None
+		self._extra = None
+	
+	@property
+	def psd(self):
+		'''
+		PSD of the transient, computed on first access through
+		transient_psd().
+		'''
+		if self._psd is None:
+			self._psd = transient_psd(np.asarray(self.waveform), self.sampling)
+		return self._psd
+	
+	@psd.setter
+	def psd(self, psd):
+		self._psd = psd
+	
+	def has_psd(self):
+		'''
+		True if the PSD has already been set or computed.
+		'''
+		return self._psd is not None
+	
+	@property
+	def reconstructed(self):
+		'''
+		Waveform reconstructed using the first spike.PCs_used principal
+		components (see `pcat.gmm.spike_time_series`)
+		'''
+		if self._reconstruction is not None:
+			matrix, index = self._reconstruction
+			return matrix[index]*self.norm
+		if self._reconstructed is None:
+			raise AttributeError("reconstructed")
+		return self._reconstructed
+	
+	@reconstructed.setter
+	def reconstructed(self, reconstructed):
+		self._reconstruction = None
+		self._reconstructed = reconstructed
+	
+	def set_reconstruction(self, matrix, index, components_number):
+		'''
+		The reconstructed waveform is matrix[index]*spike.norm, matrix being
+		the (normalized) reconstructed data matrix, shared by all the spikes.
+		'''
+		self._reconstructed = None
+		self._reconstruction = (matrix, index)
+		self.PCs_used = components_number
+	
+	def __getattr__(self, name):
+		# Only called when 'name' is not set: look for attributes
+		# from older versions of the class.
+		try:
+			extra = object.__getattribute__(self, '_extra')
+		except AttributeError:
+			raise AttributeError(name)
+		if extra and ( name in extra ):
+			return extra[name]
+		raise AttributeError(name)
+	
+	def __getstate__(self):
+		state = {}
+		for name in self.__slots__:
+			if name.startswith("_"):
+				continue
+			try:
+				state[name] = object.__getattribute__(self, name)
+			except AttributeError:
+				pass
+		# Shared matrices are not pickled, only the spike's row
+		if self._psd is not None:
+			state['psd'] = self._psd
+		if ( self._reconstruction is not None ) or ( self._reconstructed is not None ):
+			state['reconstructed'] = self.reconstructed
+		if self._extra:
+			state.update(self._extra)
+		return state
+	
+	def __setstate__(self, state):
+		self._init_heavy()
+		for name, value in state.iteritems():
+			if ( name in self.__slots__ ) or ( name in ( 'psd', 'reconstructed' ) ):
+				setattr(self, name, value)
+			else:
+				if self._extra is None:
+					self._extra = {}
+				self._extra[name] = value
+	
 	def __str__(self):
 		'''
 		String reprentation of the spike (segment_start, segment_end, spike_start, 
@@ -68,4 +225,82 @@ class Spike:
 		'''
 		return str(self.segment_start)+"\t"+str(self.segment_end)+"\t"+str(self.start)+"\t"\
 				+str(self.end)+"\t"+str(self.peak_GPS)+"\t"
-	
\ No newline at end of file
+
+
+class SegmentTable:
+	'''
+	Per-segment table for the segment PSDs and the frequency grids used
+	by the Spike() instances found in those segments.
+	Spikes only store an index into the table (spike.segment_index), each
+	segment PSD is stored once and identical frequency grids are stored
+	only once for the whole table.
+	
+		table = SegmentTable()
+		index = table.add(segment_start, segment_end, segment_psd, freqs)
+		
+		table.segment_psd(spike), table.fft_freq(spike)
+	
+	Tables built by different processes are combined with merge(), which
+	also updates the indexes of the given spikes.
+	'''
+	
+	def __init__(self):
+		# One element per segment
+		self.segments = []
+		self.psds = []
+		self.freqs_index = []
+		# Unique frequency grids
+		self.freqs = []
+	
+	def __len__(self):
+		return len(self.psds)
+	
+	def add_freqs(self, freqs):
+		'''
+		Returns the index of 'freqs' in the frequency grids of the table,
+		adding it if it is not yet stored.
+		'''
+		for index, element in enumerate(self.freqs):
+			if ( element.size == freqs.size ) and np.array_equal(element, freqs):
+				return index
+		self.freqs.append(freqs)
+		return len(self.freqs)-1
+	
+	def add(self, segment_start, segment_end, psd, freqs):
+		'''
+		Adds a segment to the table and returns its index (to be saved in
+		spike.segment_index)
+		'''
+		self.segments.append((segment_start, segment_end))
+		self.psds.append(psd)
+		self.freqs_index.append(self.add_freqs(freqs))
+		return len(self.psds)-1
+	
+	def merge(self, other, spikes=[]):
+		'''
+		Appends the segments in 'other' (a SegmentTable) to the table.
+		The segment_index attribute of the Spike() instances in 'spikes',
+		which should refer to 'other', is updated to refer to the table.
+		
+		Returns the offset added to the indexes.
+		'''
+		offset = len(self.psds)
+		freqs_map = [ self.add_freqs(freqs) for freqs in other.freqs ]
+		self.segments.extend(other.segments)
+		self.psds.extend(other.psds)
+		self.freqs_index.extend( [ freqs_map[index] for index in other.freqs_index ] )
+		for spike in spikes:
+			spike.segment_index += offset
+		return offset
+	
+	def segment_psd(self, spike):
+		'''
+		PSD of the segment from which 'spike' was extracted.
+		'''
+		return self.psds[spike.segment_index]
+	
+	def fft_freq(self, spike):
+		'''
+		Frequencies for both spike.psd and the segment PSD.
+		'''
+		return self.freqs[self.freqs_index[spike.segment_index]]
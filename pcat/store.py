@@ -0,0 +1,183 @@
+# encoding: utf-8
+'''
+store.py
+
+Appendable store for the conditioned outputs of the segments of an
+interval.
+
+Instead of one (or more) small files per segment, each process appends the
+arrays of the segments it conditions to its own chunk file, and records
+their GPS start and end times, names, types, shapes and offsets in an index
+file next to it. A store is a directory containing:
+	<host>-<pid>-<n>.chunk		->	Arrays, one after the other.
+	<host>-<pid>-<n>.index		->	One INDEX_DTYPE record per array in the
+									chunk, written after the array.
+A chunk is closed once it is larger than chunk_bytes and a new one is
+started. Processes never write to the same chunk, so no locking is needed,
+and readers only see arrays whose record has been written.
+
+	store = SegmentStore(processing_directory + conditioned_folder)
+	arrays = store.get(start, end)		# memory-mapped arrays (or None)
+	if arrays is None:
+		store.append(start, end, {'conditioned': conditioned, 'psd': psd})
+
+The index of all the chunks is read when the store is opened (see
+refresh()), lookups do not access the file system.
+
+Contains:
+	- INDEX_DTYPE, STORE_CHUNK_BYTES
+	- SegmentStore
+'''
+
+import os
+import socket
+from glob import glob
+
+import numpy as np
+
+
+INDEX_DTYPE = np.dtype([	('start', np.int64), ('end', np.int64),
+							('name', 'S32'), ('dtype', 'S8'),
+							('ndim', np.int8), ('shape', np.int64, (2,)),
+							('offset', np.int64) ])
+
+# Size after which a new chunk is started
+STORE_CHUNK_BYTES = 2**30
+
+# Arrays in the chunks start at multiples of STORE_ALIGNMENT bytes
+STORE_ALIGNMENT = 64
+
+
+class SegmentStore:
+	'''
+	Appendable store of the arrays of the segments of an interval, see the
+	module docstring.
+
+	Attributes:
+		directory		->	Directory containing the chunks
+		chunk_bytes		->	Size after which a new chunk is started
+	'''
+
+	def __init__(self, directory, chunk_bytes=STORE_CHUNK_BYTES):
+		self.directory = directory
+		self.chunk_bytes = chunk_bytes
+		if not os.path.isdir(directory):
+			try:
+				os.makedirs(directory)
+			except OSError:
+				# Created by another process
+				pass
+		# Chunk and index files this process is writing to
+		self._chunk = None
+		self._index = None
+		self._chunk_name = None
+		# Memory maps of the chunks, by name
+		self._maps = {}
+		self.refresh()
+
+	def refresh(self):
+		'''
+		Reads the index of all the chunks (e.g. to see segments appended by
+		other processes).
+		'''
+		# { (start, end): { name: (chunk_name, record) } }
+		self._entries = {}
+		for index_name in sorted(glob(os.path.join(self.directory, "*.index"))):
+			chunk_name = os.path.splitext(index_name)[0] + ".chunk"
+			with open(index_name, "rb") as f:
+				data = f.read()
+			# Skip a record which is still being written
+			data = data[:len(data)-len(data) % INDEX_DTYPE.itemsize]
+			for record in np.frombuffer(data, dtype=INDEX_DTYPE):
+				self._add_entry(chunk_name, record)
+
+	def _add_entry(self, chunk_name, record):
+		key = ( int(record['start']), int(record['end']) )
+		self._entries.setdefault(key, {})[record['name']] = ( chunk_name, record )
+
+	def __len__(self):
+		return len(self._entries)
+
+	def segments(self):
+		'''
+		Sorted list of the (start, end) GPS times of the stored segments.
+		'''
+		return sorted(self._entries)
+
+	def contains(self, start, end):
+		'''
+		True if arrays have been stored for the segment.
+		'''
+		return ( int(start), int(end) ) in self._entries
+
+	def _map(self, chunk_name, size):
+		# Memory map of the chunk, mapped again if it has grown past the
+		# mapped size
+		if ( chunk_name not in self._maps ) or ( len(self._maps[chunk_name]) < size ):
+			self._maps[chunk_name] = np.memmap(chunk_name, dtype=np.uint8, mode='r')
+		return self._maps[chunk_name]
+
+	def get(self, start, end):
+		'''
+		Returns a dictionary with the (read-only, memory-mapped) arrays
+		stored for the segment, None if the segment has not been stored.
+		'''
+		key = ( int(start), int(end) )
+		if key not in self._entries:
+			return None
+		arrays = {}
+		for name, ( chunk_name, record ) in self._entries[key].iteritems():
+			dtype = np.dtype(record['dtype'])
+			shape = tuple(record['shape'][:record['ndim']])
+			size = int(record['offset']) + dtype.itemsize*int(np.prod(shape))
+			arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self._map(chunk_name, size),
+										offset=int(record['offset']))
+		return arrays
+
+	def _open_chunk(self):
+		# Start a new chunk, named after the host and the process
+		prefix = os.path.join(self.directory, "{0}-{1}-".format(socket.gethostname(), os.getpid()))
+		number = 0
+		while os.path.exists("{0}{1}.chunk".format(prefix, number)):
+			number += 1
+		self.close()
+		self._chunk_name = "{0}{1}.chunk".format(prefix, number)
+		self._chunk = open(self._chunk_name, "wb")
+		self._index = open("{0}{1}.index".format(prefix, number), "wb")
+
+	def append(self, start, end, arrays):
+		'''
+		Stores the arrays (a dictionary of arrays with at most 2
+		dimensions, by name) of the segment from 'start' to 'end'.
+		'''
+		if ( self._chunk is None ) or ( self._chunk.tell() >= self.chunk_bytes ):
+			self._open_chunk()
+		records = np.zeros(len(arrays), dtype=INDEX_DTYPE)
+		for record, name in zip(records, sorted(arrays)):
+			array = np.ascontiguousarray(arrays[name])
+			assert array.ndim <= 2, "Only arrays with at most 2 dimensions can be stored"
+			# Align the array
+			padding = -self._chunk.tell() % STORE_ALIGNMENT
+			self._chunk.write("\0"*padding)
+			record['start'], record['end'] = start, end
+			record['name'] = name
+			record['dtype'] = array.dtype.str
+			record['ndim'] = array.ndim
+			record['shape'][:array.ndim] = array.shape
+			record['offset'] = self._chunk.tell()
+			self._chunk.write(array.tostring())
+		# Arrays are written before their records
+		self._chunk.flush()
+		self._index.write(records.tostring())
+		self._index.flush()
+		for record in records:
+			self._add_entry(self._chunk_name, record)
+
+	def close(self):
+		'''
+		Closes the chunk this process is writing to (if any).
+		'''
+		if self._chunk is not None:
+			self._chunk.close()
+			self._index.close()
+		self._chunk = self._index = self._chunk_name = None
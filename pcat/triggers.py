@@ -0,0 +1,110 @@
+# encoding: utf-8
+'''
+triggers.py
+
+Per-segment cache of the transients found in conditioned data.
+
+The transients found by find_spikes() (see `pcat.finder`) in each segment
+are stored in a SegmentStore (see `pcat.store`) inside the entry of the
+conditioning cache of the conditioned data (see `pcat.cache`), in a
+directory named after the hash of the parameters of the trigger finder:
+	<entry>/triggers-<key>/
+
+For each segment the store contains (segments without transients only have
+an empty 'spikes' array, so that they are not searched again):
+	spikes			->	TRIGGER_COLUMNS of the transients, one row each
+	waveforms		->	Waveforms of the transients, one row each
+	psds			->	PSDs of the transients, one row each
+	segment_psd		->	PSD of the segment (see `pcat.spike.SegmentTable`)
+	frequencies		->	Frequencies of the PSDs
+
+	cache = TriggerCache(conditioned_directory, trigger_parameters)
+	spikes = cache.get(start, end, f_sampl, segment_table)	# None if not stored
+	if spikes is None:
+		spikes = find_spikes(...)
+		cache.put(start, end, spikes, segment_table)
+
+Contains:
+	- TRIGGER_COLUMNS
+	- TriggerCache
+'''
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from pcat.spike import Spike
+from pcat.store import SegmentStore
+
+# Attributes of the transients saved in the 'spikes' array
+TRIGGER_COLUMNS = ( 'start', 'end', 'peak', 'norm', 'peak_GPS', 'SNR', 'polarity' )
+
+
+class TriggerCache:
+	'''
+	Per-segment cache of the transients found in conditioned data, see the
+	module docstring.
+
+	Attributes:
+		directory		->	Directory of the SegmentStore
+		key				->	Hash of the parameters of the trigger finder
+	'''
+
+	def __init__(self, conditioned_directory, parameters):
+		self.key = hashlib.sha1(json.dumps(parameters, sort_keys=True)).hexdigest()[:16]
+		self.directory = os.path.join(conditioned_directory, "triggers-{0}/".format(self.key))
+		self.store = SegmentStore(self.directory)
+
+	def contains(self, start, end):
+		'''
+		True if the segment has already been searched.
+		'''
+		return self.store.contains(start, end)
+
+	def get(self, start, end, f_sampl, segment_table):
+		'''
+		Returns the list of the Spike() instances found in the segment, None
+		if the segment has not been searched yet. The segment PSD is added
+		to segment_table.
+		'''
+		stored = self.store.get(start, end)
+		if stored is None:
+			return None
+		spikes = []
+		if ( len(stored['spikes']) == 0 ):
+			return spikes
+		segment_index = segment_table.add(int(start), int(end), np.array(stored['segment_psd']),
+											np.array(stored['frequencies']))
+		for row, waveform, psd in zip(stored['spikes'], stored['waveforms'], stored['psds']):
+			values = dict(zip(TRIGGER_COLUMNS, row))
+			spike = Spike(int(values['start']), int(values['end']), int(values['peak']),
+							values['norm'], values['peak_GPS'], int(start), int(end),
+							np.array(waveform), f_sampl)
+			spike.psd = np.array(psd)
+			spike.segment_index = segment_index
+			spike.SNR = values['SNR']
+			spike.polarity = int(values['polarity'])
+			spikes.append(spike)
+		return spikes
+
+	def put(self, start, end, spikes, segment_table):
+		'''
+		Stores the Spike() instances found in the segment (their segment
+		PSD is taken from segment_table).
+		'''
+		arrays = { 'spikes': np.array([ [ getattr(spike, name) for name in TRIGGER_COLUMNS ] for spike in spikes ],
+										dtype=np.float64).reshape(len(spikes), len(TRIGGER_COLUMNS)) }
+		if spikes:
+			arrays['waveforms'] = np.array([ spike.waveform for spike in spikes ], dtype=np.float64)
+			arrays['psds'] = np.array([ spike.psd for spike in spikes ], dtype=np.float64)
+			arrays['segment_psd'] = segment_table.segment_psd(spikes[0])
+			arrays['frequencies'] = segment_table.fft_freq(spikes[0])
+		self.store.append(start, end, arrays)
+
+	def close(self):
+		'''
+		Closes the store (see SegmentStore.close()).
+		'''
+		self.store.close()
@@ -16,9 +16,15 @@ brethil@phy.olemiss.edu
 
 DPI = 300
 
+# Largest denominator of the resampling ratios, see resampling_factors()
+RESAMPLING_MAX_DENOMINATOR = 2**16
+
 import os, sys
 import getopt
 import time
+import json
+import hashlib
+from shutil import rmtree
 from string import join
 from itertools import cycle
 from commands import getstatusoutput
@@ -34,7 +40,8 @@ import matplotlib.colors
 import matplotlib.pyplot as plt
 
 
-from scipy.signal import cheby1, firwin, lfilter, resample
+from scipy.signal import cheby1, firwin, lfilter, resample, resample_poly
+from fractions import Fraction
 
 from spike import *
 
@@ -197,9 +204,28 @@ def get_server_url():
 	return server
 
 
+# Anti-aliasing filters used by decimate(), by (q, n, ftype)
+_decimation_filters = {}
+
+def decimation_filter(q, n, ftype='iir'):
+	'''
+	Returns the (b, a) coefficients of the anti-aliasing filter used by
+	decimate(), designed once for each (q, n, ftype).
+	'''
+	if ( q, n, ftype ) not in _decimation_filters:
+		if ftype == 'fir':
+			b = firwin(n + 1, 1. / q, window='hamming')
+			a = 1.
+		else:
+			b, a = cheby1(n, 0.05, 0.8 / q)
+		_decimation_filters[( q, n, ftype )] = ( b, a )
+	return _decimation_filters[( q, n, ftype )]
+
+
 def decimate(x, q, n=None, ftype='iir', axis=-1):
 	'''
 	This code is copied from scipy.signal
+	The filter design is cached (see decimation_filter())
 		
 	Downsample the signal by using a filter.
 	By default, an order 8 Chebyshev type I filter is used.  A 30 point FIR
@@ -235,11 +261,7 @@ def decimate(x, q, n=None, ftype='iir', axis=-1):
 		else:
 			n = 8
 			
-	if ftype == 'fir':
-		b = firwin(n + 1, 1. / q, window='hamming')
-		a = 1.
-	else:
-		b, a = cheby1(n, 0.05, 0.8 / q)
+	b, a = decimation_filter(q, n, ftype)
 		
 	y = lfilter(b, a, x, axis=axis)
 	sl = [slice(None)] * y.ndim
@@ -247,6 +269,102 @@ def decimate(x, q, n=None, ftype='iir', axis=-1):
 	return y[sl]
 
 
+# FIR filters used by polyphase_resample(), by (up, down)
+_resampling_filters = {}
+
+def resampling_factors(f_sampl, resample_freq):
+	'''
+	Returns the (up, down) factors resampling from 'f_sampl' to
+	'resample_freq', i.e. resample_freq/f_sampl = up/down with up and down
+	coprime integers.
+	'''
+	ratio = Fraction(resample_freq/float(f_sampl)).limit_denominator(RESAMPLING_MAX_DENOMINATOR)
+	return ratio.numerator, ratio.denominator
+
+
+def resampling_filter(up, down):
+	'''
+	Returns the taps of the linear phase low pass FIR filter used by
+	polyphase_resample(), designed once for each (up, down) as in
+	scipy.signal.resample_poly (Kaiser window, cutoff at the lower of the
+	two Nyquist frequencies). The returned array is read-only.
+	'''
+	if ( up, down ) not in _resampling_filters:
+		max_rate = max(up, down)
+		half_length = 10*max_rate
+		taps = firwin(2*half_length+1, 1./max_rate, window=('kaiser', 5.0))
+		taps.flags.writeable = False
+		_resampling_filters[( up, down )] = taps
+	return _resampling_filters[( up, down )]
+
+
+def polyphase_resample(x, up, down):
+	'''
+	Resamples 'x' by the rational factor up/down with a polyphase FIR
+	filter (see scipy.signal.resample_poly), the filter taps are cached
+	(see resampling_filter()).
+	Unlike decimate(), the filter has zero phase and 'up/down' does not
+	have to be the inverse of an integer.
+	The output has ceil(len(x)*up/down) points.
+	'''
+	if ( up == down ):
+		return np.asarray(x)
+	return resample_poly(x, up, down, window=resampling_filter(up, down))
+
+
+class StreamingResampler:
+	'''
+	Polyphase resampling (see polyphase_resample()) of a stream of
+	contiguous (or overlapping) segments, in GPS order:
+	
+		resampler = StreamingResampler(f_sampl, resample_freq)
+		resampled = resampler.resample(time_series, start_sample)
+	
+	where start_sample is the GPS start time of the segment times f_sampl.
+	Each segment is resampled as with polyphase_resample(), but the
+	filter is run on the end of the previous segment as well, so
+	that the beginning of the segment is not affected by the transient
+	of the filter (the data before the segment is not assumed to be
+	zero). Only the last 'lookahead' points of the input are affected by
+	the transient at the end of the segment.
+	'''
+	
+	def __init__(self, f_sampl, resample_freq):
+		self.up, self.down = resampling_factors(f_sampl, resample_freq)
+		half_length = (len(resampling_filter(self.up, self.down))-1)//2
+		# Input points needed before the segment, a multiple of 'down' so
+		# that the output grid starts at the beginning of the segment
+		self.lookahead = -(-half_length//self.up)
+		self.history = -(-self.lookahead//self.down)*self.down
+		self.reset()
+	
+	def reset(self):
+		# Last segment and the index of its first point
+		self.previous = None
+		self.previous_start = None
+	
+	def resample(self, time_series, start_sample):
+		'''
+			Returns the resampled time series.
+		'''
+		start_sample = int(start_sample)
+		previous, previous_start = self.previous, self.previous_start
+		self.previous, self.previous_start = time_series, start_sample
+		if ( self.up == self.down ):
+			return np.asarray(time_series)
+		if ( previous is None ) or not ( previous_start <= start_sample-self.history < previous_start+len(previous) ):
+			# First segment, gap in the data or segment out of order
+			return polyphase_resample(time_series, self.up, self.down)
+		
+		offset = start_sample-self.history-previous_start
+		before = previous[offset:offset+self.history]
+		if ( len(before) < self.history ):
+			# The previous segment ends before this one starts
+			return polyphase_resample(time_series, self.up, self.down)
+		resampled = polyphase_resample(np.concatenate( (before, time_series) ), self.up, self.down)
+		return resampled[self.history*self.up//self.down:]
+
+
 def pickle_dump(data, file_name):
 	'''
 		Saves 'data' as a binary file named 'file_name'
@@ -269,7 +387,7 @@ def load_data(args, pickled):
 	input_data = list()
 	if pickled:
 		for index, element in enumerate(args):
-			f = open(element, "wb")
+			f = open(element, "rb")
 			input_data.append( pickle.load(f) )
 			f.close()
 	else:
@@ -323,7 +441,86 @@ def create_data_matrix(data_list, ANALYSIS, model_waveform=None):
 	
 
 	
-def create_data_matrix_from_psds(file_name_list, ANALYSIS, f_sampl, low=None, high=None):
+def psd_band(waveform_length, ANALYSIS, f_sampl, low=None, high=None):
+	'''
+		Slice of the PSD bins used by the analysis: the (contiguous) bins
+		from low to high Hz for band analyses, all the bins otherwise.
+		waveform_length is the number of bins in the PSDs.
+	'''
+	if ( "bands" in ANALYSIS ):
+		freq_array = rfftfreq( 2*(waveform_length-1), d=1./f_sampl )
+		return slice( np.searchsorted(freq_array, low, side='left'),
+						np.searchsorted(freq_array, high, side='right') )
+	return slice(0, waveform_length)
+
+
+def psd_file_times(file_name):
+	'''
+		GPS start and end times of the segment, from the name of the file
+		containing its PSD.
+	'''
+	( start, end ) = os.path.basename(file_name).split('.')[0].split('_')[-1].split('-')
+	return int(start), int(end)
+
+
+def stack_psds(file_name_list, stack_name):
+	'''
+		Stacks the PSDs saved (with np.save) in the files in file_name_list
+		into a single 2-D array, one PSD per row. The stack ('psds.npy')
+		and the names of the files ('names.npy') are saved together in a
+		directory named stack_name-<hash of the names>, which is written
+		under a temporary name, renamed when complete and never modified
+		afterwards, so that other processes never load a partial stack or
+		the names of another stack.
+		If a stack already contains all the files it is not created again,
+		stacks containing a subset of the files are removed.
+		
+		Returns the memory-mapped stack and the rows of the files.
+	'''
+	names = [ os.path.basename(file_name) for file_name in file_name_list ]
+	prefix = stack_name.rstrip("/")
+	directory, base = os.path.split(prefix)
+	subsets = []
+	for name in sorted(os.listdir(directory or ".")):
+		path = os.path.join(directory, name)
+		if not name.startswith(base + "-") or name.endswith(".tmp") or not os.path.isdir(path):
+			continue
+		try:
+			index = np.load(os.path.join(path, "names.npy"))
+			rows = dict( ( name, row ) for row, name in enumerate(index) )
+			if all( name in rows for name in names ):
+				stack = np.load(os.path.join(path, "psds.npy"), mmap_mode='r')
+				return stack, [ rows[name] for name in names ]
+			if set(rows).issubset(names):
+				subsets.append(path)
+		except (IOError, ValueError):
+			# Being removed by another process
+			pass
+	
+	path = "{0}-{1}".format(prefix, hashlib.sha1(json.dumps(names)).hexdigest()[:16])
+	tmp_name = "{0}.{1}.tmp".format(path, os.getpid())
+	if not os.path.isdir(tmp_name):
+		os.makedirs(tmp_name)
+	first = np.load(file_name_list[0], mmap_mode='r')
+	stack = np.lib.format.open_memmap(os.path.join(tmp_name, "psds.npy"), mode='w+', dtype=first.dtype, shape=(len(names), len(first)))
+	for row, file_name in enumerate(file_name_list):
+		stack[row] = np.load(file_name, mmap_mode='r')
+	stack.flush()
+	del stack
+	np.save(os.path.join(tmp_name, "names.npy"), np.array(names))
+	# The memory map stays valid if the directory is renamed or removed
+	stack = np.load(os.path.join(tmp_name, "psds.npy"), mmap_mode='r')
+	try:
+		os.rename(tmp_name, path)
+	except OSError:
+		# Created by another process (with the same files)
+		rmtree(tmp_name, ignore_errors=True)
+	for subset in subsets:
+		rmtree(subset, ignore_errors=True)
+	return stack, range(len(names))
+
+
+def create_data_matrix_from_psds(file_name_list, ANALYSIS, f_sampl, low=None, high=None, stack_name=None):
 	'''
 		Creates a list and a matrix from the input file names list
 		
@@ -333,53 +530,55 @@ def create_data_matrix_from_psds(file_name_list, ANALYSIS, f_sampl, low=None, hi
 		
 		This is used for band analysis in frequency-domain PCAT.
 		
+		PSDs are memory-mapped and only the bins in the slice are read (and
+		their log taken). If stack_name is given, the PSDs are read from a
+		single stacked array (see stack_psds()) instead of one file each.
+		
+		Files containing short-time PSDs (see --stft in pcat) give one
+		observation per window, with the GPS start and end times of the
+		window.
+		
 	'''
-	database = []
-	waveforms = []
+	if stack_name is not None:
+		stack, rows = stack_psds(file_name_list, stack_name)
+		band = psd_band(stack.shape[1], ANALYSIS, f_sampl, low, high)
+		# Slicing the memory-mapped stack does not read it: only the bins
+		# in the band of the selected rows are read
+		waveforms = np.log10( np.asarray(stack[:, band][rows]) )
+		times = [ psd_file_times(element) for element in file_name_list ]
+	else:
+		band = None
+		waveforms = []
+		times = []
+		for element in file_name_list:
+			loaded = np.load(element, mmap_mode='r')
+			if hasattr(loaded, "files"):
+				# Short-time PSDs, saved with np.savez
+				PSDs = loaded['psds']
+				times.extend( zip(loaded['start'], loaded['end']) )
+				loaded.close()
+			else:
+				PSDs = loaded[np.newaxis, :]
+				times.append( psd_file_times(element) )
+			if band is None:
+				band = psd_band(PSDs.shape[1], ANALYSIS, f_sampl, low, high)
+			waveforms.append( np.log10( np.asarray(PSDs[:, band]) ) )
+			del PSDs, loaded
+		waveforms = np.concatenate(waveforms)
 	
-	if ("bands" in ANALYSIS):
-		tmp = open(file_name_list[0])
-		tmp1 = np.load(tmp)
-		waveform_length = tmp1.size
-		tmp.close()
-		freq_array = rfftfreq( 2*(waveform_length-1), d=1./f_sampl )
-		# We can now select the correct values from the spectra
-		# by choosing only the values defined by the mask
-		mask = (freq_array>=low) & (freq_array<=high)
-	for index, element in enumerate(file_name_list):
-		f = open(element, "rb")
-		tmp = np.log10(np.load(f))
-		f.close()
-		# Cut the spectra to the defined interval if required:
-		if ( "bands" in ANALYSIS ):
-			tmp = tmp[mask]
-		waveforms.append(tmp)
-		
-		# This part is used to extract the name of the segment from the file 
-		# name the if is needed to correctly hand cases when
-		# files are in the same folder and when they are not (i.e. path to file 
-		# is given)
-		if ( "/" in element ):		# Different folder, Path to the file is 
-									#given
-			( start, end ) = element.split("/")[-1].split('.')[0].split('_')[-1].split('-')
-			start = int(start)
-			end = int(end)
-		else:					# Same folder, only file name is given
-			( start, end ) = element.split('.')[0].split('_')[-1].split('-')
-			start = int(start)
-			end = int(end)
-		
+	database = []
+	for row, ( start, end ) in enumerate(times):
 		normalization = 1.0
-		spike = Spike(int(start), int(end),
+		spike = Spike(start, end,
 						 0, normalization,
-						0, int(start), int(end),
-						tmp, f_sampl)
+						0, start, end,
+						waveforms[row], f_sampl)
 		database.append(spike)
-		
+	
+	# The data matrix is modified by PCA(), the spikes keep the PSDs
 	return database, np.array(waveforms)
 
 
-
 def nearest_power_of_two(number):
 	"Returns the nearest power of two less than 'number'"
 	i=1
@@ -401,7 +600,7 @@ def tformat(x, start_time):
 	return tick
 
 
-def plot_glitchgram(data, times, start_time, end_time, highpass_cutoff, f_sampl, labels, name="Glitchgram"):
+def plot_glitchgram(data, times, start_time, end_time, highpass_cutoff, f_sampl, labels, name="Glitchgram", segment_table=None):
 	"""
 	Plot a glitchgram of all the glitches in 'data' (a list of Spike() istances)
 	
@@ -409,6 +608,10 @@ def plot_glitchgram(data, times, start_time, end_time, highpass_cutoff, f_sampl,
 	
 	start_time and end_time are the earliest and the latest GPS times
 	
+	segment_table is the SegmentTable() the glitches' segment_index refers to,
+	if None the frequencies are read from spike.fft_freq (databases saved
+	before segment tables were introduced).
+	
 	"""
 	DPI = 100
 	fig = plt.figure(figsize=(12,3*6), dpi=DPI)
@@ -438,7 +641,10 @@ def plot_glitchgram(data, times, start_time, end_time, highpass_cutoff, f_sampl,
 	for index, spike in enumerate(data):
 		time_axis.append(spike.peak_GPS)
 		
-		(PSD, freqs) =  spike.psd, spike.fft_freq
+		if segment_table is not None:
+			(PSD, freqs) = spike.psd, segment_table.fft_freq(spike)
+		else:
+			(PSD, freqs) = spike.psd, spike.fft_freq
 	
 		central_freq = (np.sum(PSD*freqs))/PSD.sum()
 		# Peak frequency is the frequency at which the PSD has a maximum (bad choice for parameter name)
@@ -696,6 +902,39 @@ def parmap(f, X, nprocs = multiprocessing.cpu_count()):
 	return [x for i,x in sorted(res)]
 	
 
+def available_memory():
+	'''
+		Memory (in bytes) available for new processes without swapping,
+		None if it cannot be determined.
+	'''
+	try:
+		with open("/proc/meminfo") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1])*1024
+	except IOError:
+		pass
+	try:
+		return os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+	except (ValueError, OSError, AttributeError):
+		return None
+
+
+def worker_processes(memory_per_process, max_processes=None):
+	'''
+		Number of worker processes to run: one per core (at most
+		max_processes), fewer if the available memory (see
+		available_memory()) cannot hold memory_per_process bytes for each.
+	'''
+	processes = multiprocessing.cpu_count()
+	if max_processes is not None:
+		processes = min(processes, max_processes)
+	memory = available_memory()
+	if ( memory is not None ) and ( memory_per_process > 0 ):
+		processes = min(processes, int(memory//memory_per_process))
+	return max(1, processes)
+
+
 ##### Stolen from Numpy 1.8, returns the frequencies vector
 ##### associated to the fourier transform obtained through
 #### np.fft.rfft